@@ -1,16 +1,32 @@
+import functools
 import os
-from flask import Flask as _Flask
-from flask_cors import CORS
-from flask_jwt_extended import JWTManager
-from flask_restful import Api
+import time
 
+# flask is imported when the web app is built, so parse workers importing app.* don't pay for it
 
-class Flask(_Flask):
-    pass
+
+@functools.lru_cache(maxsize=None)
+def _flask_class():
+    from flask import Flask as _Flask
+
+    class Flask(_Flask):
+        pass
+
+    return Flask
+
+
+def __getattr__(name):
+    if name == 'Flask':
+        return _flask_class()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 def create_app(config=None):
-    app = Flask(__name__)
+    from flask_cors import CORS
+    from flask_jwt_extended import JWTManager
+    from flask_restful import Api
+
+    app = _flask_class()(__name__)
     # load default configuration
     app.config.from_object('app.settings.FlaskConfig')
     # load environment configuration
@@ -25,4 +41,53 @@ def create_app(config=None):
     CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": "*"}})
     JWTManager(app)
     api = Api(app)
+    _init_metrics(app)
+    _init_heatmap(app)
     return app
+
+
+def _init_metrics(app):
+    """
+    time every request by endpoint and expose the metrics at /metrics
+    """
+    from flask import Response, g, request
+
+    from app.utils import metrics
+
+    @app.before_request
+    def start_timer():
+        if metrics.is_enabled():
+            g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            metrics.observe('http_request_seconds', time.perf_counter() - start,
+                            endpoint=request.endpoint or 'unknown', method=request.method,
+                            status=response.status_code)
+        return response
+
+    @app.route('/metrics')
+    def expose_metrics():
+        return Response(metrics.expose(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+def _init_heatmap(app):
+    """
+    serve the heatmap tiles at /heatmap/<z>/<x>/<y>.png
+    """
+    from flask import Response, abort
+
+    from app.settings import HEATMAP
+
+    @app.route('/heatmap/<int:z>/<int:x>/<int:y>.png')
+    def heatmap_tile(z, x, y):
+        from app.data.geographic.heatmap import HeatmapError, get_heatmap
+
+        try:
+            png = get_heatmap().png(z, x, y)
+        except HeatmapError:
+            abort(404)
+        return Response(png, content_type='image/png',
+                        headers={'Cache-Control': 'public, max-age=%d' % HEATMAP['MAX_AGE']})
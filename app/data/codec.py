@@ -0,0 +1,348 @@
+"""
+compact storage codec of activity records.
+
+records are cut into chunks, every chunk stores each field as an integer column: values are quantized by the
+field scale, delta encoded, zig-zag mapped and written as varints. text fields are dictionary encoded.
+chunks are compressed on their own and base64 encoded for the JSON based DB layer, so a single chunk can be
+decoded without touching the others
+
+    {'_codec': 'track/1', 'chunks': [{'count', 'start', 'end', 'compression', 'scales', 'data'}]}
+
+model internals (keys starting with `_`) are not stored, numbers are kept to the precision of their scale.
+every chunk records the scales it was written with, so changing TRACK_CODEC['SCALES'] leaves the stored tracks
+readable
+"""
+import base64
+import json
+import logging
+import math
+import zlib
+from typing import Dict, List
+
+import numpy as np
+
+from app.base.exceptions import PyrError
+from app.settings import TRACK_CODEC
+
+logger = logging.getLogger(__name__)
+
+CODEC = 'track/1'
+
+_NUMBER, _TEXT = 'number', 'text'
+# (part, key, kind), scales of the number fields are in TRACK_CODEC['SCALES']
+_FIELDS = (
+    ('coordinate', 'timestamp', _NUMBER),
+    ('coordinate', 'longitude', _NUMBER),
+    ('coordinate', 'latitude', _NUMBER),
+    ('coordinate', 'altitude', _NUMBER),
+    ('coordinate', 'datum', _TEXT),
+    ('coordinate', 'address', _TEXT),
+    ('coordinate', 'time', _TEXT),
+    ('physiologic', 'timestamp', _NUMBER),
+    ('physiologic', 'speed', _NUMBER),
+    ('physiologic', 'heart_rate', _NUMBER),
+    ('physiologic', 'power', _NUMBER),
+    ('physiologic', 'time', _TEXT),
+    ('environment', 'timestamp', _NUMBER),
+    ('environment', 'temperature', _NUMBER),
+    ('environment', 'gradient', _NUMBER),
+    ('environment', 'time', _TEXT),
+)
+_PARTS = ('coordinate', 'physiologic', 'environment')
+_KNOWN = {(part, key) for part, key, _ in _FIELDS}
+
+# states of a field in a record
+_ABSENT, _NONE, _VALUE = 0, 1, 2
+
+
+class CodecError(PyrError):
+    pass
+
+
+# integer columns
+
+def _zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << np.int64(1)) ^ (values >> np.int64(63))).view(np.uint64)
+
+
+def _unzigzag(values):
+    values = values.astype(np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def varint_encode(values) -> bytes:
+    """
+    LEB128 varints of unsigned integers
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if values.size == 0:
+        return b''
+    lengths = np.ones(values.size, dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    offsets = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max())):
+        mask = lengths > k
+        byte = ((values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)).astype(np.uint8)
+        byte[lengths[mask] > k + 1] |= 0x80
+        out[offsets[mask] + k] = byte
+    return out.tobytes()
+
+
+def varint_decode(data, count):
+    """
+    :return: uint64 array of the first `count` varints in data
+    """
+    if count == 0:
+        return np.empty(0, dtype=np.uint64)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf < 0x80)[:count]
+    if ends.size < count:
+        raise CodecError('expected %d varints, but got %d' % (count, ends.size))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    buf = buf[:ends[-1] + 1]
+    group = np.repeat(np.arange(count), ends - starts + 1)
+    shift = ((np.arange(buf.size) - starts[group]) * 7).astype(np.uint64)
+    return np.bitwise_or.reduceat((buf & 0x7f).astype(np.uint64) << shift, starts)
+
+
+def _pack(sections: List[bytes]) -> bytes:
+    return varint_encode([len(sections)] + [len(i) for i in sections]) + b''.join(sections)
+
+
+def _unpack(data: bytes) -> List[bytes]:
+    count = int(varint_decode(data, 1)[0])
+    header = varint_decode(data, count + 1)
+    offset = len(varint_encode(header))
+    ret = []
+    for size in header[1:].tolist():
+        ret.append(data[offset:offset + size])
+        offset += size
+    return ret
+
+
+# compression
+
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def compress(data, compression):
+    """
+    :return: (compressed data, compression used), zstd falls back to zlib when zstandard is not installed
+    """
+    if compression == 'zstd':
+        zstd = _zstd()
+        if zstd is not None:
+            return zstd.ZstdCompressor(level=TRACK_CODEC['LEVEL']).compress(data), 'zstd'
+        compression = 'zlib'
+    if compression == 'zlib':
+        return zlib.compress(data, TRACK_CODEC['LEVEL']), 'zlib'
+    return data, None
+
+
+def decompress(data, compression):
+    if compression == 'zstd':
+        zstd = _zstd()
+        if zstd is None:
+            raise CodecError('track chunk is zstd compressed, but zstandard is not installed')
+        return zstd.ZstdDecompressor().decompress(data)
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    return data
+
+
+# chunks
+
+def _encode_chunk(records: List[Dict], compression):
+    scales = dict(TRACK_CODEC['SCALES'])
+    count = len(records)
+    parts = np.zeros((len(_PARTS), count), dtype=np.uint8)
+    extra = []
+    sections = []
+    for p, part in enumerate(_PARTS):
+        for i, record in enumerate(records):
+            value = record.get(part)
+            if isinstance(value, dict):
+                parts[p, i] = _VALUE
+            elif part in record:
+                parts[p, i] = _NONE
+                if value is not None:
+                    extra.append([i, part, None, value])
+    sections.append(parts.tobytes())
+
+    for part, key, kind in _FIELDS:
+        states = np.zeros(count, dtype=np.uint8)
+        values = []
+        for i, record in enumerate(records):
+            data = record.get(part)
+            if not isinstance(data, dict) or key not in data:
+                continue
+            value = data[key]
+            if value is None:
+                states[i] = _NONE
+            elif kind == _NUMBER and isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and math.isfinite(value):
+                states[i] = _VALUE
+                values.append(value)
+            elif kind == _TEXT and isinstance(value, str):
+                states[i] = _VALUE
+                values.append(value)
+            else:
+                extra.append([i, part, key, value])
+        sections.append(states.tobytes())
+        if kind == _NUMBER:
+            quantized = np.round(np.asarray(values, dtype=np.float64) * scales[key]).astype(np.int64)
+            sections.append(varint_encode(_zigzag(np.diff(quantized, prepend=np.int64(0)))))
+        else:
+            dictionary, indices = np.unique(np.asarray(values, dtype=str), return_inverse=True) if values \
+                else (np.empty(0, dtype=str), np.empty(0, dtype=np.int64))
+            sections.append(json.dumps(dictionary.tolist(), ensure_ascii=False).encode('utf-8'))
+            sections.append(varint_encode(indices))
+
+    # fields out of the schema, except model internals
+    for i, record in enumerate(records):
+        for part, data in record.items():
+            if part not in _PARTS:
+                if not part.startswith('_'):
+                    extra.append([i, part, None, data])
+                continue
+            if isinstance(data, dict):
+                extra.extend([i, part, key, value] for key, value in data.items()
+                             if (part, key) not in _KNOWN and not key.startswith('_'))
+    sections.append(json.dumps(extra, ensure_ascii=False, default=str).encode('utf-8'))
+
+    timestamps = [record['coordinate']['timestamp'] for record in records
+                  if isinstance(record.get('coordinate'), dict)
+                  and isinstance(record['coordinate'].get('timestamp'), (int, float))]
+    data, compression = compress(_pack(sections), compression)
+    return {'count': count,
+            'start': min(timestamps) if timestamps else None,
+            'end': max(timestamps) if timestamps else None,
+            'compression': compression,
+            'scales': {key: scales[key] for part, key, kind in _FIELDS if kind == _NUMBER},
+            'data': base64.b64encode(data).decode('ascii')}
+
+
+def decode_chunk(chunk: Dict) -> List[Dict]:
+    count = chunk['count']
+    scales = chunk['scales']
+    sections = iter(_unpack(decompress(base64.b64decode(chunk['data']), chunk.get('compression'))))
+    parts = np.frombuffer(next(sections), dtype=np.uint8).reshape(len(_PARTS), count)
+    records = [{} for _ in range(count)]
+    for p, part in enumerate(_PARTS):
+        for i in np.flatnonzero(parts[p] == _VALUE).tolist():
+            records[i][part] = {}
+        for i in np.flatnonzero(parts[p] == _NONE).tolist():
+            records[i][part] = None
+
+    for part, key, kind in _FIELDS:
+        states = np.frombuffer(next(sections), dtype=np.uint8)
+        present = np.flatnonzero(states == _VALUE)
+        if kind == _NUMBER:
+            quantized = np.cumsum(_unzigzag(varint_decode(next(sections), present.size)))
+            scale = scales[key]
+            # whole numbers stay integers, e.g. the timestamps of FIT files
+            values = (quantized // scale).tolist() if not (quantized % scale).any() else (quantized / scale).tolist()
+        else:
+            dictionary = json.loads(next(sections).decode('utf-8'))
+            values = [dictionary[i] for i in varint_decode(next(sections), present.size).tolist()]
+        for i, value in zip(present.tolist(), values):
+            records[i][part][key] = value
+        for i in np.flatnonzero(states == _NONE).tolist():
+            records[i][part][key] = None
+
+    for i, part, key, value in json.loads(next(sections).decode('utf-8')):
+        if key is None:
+            records[i][part] = value
+        else:
+            records[i].setdefault(part, {})[key] = value
+    return records
+
+
+def encode_track(activity_records: List[Dict], chunk_size=TRACK_CODEC['CHUNK_SIZE'],
+                 compression=TRACK_CODEC['COMPRESSION']) -> Dict:
+    return {'_codec': CODEC,
+            'chunks': [_encode_chunk(activity_records[i:i + chunk_size], compression)
+                       for i in range(0, len(activity_records), chunk_size)]}
+
+
+class TrackEncoder:
+    """
+    encode a stream of records, only the chunk being filled is kept uncompressed
+    """
+
+    def __init__(self, chunk_size=TRACK_CODEC['CHUNK_SIZE'], compression=TRACK_CODEC['COMPRESSION']):
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self._records = []
+        self._chunks = []
+
+    def add(self, record: Dict):
+        self._records.append(record)
+        if len(self._records) >= self.chunk_size:
+            self._chunks.append(_encode_chunk(self._records, self.compression))
+            self._records = []
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def result(self) -> Dict:
+        if self._records:
+            self._chunks.append(_encode_chunk(self._records, self.compression))
+            self._records = []
+        return {'_codec': CODEC, 'chunks': self._chunks}
+
+
+def is_encoded(value):
+    return isinstance(value, dict) and value.get('_codec') == CODEC
+
+
+def decode_track(encoded, chunks=None) -> List[Dict]:
+    """
+    records of an encoded track, plain record lists are returned as they are
+    @:param chunks: indexes of the chunks to decode, all by default
+    """
+    if not is_encoded(encoded):
+        return encoded
+    selected = encoded['chunks'] if chunks is None else [encoded['chunks'][i] for i in chunks]
+    ret = []
+    for chunk in selected:
+        ret.extend(decode_chunk(chunk))
+    return ret
+
+
+def iter_track(encoded):
+    """
+    yield the records of a track chunk by chunk, plain record lists as they are
+    """
+    if not is_encoded(encoded):
+        yield from encoded or ()
+        return
+    for chunk in encoded['chunks']:
+        yield from decode_chunk(chunk)
+
+
+def find_chunks(encoded, start=None, end=None):
+    """
+    indexes of the chunks overlapping the time range, chunks without time are always included
+    """
+    ret = []
+    for i, chunk in enumerate(encoded['chunks']):
+        if chunk['start'] is None or ((end is None or chunk['start'] <= end) and
+                                      (start is None or chunk['end'] >= start)):
+            ret.append(i)
+    return ret
+
+
+def track_length(encoded):
+    return sum(chunk['count'] for chunk in encoded['chunks']) if is_encoded(encoded) else len(encoded)
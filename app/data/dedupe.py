@@ -0,0 +1,193 @@
+"""
+duplicate and near duplicate photos, by the content hash of the file and a perceptual hash of the EXIF thumbnail
+
+    index = get_photo_index()
+    index.find(sha1, phash)  # {'parse_id', 'exact', 'distance'} of the closest stored photo, or None
+    index.add(parse_id, sha1, phash)
+
+the perceptual hash is the sign of the low DCT frequencies of the thumbnail against their median, so the full
+image is never decoded. near duplicates are looked up by Hamming distance in a multi-index hash table. the hashes
+are stored in the photo_hash collection, every process keeps a table of them and loads the ones other processes
+added before each lookup
+"""
+import hashlib
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+from app.settings import DEDUPE
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(file, block=DEDUPE['HASH_BLOCK']):
+    """
+    sha1 of the whole content of a binary file object
+    """
+    digest = hashlib.sha1()
+    while True:
+        data = file.read(block)
+        if not data:
+            return digest.hexdigest()
+        digest.update(data)
+
+
+def _dct_matrix(size):
+    n = np.arange(size)
+    ret = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2 / size)
+    ret[0] /= np.sqrt(2)
+    return ret
+
+
+def _resize(pixels, size):
+    """
+    scale an image to size x size, by the mean of the pixels of each output pixel when it shrinks
+    """
+    for axis in (0, 1):
+        count = pixels.shape[axis]
+        if count >= size:
+            edges = np.arange(size) * count // size
+            counts = np.diff(np.append(edges, count))
+            pixels = np.add.reduceat(pixels, edges, axis=axis) / np.expand_dims(counts, 1 - axis)
+        else:
+            pixels = np.take(pixels, np.arange(size) * count // size, axis=axis)
+    return pixels
+
+
+def perceptual_hash(jpeg: bytes, size=DEDUPE['HASH_SIZE']):
+    """
+    size * size bit DCT hash of a JPEG image, None when the image can not be decoded
+    """
+    from app.parse.jpeg import JpegError, decode_luma
+
+    if not jpeg:
+        return None
+    sample = size * 4
+    try:
+        pixels = _resize(decode_luma(jpeg), sample)
+    except JpegError as err:
+        logger.debug('can not decode the thumbnail: %s' % err)
+        return None
+    dct = _dct_matrix(sample)
+    low = (dct @ pixels @ dct.T)[:size, :size].ravel()
+    # the DC term is the brightness, it stays out of the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class MultiIndexHash:
+    """
+    multi-index hashing of integer hashes for Hamming range search. the bits are split into radius + 1 parts,
+    a hash within `radius` of the query equals it in at least one part, so only the hashes sharing a part with
+    the query are compared instead of all of them
+    """
+
+    def __init__(self, bits=DEDUPE['HASH_SIZE'] ** 2, radius=DEDUPE['MAX_DISTANCE']):
+        self.bits = bits
+        self.radius = radius
+        parts = radius + 1
+        widths = [bits // parts + (1 if i < bits % parts else 0) for i in range(parts)]
+        self._parts = [(sum(widths[:i]), (1 << width) - 1) for i, width in enumerate(widths)]
+        self._tables = [{} for _ in self._parts]  # part value -> hashes
+        self._items = {}  # hash -> items
+
+    def __len__(self):
+        return sum(len(items) for items in self._items.values())
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._parts]
+
+    def add(self, value, item):
+        if value not in self._items:
+            for table, key in zip(self._tables, self._keys(value)):
+                table.setdefault(key, []).append(value)
+        self._items.setdefault(value, []).append(item)
+
+    def search(self, value, radius=None) -> List:
+        """
+        (distance, hash, items) within radius of value, closest first
+        """
+        radius = self.radius if radius is None else radius
+        if radius > self.radius:
+            candidates = self._items.keys()
+        else:
+            candidates = {i for table, key in zip(self._tables, self._keys(value)) for i in table.get(key, ())}
+        ret = [(hamming(value, i), i, self._items[i]) for i in candidates]
+        return sorted((i for i in ret if i[0] <= radius), key=lambda i: i[0])
+
+
+class PhotoIndex:
+    def __init__(self, db=None, max_distance=DEDUPE['MAX_DISTANCE']):
+        self.max_distance = max_distance
+        self._db = db
+        self._table = MultiIndexHash(radius=max_distance)
+        self._sha1 = {}  # sha1 -> parse id
+        self._known = set()
+        self._synced = None  # creation time of the last hash loaded
+
+    @property
+    def db(self):
+        if self._db is None:
+            from app.utils.mongodb import mongodb
+
+            self._db = mongodb
+            self._db.create_index(self._db.Collections.PHOTO_HASH, 'sha1')
+            self._db.create_index(self._db.Collections.PHOTO_HASH, '_db_created_time')
+        return self._db
+
+    def _remember(self, parse_id, sha1, phash):
+        if parse_id in self._known:
+            return
+        self._known.add(parse_id)
+        self._sha1.setdefault(sha1, parse_id)
+        if phash is not None:
+            self._table.add(phash, parse_id)
+
+    def sync(self):
+        """
+        load the hashes stored since the last sync, by this or another process
+        """
+        condition = {} if self._synced is None else {'_db_created_time': {'$gte': self._synced}}
+        for document in self.db.iterate(self.db.Collections.PHOTO_HASH, condition,
+                                        {'parse_id': True, 'sha1': True, 'phash': True, '_db_created_time': True}):
+            phash = document.get('phash')
+            self._remember(document['parse_id'], document['sha1'], int(phash, 16) if phash else None)
+            created = document.get('_db_created_time')
+            if created is not None and (self._synced is None or created > self._synced):
+                self._synced = created
+
+    def find(self, sha1, phash=None) -> Dict:
+        """
+        the stored photo with the same content, or else the one with the closest thumbnail within max_distance
+        :return: {'parse_id', 'exact', 'distance'}, None when there is none
+        """
+        self.sync()
+        if sha1 in self._sha1:
+            return {'parse_id': self._sha1[sha1], 'exact': True, 'distance': 0}
+        if phash is None:
+            return None
+        found = self._table.search(phash)
+        if not found:
+            return None
+        distance, _, parse_ids = found[0]
+        return {'parse_id': parse_ids[0], 'exact': False, 'distance': distance}
+
+    def add(self, parse_id, sha1, phash=None):
+        self.db.insert(self.db.Collections.PHOTO_HASH,
+                       {'parse_id': parse_id, 'sha1': sha1, 'phash': '%x' % phash if phash is not None else None})
+        self._remember(parse_id, sha1, phash)
+
+
+_photo_index = None
+
+
+def get_photo_index() -> PhotoIndex:
+    global _photo_index
+    if _photo_index is None:
+        _photo_index = PhotoIndex()
+    return _photo_index
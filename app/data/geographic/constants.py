@@ -2,6 +2,20 @@ COORDINATE_SYSTEM_WGS84 = 'WGS84'
 COORDINATE_SYSTEM_MARS = 'GCJ02'
 COORDINATE_SYSTEM_BD09 = 'BD09'
 COORDINATE_SYSTEM_GCJ02 = 'GCJ02'
+COORDINATE_SYSTEMS = (COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_BD09)
 
 LATITUDE_RANGE = (-90, 90)
 LONGITUDE_RANGE = (-180, 180)
+
+# rough mainland China bounding box, GCJ-02 offsets are only applied inside it
+CHINA_LATITUDE_RANGE = (0.8293, 55.8271)
+CHINA_LONGITUDE_RANGE = (72.004, 137.8347)
+
+# Krasovsky 1940 ellipsoid used by GCJ-02
+KRASOVSKY_SEMI_MAJOR_AXIS = 6378245.0
+KRASOVSKY_ECCENTRICITY_SQUARED = 0.00669342162296594323
+
+GCJ02_INVERSE_MAX_ITERATIONS = 30
+GCJ02_INVERSE_TOLERANCE = 1e-9  # in degree, about 0.1 mm
+
+EARTH_RADIUS = 6371008.8  # mean radius in meter
@@ -0,0 +1,192 @@
+import json
+import os
+from collections import OrderedDict
+from typing import List, Dict
+
+import numpy as np
+
+from app.data.geographic.constants import COORDINATE_SYSTEM_WGS84, EARTH_RADIUS
+from app.data.geographic.transform import transform
+from app.settings import GEOCODING
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy is optional, fall back to brute force nearest search
+    cKDTree = None
+
+_STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+_CITY_DISTRICT_NAMES = ('市辖区', '县', '省直辖县级行政区划', '自治区直辖县级行政区划')
+_BRUTE_FORCE_CHUNK = 4096
+
+
+def _to_unit_vectors(longitude, latitude):
+    """
+    points on the unit sphere, the euclidean distance between them grows with the great circle distance
+    """
+    lng = np.radians(np.asarray(longitude, dtype=np.float64))
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)], axis=-1)
+
+
+class Gazetteer:
+    """
+    administrative places with the coordinate of their seat,
+    built from province.json and city.json and the WGS84 coordinates in centroid.json
+    """
+
+    def __init__(self, static_root=_STATIC_ROOT):
+        with open(os.path.join(static_root, 'province.json'), 'r', encoding='utf-8') as file:
+            provinces = {item['id']: item['name'] for item in json.load(file)}
+        with open(os.path.join(static_root, 'city.json'), 'r', encoding='utf-8') as file:
+            cities = {item['id']: dict(item, province_id=province_id)
+                      for province_id, items in json.load(file).items() for item in items}
+        with open(os.path.join(static_root, 'centroid.json'), 'r', encoding='utf-8') as file:
+            centroids = json.load(file)
+
+        self.places = []
+        positions = []
+        for place_id, (longitude, latitude) in centroids.items():
+            if place_id in cities:
+                city = cities[place_id]
+                place = {'id': place_id, 'province_id': city['province_id'], 'province': city['province'],
+                         'city': None if city['name'] in _CITY_DISTRICT_NAMES else city['name']}
+            elif place_id in provinces:
+                place = {'id': place_id, 'province_id': place_id, 'province': provinces[place_id], 'city': None}
+            else:
+                continue
+            place['address'] = place['province'] + (place['city'] or '')
+            self.places.append(place)
+            positions.append((longitude, latitude))
+
+        positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+        self._vectors = _to_unit_vectors(positions[:, 0], positions[:, 1])
+        self._tree = cKDTree(self._vectors) if cKDTree is not None and len(self.places) > 0 else None
+
+    def nearest(self, longitude, latitude):
+        """
+        index of the nearest place and the distance to it in meter for every point
+        @:param longitude, latitude: 1-d arrays in degree (WGS84)
+        """
+        points = _to_unit_vectors(longitude, latitude).reshape(-1, 3)
+        if self._tree is not None:
+            chord, index = self._tree.query(points)
+        else:
+            chord = np.empty(len(points), dtype=np.float64)
+            index = np.empty(len(points), dtype=np.int64)
+            for start in range(0, len(points), _BRUTE_FORCE_CHUNK):
+                chunk = points[start:start + _BRUTE_FORCE_CHUNK]
+                squared = ((chunk[:, None, :] - self._vectors[None, :, :]) ** 2).sum(axis=-1)
+                index[start:start + len(chunk)] = squared.argmin(axis=1)
+                chord[start:start + len(chunk)] = np.sqrt(squared.min(axis=1))
+        distance = 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+        return np.asarray(index), distance
+
+
+class ReverseGeocoder:
+    """
+    offline reverse geocoder, points are quantized to `quantum` degree and looked up once per cell,
+    recently used cells are kept in a LRU cache, so a long track only costs one lookup per distinct cell
+    """
+
+    def __init__(self, gazetteer: Gazetteer = None, quantum=GEOCODING['QUANTUM'], cache_size=GEOCODING['CACHE_SIZE'],
+                 max_distance=GEOCODING['MAX_DISTANCE']):
+        self.gazetteer = gazetteer or Gazetteer()
+        self.quantum = quantum
+        self.cache_size = cache_size
+        self.max_distance = max_distance
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_get(self, key):
+        place = self._cache.get(key, self)
+        if place is not self:
+            self._cache.move_to_end(key)
+        return place
+
+    def _cache_put(self, key, place):
+        self._cache[key] = place
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def lookup(self, longitude, latitude, datum=COORDINATE_SYSTEM_WGS84) -> List[Dict]:
+        """
+        places for a batch of points
+        @:param longitude, latitude: array like values in degree, None and NaN give None
+        @:return list of place dicts {'id', 'province_id', 'province', 'city', 'address'} or None for every point
+        """
+        lng, lat = transform(np.atleast_1d(np.asarray(longitude, dtype=np.float64)),
+                             np.atleast_1d(np.asarray(latitude, dtype=np.float64)), datum, COORDINATE_SYSTEM_WGS84)
+        ret = [None] * lng.size
+        valid = np.nonzero(~(np.isnan(lng) | np.isnan(lat)))[0]
+        if valid.size == 0 or not self.gazetteer.places:
+            return ret
+
+        cells = np.stack([np.round(lng[valid] / self.quantum), np.round(lat[valid] / self.quantum)], axis=1)
+        cells, inverse = np.unique(cells.astype(np.int64), axis=0, return_inverse=True)
+        keys = [tuple(cell) for cell in cells.tolist()]
+        places = [self._cache_get(key) for key in keys]
+
+        missing = [i for i, place in enumerate(places) if place is self]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            centers = cells[missing] * self.quantum
+            index, distance = self.gazetteer.nearest(centers[:, 0], centers[:, 1])
+            for i, place_index, place_distance in zip(missing, index.tolist(), distance.tolist()):
+                place = self.gazetteer.places[place_index] if place_distance <= self.max_distance else None
+                places[i] = place
+                self._cache_put(keys[i], place)
+
+        for point, cell_index in zip(valid.tolist(), np.ravel(inverse).tolist()):
+            ret[point] = places[cell_index]
+        return ret
+
+    def reverse(self, longitude, latitude, datum=COORDINATE_SYSTEM_WGS84):
+        if longitude is None or latitude is None:
+            return None
+        return self.lookup([longitude], [latitude], datum)[0]
+
+    def annotate_track(self, activity_records: List[Dict]):
+        """
+        fill the address of parsed activity record coordinates in place
+        @:param activity_records: FitParser result 'activity_records', [{'coordinate': {...}, ...}, ...]
+        """
+        groups = {}
+        for record in activity_records:
+            point = record.get('coordinate') if record else None
+            if not point or point.get('longitude') is None or point.get('latitude') is None:
+                continue
+            groups.setdefault(point.get('datum') or COORDINATE_SYSTEM_WGS84, []).append(point)
+
+        for datum, points in groups.items():
+            places = self.lookup([p['longitude'] for p in points], [p['latitude'] for p in points], datum)
+            for point, place in zip(points, places):
+                point['address'] = place['address'] if place else None
+        return activity_records
+
+
+_reverse_geocoder = None
+
+
+def get_reverse_geocoder():
+    """
+    the process wide geocoder, the gazetteer is loaded on first use
+    """
+    global _reverse_geocoder
+    if _reverse_geocoder is None:
+        _reverse_geocoder = ReverseGeocoder()
+    return _reverse_geocoder
+
+
+def reverse_geocode(longitude, latitude, datum=COORDINATE_SYSTEM_WGS84):
+    """
+    nearest administrative place of a point, None if it is farther than GEOCODING['MAX_DISTANCE']
+    """
+    return get_reverse_geocoder().reverse(longitude, latitude, datum)
+
+
+def annotate_track(activity_records: List[Dict]):
+    return get_reverse_geocoder().annotate_track(activity_records)
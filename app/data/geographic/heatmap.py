@@ -0,0 +1,389 @@
+"""
+heatmap tiles of all stored tracks, pre-aggregated into z/x/y Web-Mercator tiles so a map view reads one small
+file per tile
+
+    heatmap = get_heatmap()
+    heatmap.add(parse_id, longitudes, latitudes)
+    heatmap.tile(12, 3372, 1552)  # TILE_SIZE x TILE_SIZE counts
+    heatmap.png(12, 3372, 1552)
+
+    python -m app.data.geographic.heatmap rebuild
+
+a pixel counts the tracks passing it, each track once, at every zoom from MIN_ZOOM to MAX_ZOOM. deeper zooms are
+served by scaling up the MAX_ZOOM tiles. the MAX_ZOOM pixels and the last point of every counted track are kept
+beside the tiles, so points appended to a track count only the pixels it did not pass yet. tiles are sparse count lists compressed by zlib, written by one process
+at a time like the spatial index, readers only ever see whole files
+"""
+import argparse
+import hashlib
+import logging
+import math
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from app.base.exceptions import PyrError
+from app.settings import HEATMAP
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'HMT1'
+_HEADER = struct.Struct('<4sHI')  # magic, tile size, non empty pixels
+_MAX_LATITUDE = 85.05112878  # latitude limit of Web-Mercator
+_MAX_OVERZOOM = 8  # zooms past MAX_ZOOM served by scaling up
+# color ramp of the rendered tiles, (intensity, r, g, b)
+_RAMP = np.array([
+    (0.0, 255, 255, 178),
+    (0.35, 254, 204, 92),
+    (0.6, 253, 141, 60),
+    (0.8, 240, 59, 32),
+    (1.0, 189, 0, 38),
+], dtype=np.float64)
+
+
+class HeatmapError(PyrError):
+    pass
+
+
+def to_pixels(longitude, latitude, zoom, tile_size=HEATMAP['TILE_SIZE']):
+    """
+    global Web-Mercator pixel coordinates of WGS84 positions, as floats
+    """
+    longitude = np.asarray(longitude, dtype=np.float64)
+    latitude = np.clip(np.asarray(latitude, dtype=np.float64), -_MAX_LATITUDE, _MAX_LATITUDE)
+    size = float(tile_size << zoom)
+    x = (longitude + 180) / 360 * size
+    sin = np.sin(np.radians(latitude))
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * size
+    return np.clip(x, 0, size - 1), np.clip(y, 0, size - 1)
+
+
+def _png(rgba: np.ndarray):
+    """
+    encode an RGBA uint8 image to PNG
+    """
+    height, width, _ = rgba.shape
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return b''.join((b'\x89PNG\r\n\x1a\n',
+                     chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+                     chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)),
+                     chunk(b'IEND', b'')))
+
+
+class Heatmap:
+    def __init__(self, path, min_zoom=HEATMAP['MIN_ZOOM'], max_zoom=HEATMAP['MAX_ZOOM'],
+                 tile_size=HEATMAP['TILE_SIZE'], max_segment_pixels=HEATMAP['MAX_SEGMENT_PIXELS']):
+        if tile_size & (tile_size - 1) or tile_size > 256:
+            raise HeatmapError('tile size should be a power of 2 up to 256, got %s' % tile_size)
+        self.path = path
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.tile_size = tile_size
+        self.max_segment_pixels = max_segment_pixels
+        self._shift = tile_size.bit_length() - 1
+        self._parses = None
+
+    # pixels
+
+    def _rasterize(self, longitude, latitude):
+        """
+        unique MAX_ZOOM pixels covered by the segments between consecutive points, NaN points break the track
+        :return: sorted int64 array of x << 32 | y
+        """
+        x, y = to_pixels(longitude, latitude, self.max_zoom, self.tile_size)
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        xs, ys = [np.floor(x[valid])], [np.floor(y[valid])]
+        if x.size > 1:
+            segment = valid[:-1] & valid[1:]
+            x0, y0 = x[:-1][segment], y[:-1][segment]
+            dx, dy = x[1:][segment] - x0, y[1:][segment] - y0
+            # sample every half pixel, longer jumps than max_segment_pixels are GPS glitches and left out
+            steps = np.ceil(2 * np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64)
+            keep = (steps > 1) & (steps <= 2 * self.max_segment_pixels)
+            if keep.any():
+                x0, y0, dx, dy, steps = x0[keep], y0[keep], dx[keep], dy[keep], steps[keep]
+                owner = np.repeat(np.arange(steps.size), steps)
+                t = (np.arange(owner.size) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[owner]
+                xs.append(np.floor(x0[owner] + t * dx[owner]))
+                ys.append(np.floor(y0[owner] + t * dy[owner]))
+        return np.unique(np.concatenate(xs).astype(np.int64) << 32 | np.concatenate(ys).astype(np.int64))
+
+    def _update(self, keys, sign, counted=None):
+        """
+        add or subtract MAX_ZOOM pixels from the tiles of every zoom
+        @:param counted: pixels the track counted before, skipped at every zoom
+        :return: number of tiles written
+        """
+        written = 0
+        mask = self.tile_size - 1
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            if zoom < self.max_zoom:
+                keys = np.unique(keys >> 33 << 32 | (keys & 0xffffffff) >> 1)
+                if counted is not None:
+                    counted = np.unique(counted >> 33 << 32 | (counted & 0xffffffff) >> 1)
+            current = keys if counted is None else keys[~np.isin(keys, counted, assume_unique=True)]
+            if current.size == 0:
+                continue
+            x, y = current >> 32, current & 0xffffffff
+            tiles = (x >> self._shift) << 32 | (y >> self._shift)
+            offsets = (y & mask) * self.tile_size + (x & mask)
+            order = np.argsort(tiles, kind='stable')
+            tiles, offsets = tiles[order], offsets[order]
+            starts = np.flatnonzero(np.concatenate(([True], tiles[1:] != tiles[:-1])))
+            for start, end in zip(starts.tolist(), np.append(starts[1:], tiles.size).tolist()):
+                tile = int(tiles[start])
+                counts = self._read(zoom, tile >> 32, tile & 0xffffffff).ravel()
+                if sign > 0:
+                    counts[offsets[start:end]] += 1
+                else:
+                    counts[offsets[start:end]] -= np.minimum(counts[offsets[start:end]], 1)
+                self._write(zoom, tile >> 32, tile & 0xffffffff, counts)
+                written += 1
+        return written
+
+    # tracks
+
+    def _ledger_path(self):
+        return os.path.join(self.path, 'parses')
+
+    @property
+    def parses(self):
+        """
+        parse ids of the tracks counted in the tiles
+        """
+        if self._parses is None:
+            self._parses = set()
+            if os.path.exists(self._ledger_path()):
+                with open(self._ledger_path()) as file:
+                    for line in file:
+                        op, parse_id = line.rstrip('\n').split(' ', 1)
+                        (self._parses.add if op == '+' else self._parses.discard)(parse_id)
+        return self._parses
+
+    def _log(self, op, parse_id):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._ledger_path(), 'a') as file:
+            file.write('%s %s\n' % (op, parse_id))
+
+    def _track_path(self, parse_id):
+        return os.path.join(self.path, 'tracks', hashlib.sha1(str(parse_id).encode('utf8')).hexdigest() + '.px')
+
+    def _read_track(self, parse_id):
+        """
+        pixels a track was counted with and its last point, (None, None) when none are stored
+        """
+        try:
+            with open(self._track_path(parse_id), 'rb') as file:
+                data = zlib.decompress(file.read())
+        except FileNotFoundError:
+            return None, None
+        return np.frombuffer(data, dtype='<i8', offset=16), np.frombuffer(data, dtype='<f8', count=2)
+
+    def _write_track(self, parse_id, keys, longitude, latitude):
+        path = self._track_path(parse_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        last = np.array([longitude[-1], latitude[-1]] if len(longitude) else [np.nan, np.nan], dtype='<f8')
+        with open(path + '.tmp', 'wb') as file:
+            file.write(zlib.compress(last.tobytes() + keys.astype('<i8').tobytes(), 6))
+        os.replace(path + '.tmp', path)
+
+    def add(self, parse_id, longitude, latitude):
+        """
+        count a track in the tiles, a parse id counted before is skipped
+        @:param longitude, latitude: array like track points in degree (WGS84)
+        :return: number of tiles written
+        """
+        if parse_id in self.parses:
+            return 0
+        longitude, latitude = np.atleast_1d(longitude), np.atleast_1d(latitude)
+        keys = self._rasterize(longitude, latitude)
+        written = self._update(keys, 1)
+        self._write_track(parse_id, keys, longitude, latitude)
+        self.parses.add(parse_id)
+        self._log('+', parse_id)
+        return written
+
+    def extend(self, parse_id, longitude, latitude):
+        """
+        count the points appended to a counted track, e.g. by an incremental FIT parse. the segment from the last
+        point counted joins them, pixels the track passed before are not counted again
+        """
+        longitude, latitude = np.atleast_1d(longitude), np.atleast_1d(latitude)
+        if longitude.size == 0 and parse_id in self.parses:
+            return 0
+        counted, last = self._read_track(parse_id)
+        keys = self._rasterize(longitude, latitude) if last is None else \
+            self._rasterize(np.concatenate(([last[0]], longitude)), np.concatenate(([last[1]], latitude)))
+        written = self._update(keys, 1, counted)
+        if counted is not None:
+            keys = np.union1d(counted, keys)
+        self._write_track(parse_id, keys, longitude, latitude)
+        if parse_id not in self.parses:
+            self.parses.add(parse_id)
+            self._log('+', parse_id)
+        return written
+
+    def remove(self, parse_id, longitude, latitude):
+        """
+        take a track out of the tiles with the pixels it was counted with, or the points when none are stored
+        """
+        if parse_id not in self.parses:
+            return 0
+        keys, _ = self._read_track(parse_id)
+        written = self._update(self._rasterize(longitude, latitude) if keys is None else keys, -1)
+        if keys is not None:
+            os.remove(self._track_path(parse_id))
+        self.parses.discard(parse_id)
+        self._log('-', parse_id)
+        return written
+
+    # tiles
+
+    def _tile_path(self, zoom, x, y):
+        return os.path.join(self.path, str(zoom), str(x), '%d.tile' % y)
+
+    def _read(self, zoom, x, y):
+        """
+        counts of a stored tile, zeros when it has none
+        """
+        counts = np.zeros(self.tile_size * self.tile_size, dtype=np.uint32)
+        try:
+            with open(self._tile_path(zoom, x, y), 'rb') as file:
+                data = zlib.decompress(file.read())
+        except FileNotFoundError:
+            return counts.reshape(self.tile_size, self.tile_size)
+        magic, tile_size, size = _HEADER.unpack_from(data)
+        if magic != _MAGIC or tile_size != self.tile_size:
+            raise HeatmapError('tile %d/%d/%d is not a heatmap tile of size %d' % (zoom, x, y, self.tile_size))
+        offsets = np.frombuffer(data, dtype='<u2', count=size, offset=_HEADER.size)
+        counts[offsets] = np.frombuffer(data, dtype='<u4', count=size, offset=_HEADER.size + 2 * size)
+        return counts.reshape(self.tile_size, self.tile_size)
+
+    def _write(self, zoom, x, y, counts):
+        path = self._tile_path(zoom, x, y)
+        offsets = np.flatnonzero(counts)
+        if offsets.size == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = _HEADER.pack(_MAGIC, self.tile_size, offsets.size) + offsets.astype('<u2').tobytes() + \
+            counts[offsets].astype('<u4').tobytes()
+        with open(path + '.tmp', 'wb') as file:
+            file.write(zlib.compress(data, 6))
+        os.replace(path + '.tmp', path)
+
+    def tile(self, zoom, x, y) -> np.ndarray:
+        """
+        tile_size x tile_size track counts of a tile, rows from north to south
+        """
+        if not 0 <= x < 1 << zoom or not 0 <= y < 1 << zoom or zoom > self.max_zoom + _MAX_OVERZOOM:
+            raise HeatmapError('no tile %d/%d/%d' % (zoom, x, y))
+        if zoom < self.min_zoom:
+            return np.zeros((self.tile_size, self.tile_size), dtype=np.uint32)
+        if zoom <= self.max_zoom:
+            return self._read(zoom, x, y)
+        # scale up the part of the MAX_ZOOM tile covering it
+        factor = 1 << (zoom - self.max_zoom)
+        parent = self._read(self.max_zoom, x // factor, y // factor)
+        size = max(self.tile_size // factor, 1)
+        row, column = (y % factor) * self.tile_size // factor, (x % factor) * self.tile_size // factor
+        part = parent[row:row + size, column:column + size]
+        repeat = self.tile_size // size
+        return np.repeat(np.repeat(part, repeat, axis=0), repeat, axis=1)
+
+    def png(self, zoom, x, y, saturation=HEATMAP['SATURATION']) -> bytes:
+        """
+        the tile rendered on a transparent background, pixels passed by `saturation` tracks or more get the
+        strongest color
+        """
+        counts = self.tile(zoom, x, y).astype(np.float64)
+        intensity = np.clip(np.log1p(counts) / math.log1p(saturation), 0, 1)
+        rgba = np.empty(counts.shape + (4,), dtype=np.uint8)
+        for channel in range(3):
+            rgba[..., channel] = np.interp(intensity, _RAMP[:, 0], _RAMP[:, channel + 1])
+        rgba[..., 3] = np.where(counts > 0, 80 + 175 * intensity, 0)
+        return _png(rgba)
+
+    # rebuild
+
+    def clear(self):
+        import shutil
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        self._parses = set()
+
+    def rebuild(self, db=None, batch_size=HEATMAP['BATCH_SIZE']):
+        """
+        count every stored track again from scratch, run it while nothing is saved
+        :return: number of tracks counted
+        """
+        from app.data.codec import iter_track
+        from app.parse.constants import FIT_DATA_ACTIVITY_RECORD
+        from app.parse.parsers import Parser
+
+        if db is None:
+            from app.utils.mongodb import mongodb as db
+        self.clear()
+        projection = {'_db_pyr_guid': True, 'data.' + FIT_DATA_ACTIVITY_RECORD[0]: True}
+        count = 0
+        for document in db.iterate(db.Collections.MEDIA_PARSED_DATA, {'_db_deleted': {'$ne': True}}, projection,
+                                   batch_size, decode_tracks=False):
+            longitudes, latitudes, records = [], [], []
+            for record in iter_track((document.get('data') or {}).get(FIT_DATA_ACTIVITY_RECORD[0])):
+                records.append(record)
+                if len(records) >= 4096:
+                    self._collect_positions(Parser, records, longitudes, latitudes)
+            self._collect_positions(Parser, records, longitudes, latitudes)
+            if longitudes and not document.get('merged_from'):
+                self.add(document['_db_pyr_guid'], longitudes, latitudes)
+                count += 1
+        logger.info('rebuilt the heatmap of %d tracks' % count)
+        return count
+
+    @staticmethod
+    def _collect_positions(parser_class, records, longitudes, latitudes):
+        positions = parser_class._get_track_positions(records)
+        if positions is not None:
+            longitudes.extend(np.nan if i is None else i for i in positions[0])
+            latitudes.extend(np.nan if i is None else i for i in positions[1])
+        records.clear()
+
+
+_heatmap = None
+
+
+def get_heatmap():
+    """
+    the heatmap at HEATMAP['PATH']
+    """
+    global _heatmap
+    if _heatmap is None:
+        _heatmap = Heatmap(os.path.expanduser(HEATMAP['PATH']))
+    return _heatmap
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='heatmap tiles of the stored tracks')
+    sub = parser.add_subparsers(dest='command', required=True)
+    rebuild = sub.add_parser('rebuild', help='count every stored track again')
+    rebuild.add_argument('--batch-size', type=int, default=HEATMAP['BATCH_SIZE'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'rebuild':
+        get_heatmap().rebuild(batch_size=args.batch_size)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
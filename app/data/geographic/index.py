@@ -0,0 +1,407 @@
+import argparse
+import contextlib
+import logging
+import math
+import os
+import pickle
+import sys
+from typing import Dict, Iterable, Set
+
+import numpy as np
+
+from app.base.exceptions import PyrError
+from app.data.geographic.constants import EARTH_RADIUS, LONGITUDE_RANGE, LATITUDE_RANGE
+from app.settings import SPATIAL_INDEX
+
+logger = logging.getLogger(__name__)
+
+_METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+_ROW = 1 << 32
+_OP_ADD = 'add'
+_OP_REMOVE = 'remove'
+
+
+class SpatialIndexError(PyrError):
+    pass
+
+
+class SpatialIndex:
+    """
+    grid index maps cells of `cell_size` degree to the parse ids whose track or photo position touch them,
+    queries return candidate parse ids, exact geometry check is up to the caller.
+
+    changes are appended to a journal next to the snapshot file, so keeping the index up to date costs
+    O(cells of the new parse) instead of rewriting the whole index. processes sharing the files take a lock file
+    for every write and replay the entries the others appended since their last read before a write or a query.
+    the journal is folded into the snapshot by `compact`, a maintenance command run out of the save path:
+
+        python -m app.data.geographic.index compact
+    """
+
+    def __init__(self, path=None, cell_size=SPATIAL_INDEX['CELL_SIZE'],
+                 max_segment_cells=SPATIAL_INDEX['MAX_SEGMENT_CELLS']):
+        self.cell_size = cell_size
+        self.max_segment_cells = max_segment_cells
+        self._path = path
+        self._cells: Dict[int, Set[str]] = {}
+        self._items: Dict[str, np.ndarray] = {}
+        self._journal_size = 0  # entries of the journal
+        self._journal_offset = 0  # bytes of the journal read
+        self._snapshot_stat = None
+        if path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, parse_id):
+        return parse_id in self._items
+
+    # cell helpers
+
+    def _to_grid(self, longitude, latitude):
+        gx = (np.asarray(longitude, dtype=np.float64) - LONGITUDE_RANGE[0]) / self.cell_size
+        gy = (np.asarray(latitude, dtype=np.float64) - LATITUDE_RANGE[0]) / self.cell_size
+        return gx, gy
+
+    @staticmethod
+    def _to_keys(ix, iy):
+        return ix.astype(np.int64) * _ROW + iy.astype(np.int64)
+
+    @staticmethod
+    def _from_keys(keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        return keys // _ROW, keys % _ROW
+
+    def _rasterize(self, longitude, latitude, track=True):
+        """
+        cell keys covered by the points, or by the segments between consecutive points when `track` is set,
+        NaN points break the track
+        """
+        gx, gy = self._to_grid(longitude, latitude)
+        gx, gy = np.atleast_1d(gx), np.atleast_1d(gy)
+        valid = ~(np.isnan(gx) | np.isnan(gy))
+        if not valid.any():
+            return np.empty(0, dtype=np.int64)
+
+        keys = [self._to_keys(np.floor(gx[valid]), np.floor(gy[valid]))]
+        if track and gx.size > 1:
+            segment = valid[:-1] & valid[1:]
+            x0, y0 = gx[:-1][segment], gy[:-1][segment]
+            dx, dy = gx[1:][segment] - x0, gy[1:][segment] - y0
+            # sample every half cell so diagonal segments don't skip the corner cells
+            steps = np.minimum(np.ceil(2 * np.maximum(np.abs(dx), np.abs(dy))), self.max_segment_cells)
+            steps = steps.astype(np.int64)
+            long_segment = steps > 1
+            if long_segment.any():
+                x0, y0, dx, dy, steps = x0[long_segment], y0[long_segment], dx[long_segment], dy[long_segment], \
+                                        steps[long_segment]
+                owner = np.repeat(np.arange(steps.size), steps)
+                offset = np.arange(owner.size) - np.repeat(np.cumsum(steps) - steps, steps)
+                t = offset / steps[owner]
+                keys.append(self._to_keys(np.floor(x0[owner] + t * dx[owner]), np.floor(y0[owner] + t * dy[owner])))
+
+        return np.unique(np.concatenate(keys))
+
+    def _present(self, ix0, ix1, iy0, iy1):
+        """
+        keys of non empty cells inside the inclusive grid range
+        """
+        count = (ix1 - ix0 + 1) * (iy1 - iy0 + 1)
+        if count <= 0:
+            return np.empty(0, dtype=np.int64)
+        if count > len(self._cells):
+            keys = np.fromiter(self._cells.keys(), dtype=np.int64, count=len(self._cells))
+            ix, iy = self._from_keys(keys)
+            return keys[(ix >= ix0) & (ix <= ix1) & (iy >= iy0) & (iy <= iy1)]
+        ix, iy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1))
+        keys = self._to_keys(ix.ravel(), iy.ravel())
+        return np.array([k for k in keys.tolist() if k in self._cells], dtype=np.int64)
+
+    def _collect(self, keys: Iterable[int]):
+        ret = set()
+        for key in keys:
+            ret.update(self._cells.get(int(key), ()))
+        return ret
+
+    # maintenance
+
+    def add(self, parse_id, longitude, latitude, track=True):
+        """
+        index the positions of a parse result, replace the positions indexed for the parse id before
+        @:param longitude, latitude: scalar or array like values in degree (WGS84)
+        @:param track: index segments between consecutive points as well, off for unordered point sets
+        """
+        keys = self._rasterize(longitude, latitude, track)
+        self._write(_OP_ADD, parse_id, keys)
+        return keys.size
+
+    def extend(self, parse_id, longitude, latitude, track=True):
+        """
+        index more positions of a parse result, keep the positions indexed before
+        """
+        keys = self._rasterize(longitude, latitude, track)
+        self._write(_OP_ADD, parse_id, keys, extend=True)
+        return self._items[parse_id].size
+
+    def remove(self, parse_id):
+        self.refresh()
+        if parse_id not in self._items:
+            return False
+        self._write(_OP_REMOVE, parse_id, None)
+        return True
+
+    def _apply(self, op, parse_id, keys):
+        if op == _OP_ADD:
+            self._add(parse_id, keys)
+        elif parse_id in self._items:
+            self._remove(parse_id)
+
+    def _add(self, parse_id, keys):
+        if parse_id in self._items:
+            self._remove(parse_id)
+        self._items[parse_id] = keys
+        for key in keys.tolist():
+            self._cells.setdefault(key, set()).add(parse_id)
+
+    def _remove(self, parse_id):
+        for key in self._items.pop(parse_id).tolist():
+            ids = self._cells.get(key)
+            if ids is None:
+                continue
+            ids.discard(parse_id)
+            if not ids:
+                del self._cells[key]
+
+    # queries
+
+    def bbox(self, min_longitude, min_latitude, max_longitude, max_latitude):
+        """
+        parse ids having positions inside the bounding box
+        """
+        self.refresh()
+        gx, gy = self._to_grid([min_longitude, max_longitude], [min_latitude, max_latitude])
+        ix0, ix1 = np.floor(gx).astype(np.int64).tolist()
+        iy0, iy1 = np.floor(gy).astype(np.int64).tolist()
+        return self._collect(self._present(ix0, ix1, iy0, iy1))
+
+    def radius(self, longitude, latitude, meters):
+        """
+        parse ids having positions within `meters` of the center, by equirectangular distance to the cells
+        """
+        self.refresh()
+        d_lat = meters / _METERS_PER_DEGREE
+        d_lng = d_lat / max(math.cos(math.radians(latitude)), 1e-6)
+        gx, gy = self._to_grid([longitude - d_lng, longitude + d_lng], [latitude - d_lat, latitude + d_lat])
+        keys = self._present(*np.floor(gx).astype(np.int64).tolist(), *np.floor(gy).astype(np.int64).tolist())
+        if keys.size == 0:
+            return set()
+
+        ix, iy = self._from_keys(keys)
+        cx, cy = self._to_grid(longitude, latitude)
+        # distance from the center to the closest point of each cell, in cell units
+        nx = np.clip(cx, ix, ix + 1) - cx
+        ny = np.clip(cy, iy, iy + 1) - cy
+        cell_meters = self.cell_size * _METERS_PER_DEGREE
+        distance = np.hypot(nx * cell_meters * math.cos(math.radians(latitude)), ny * cell_meters)
+        return self._collect(keys[distance <= meters])
+
+    def corridor(self, longitude, latitude, meters):
+        """
+        parse ids having positions within about `meters` of the polyline, the corridor is widened to whole cells
+        @:param longitude, latitude: array like polyline vertices in degree
+        """
+        self.refresh()
+        base = self._rasterize(longitude, latitude, track=True)
+        if base.size == 0:
+            return set()
+
+        max_latitude = float(np.nanmax(np.abs(np.asarray(latitude, dtype=np.float64))))
+        cell_meters = self.cell_size * _METERS_PER_DEGREE
+        ry = int(math.ceil(meters / cell_meters))
+        rx = int(math.ceil(meters / (cell_meters * max(math.cos(math.radians(max_latitude)), 1e-6))))
+        ox, oy = np.meshgrid(np.arange(-rx, rx + 1), np.arange(-ry, ry + 1))
+        ix, iy = self._from_keys(base)
+        keys = np.unique(self._to_keys((ix[:, None] + ox.ravel()).ravel(), (iy[:, None] + oy.ravel()).ravel()))
+        return self._collect(k for k in keys.tolist() if k in self._cells)
+
+    # persistence
+
+    @property
+    def _journal_path(self):
+        return self._path + '.journal'
+
+    @contextlib.contextmanager
+    def _locked(self, path=None):
+        """
+        exclusive lock of the index files between processes, a no-op where fcntl is missing
+        """
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        path = path or self._path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.lock', 'ab') as file:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def _write(self, op, parse_id, keys, extend=False):
+        """
+        apply a change and append it to the journal, after the entries the other processes appended
+        """
+        if self._path is None:
+            if extend and parse_id in self._items:
+                keys = np.union1d(self._items[parse_id], keys)
+            self._apply(op, parse_id, keys)
+            return
+        with self._locked():
+            self._refresh()
+            if os.path.exists(self._journal_path) and os.path.getsize(self._journal_path) > self._journal_offset:
+                # the tail of a write torn by a crash, the entries appended after it would never be read
+                logger.warning('spatial index journal %s truncated at %d' % (self._journal_path, self._journal_offset))
+                os.truncate(self._journal_path, self._journal_offset)
+            if extend and parse_id in self._items:
+                keys = np.union1d(self._items[parse_id], keys)
+            self._apply(op, parse_id, keys)
+            # one write per entry, entries of processes appending at the same time don't interleave
+            with open(self._journal_path, 'ab') as file:
+                file.write(pickle.dumps((op, parse_id, keys), protocol=pickle.HIGHEST_PROTOCOL))
+                self._journal_offset = file.tell()
+            self._journal_size += 1
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """
+        replay the journal entries other processes appended since the last read, read the files again from scratch
+        when the index was compacted
+        """
+        if self._path is not None:
+            self._refresh()
+
+    def _refresh(self):
+        journal_size = os.path.getsize(self._journal_path) if os.path.exists(self._journal_path) else 0
+        if self._stat(self._path) != self._snapshot_stat or journal_size < self._journal_offset:
+            self._load()
+        elif journal_size > self._journal_offset:
+            self._read_journal()
+
+    def _read_journal(self):
+        """
+        apply the entries of the journal from the last offset read, an entry being written is left for later
+        """
+        try:
+            file = open(self._journal_path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            file.seek(self._journal_offset)
+            while True:
+                try:
+                    op, parse_id, keys = pickle.load(file)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError) as err:
+                    logger.debug('spatial index journal %s ends in a partial entry: %s' % (self._journal_path, err))
+                    break
+                self._apply(op, parse_id, keys)
+                self._journal_offset = file.tell()
+                self._journal_size += 1
+
+    def load(self):
+        with self._locked():
+            self._load()
+
+    def _load(self):
+        self._cells, self._items, self._journal_size, self._journal_offset = {}, {}, 0, 0
+        self._snapshot_stat = self._stat(self._path)
+        if self._snapshot_stat is not None:
+            with open(self._path, 'rb') as file:
+                snapshot = pickle.load(file)
+            if snapshot['cell_size'] != self.cell_size:
+                raise SpatialIndexError('index %s is built with cell size %s, but %s is configured'
+                                        % (self._path, snapshot['cell_size'], self.cell_size))
+            for parse_id, keys in snapshot['items'].items():
+                self._add(parse_id, keys)
+        self._read_journal()
+
+    @property
+    def journal_size(self):
+        """
+        entries of the journal not folded into the snapshot yet
+        """
+        self.refresh()
+        return self._journal_size
+
+    def compact(self, path=None):
+        """
+        write a snapshot of the whole index and drop the journal. the index is read again from its files first,
+        it then holds the changes of the other processes as well
+        @:param path: write the snapshot there instead, e.g. a copy of the index, the journal is left alone
+        """
+        path = path or self._path
+        if path is None:
+            raise SpatialIndexError('no path to save the spatial index to')
+        with self._locked(path):
+            if path == self._path:
+                self._load()
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as file:
+                pickle.dump({'cell_size': self.cell_size, 'items': self._items}, file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            if path == self._path:
+                if os.path.exists(self._journal_path):
+                    os.remove(self._journal_path)
+                self._journal_size, self._journal_offset = 0, 0
+                self._snapshot_stat = self._stat(path)
+
+
+_spatial_index = None
+
+
+def get_spatial_index():
+    """
+    the process wide index at SPATIAL_INDEX['PATH'], loaded on first use
+    """
+    global _spatial_index
+    if _spatial_index is None:
+        path = os.path.expanduser(SPATIAL_INDEX['PATH'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _spatial_index = SpatialIndex(path)
+    return _spatial_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='spatial index of the stored positions')
+    sub = parser.add_subparsers(dest='command', required=True)
+    compact = sub.add_parser('compact', help='fold the journal into the snapshot')
+    compact.add_argument('--min-entries', type=int, default=SPATIAL_INDEX['COMPACT_THRESHOLD'],
+                         help='compact only when the journal has this many entries')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compact':
+        index = get_spatial_index()
+        if index.journal_size >= args.min_entries:
+            index.compact()
+            logger.info('compacted the spatial index of %d parses' % len(index))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -1,6 +1,6 @@
 from typing import Dict
 
-from app.data.geographic.constants import LONGITUDE_RANGE, LATITUDE_RANGE
+from app.data.geographic.constants import LONGITUDE_RANGE, LATITUDE_RANGE, COORDINATE_SYSTEM_WGS84
 from app.data.geographic.utils import semicircle_to_degree
 from app.data.models import DataModel
 
@@ -32,28 +32,53 @@ class Coordinate(DataModel):
         else:
             return None, None
 
+    def transform(self, datum):
+        """
+        return a copy of this coordinate converted to another coordinate system
+        @:param datum: WGS84, GCJ02 or BD09, coordinate without datum is regarded as WGS84
+        """
+        from app.data.geographic.transform import transform
+
+        coordinate = Coordinate(dict(self.__dict__))
+        if self.longitude is not None and self.latitude is not None:
+            longitude, latitude = transform(self.longitude, self.latitude, self.datum or COORDINATE_SYSTEM_WGS84, datum)
+            coordinate.set_data({'longitude': longitude, 'latitude': latitude})
+        coordinate.datum = datum
+        return coordinate
+
     def _get_location(self):
         """
-        TODO get address
         TODO correct altitude
         parse readable address and correct altitude
         """
-        pass
+        if self.address is None and self.longitude is not None and self.latitude is not None:
+            from app.data.geographic.geocoding import reverse_geocode
+
+            place = reverse_geocode(self.longitude, self.latitude, self.datum or COORDINATE_SYSTEM_WGS84)
+            self.address = place['address'] if place else None
 
     def _clean(self):
         self._clean_coordinate()
 
     def _clean_coordinate(self):
-        if self.longitude > LONGITUDE_RANGE[1]:
+        if self.longitude is None or self.latitude is None:
+            self.error(DataModel.DataNoneValueError('coordinate needs both longitude and latitude'))
+            return
+        if not isinstance(self.longitude, (int, float)) or not isinstance(self.latitude, (int, float)):
+            self.error(DataModel.DataTypeError('longitude and latitude must be numbers, but got %r, %r'
+                                               % (self.longitude, self.latitude)))
+            return
+        # FIT positions are in semicircles
+        if abs(self.longitude) > LONGITUDE_RANGE[1]:
             self.longitude = semicircle_to_degree(self.longitude)
-        if self.latitude > LATITUDE_RANGE[1]:
+        if abs(self.latitude) > LATITUDE_RANGE[1]:
             self.latitude = semicircle_to_degree(self.latitude)
-        if not (LATITUDE_RANGE[0] < self.latitude < LATITUDE_RANGE[1]):
+        if not (LATITUDE_RANGE[0] <= self.latitude <= LATITUDE_RANGE[1]):
             self.error(DataModel.DataRangeError('latitude must between %s and %s, but %s have been set'
                                                 % (LATITUDE_RANGE[0], LATITUDE_RANGE[1], self.latitude)))
-        if not (LONGITUDE_RANGE[0] < self.longitude < LONGITUDE_RANGE[1]):
-            self.error(DataModel.DataRangeError('latitude must between %s and %s, but %s have been set'
-                                                % (LONGITUDE_RANGE[0], LONGITUDE_RANGE[1], self.latitude)))
+        if not (LONGITUDE_RANGE[0] <= self.longitude <= LONGITUDE_RANGE[1]):
+            self.error(DataModel.DataRangeError('longitude must between %s and %s, but %s have been set'
+                                                % (LONGITUDE_RANGE[0], LONGITUDE_RANGE[1], self.longitude)))
 
 
 class Geographic(DataModel):
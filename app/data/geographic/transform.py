@@ -0,0 +1,190 @@
+import math
+from typing import List, Dict
+
+import numpy as np
+
+from app.base.exceptions import PyrError
+from app.data.geographic.constants import COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_BD09, \
+    COORDINATE_SYSTEMS, CHINA_LATITUDE_RANGE, CHINA_LONGITUDE_RANGE, KRASOVSKY_SEMI_MAJOR_AXIS, \
+    KRASOVSKY_ECCENTRICITY_SQUARED, GCJ02_INVERSE_MAX_ITERATIONS, GCJ02_INVERSE_TOLERANCE
+
+_BD09_X_PI = math.pi * 3000.0 / 180.0
+
+
+class CoordinateSystemError(PyrError):
+    pass
+
+
+def _as_arrays(longitude, latitude):
+    lng = np.asarray(longitude, dtype=np.float64)
+    lat = np.asarray(latitude, dtype=np.float64)
+    if lng.shape != lat.shape:
+        raise CoordinateSystemError('longitude and latitude must have the same shape, but got %s and %s'
+                                    % (lng.shape, lat.shape))
+    return lng, lat
+
+
+def _as_result(lng, lat, scalar):
+    if scalar:
+        return float(lng), float(lat)
+    return lng, lat
+
+
+def in_china(longitude, latitude):
+    """
+    check whether coordinates are inside the area GCJ-02 offsets apply to
+    @:param longitude, latitude: scalar or array like values in degree
+    """
+    lng, lat = _as_arrays(longitude, latitude)
+    return (lng > CHINA_LONGITUDE_RANGE[0]) & (lng < CHINA_LONGITUDE_RANGE[1]) & \
+           (lat > CHINA_LATITUDE_RANGE[0]) & (lat < CHINA_LATITUDE_RANGE[1])
+
+
+def _gcj02_offset(lng, lat):
+    x = lng - 105.0
+    y = lat - 35.0
+    sqrt_abs_x = np.sqrt(np.abs(x))
+    common = (20.0 * np.sin(6.0 * x * np.pi) + 20.0 * np.sin(2.0 * x * np.pi)) * 2.0 / 3.0
+
+    d_lat = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * sqrt_abs_x + common
+    d_lat += (20.0 * np.sin(y * np.pi) + 40.0 * np.sin(y / 3.0 * np.pi)) * 2.0 / 3.0
+    d_lat += (160.0 * np.sin(y / 12.0 * np.pi) + 320.0 * np.sin(y * np.pi / 30.0)) * 2.0 / 3.0
+
+    d_lng = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * sqrt_abs_x + common
+    d_lng += (20.0 * np.sin(x * np.pi) + 40.0 * np.sin(x / 3.0 * np.pi)) * 2.0 / 3.0
+    d_lng += (150.0 * np.sin(x / 12.0 * np.pi) + 300.0 * np.sin(x / 30.0 * np.pi)) * 2.0 / 3.0
+
+    rad_lat = lat / 180.0 * np.pi
+    magic = 1 - KRASOVSKY_ECCENTRICITY_SQUARED * np.sin(rad_lat) ** 2
+    sqrt_magic = np.sqrt(magic)
+    d_lat = (d_lat * 180.0) / ((KRASOVSKY_SEMI_MAJOR_AXIS * (1 - KRASOVSKY_ECCENTRICITY_SQUARED))
+                               / (magic * sqrt_magic) * np.pi)
+    d_lng = (d_lng * 180.0) / (KRASOVSKY_SEMI_MAJOR_AXIS / sqrt_magic * np.cos(rad_lat) * np.pi)
+    return d_lng, d_lat
+
+
+def _wgs84_to_gcj02(lng, lat):
+    d_lng, d_lat = _gcj02_offset(lng, lat)
+    mask = in_china(lng, lat)
+    return np.where(mask, lng + d_lng, lng), np.where(mask, lat + d_lat, lat)
+
+
+def _gcj02_to_wgs84(lng, lat, max_iterations=GCJ02_INVERSE_MAX_ITERATIONS, tolerance=GCJ02_INVERSE_TOLERANCE):
+    """
+    GCJ-02 has no closed form inverse, start from the GCJ-02 point and correct the guess by the
+    forward error until it converges, only the points which are not converged are recomputed
+    """
+    wgs_lng = np.array(lng, dtype=np.float64, copy=True)
+    wgs_lat = np.array(lat, dtype=np.float64, copy=True)
+    active = np.nonzero(np.ravel(in_china(lng, lat)))[0]
+    flat_lng, flat_lat = wgs_lng.reshape(-1), wgs_lat.reshape(-1)
+    target_lng, target_lat = np.ravel(lng), np.ravel(lat)
+
+    for _ in range(max_iterations):
+        if active.size == 0:
+            break
+        guess_lng, guess_lat = _wgs84_to_gcj02(flat_lng[active], flat_lat[active])
+        diff_lng = guess_lng - target_lng[active]
+        diff_lat = guess_lat - target_lat[active]
+        flat_lng[active] -= diff_lng
+        flat_lat[active] -= diff_lat
+        active = active[(np.abs(diff_lng) > tolerance) | (np.abs(diff_lat) > tolerance)]
+
+    return wgs_lng, wgs_lat
+
+
+def _gcj02_to_bd09(lng, lat):
+    z = np.sqrt(lng * lng + lat * lat) + 0.00002 * np.sin(lat * _BD09_X_PI)
+    theta = np.arctan2(lat, lng) + 0.000003 * np.cos(lng * _BD09_X_PI)
+    return z * np.cos(theta) + 0.0065, z * np.sin(theta) + 0.006
+
+
+def _bd09_to_gcj02(lng, lat):
+    x = lng - 0.0065
+    y = lat - 0.006
+    z = np.sqrt(x * x + y * y) - 0.00002 * np.sin(y * _BD09_X_PI)
+    theta = np.arctan2(y, x) - 0.000003 * np.cos(x * _BD09_X_PI)
+    return z * np.cos(theta), z * np.sin(theta)
+
+
+_TRANSFORMS = {
+    (COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_GCJ02): (_wgs84_to_gcj02,),
+    (COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_WGS84): (_gcj02_to_wgs84,),
+    (COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_BD09): (_gcj02_to_bd09,),
+    (COORDINATE_SYSTEM_BD09, COORDINATE_SYSTEM_GCJ02): (_bd09_to_gcj02,),
+    (COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_BD09): (_wgs84_to_gcj02, _gcj02_to_bd09),
+    (COORDINATE_SYSTEM_BD09, COORDINATE_SYSTEM_WGS84): (_bd09_to_gcj02, _gcj02_to_wgs84),
+}
+
+
+def transform(longitude, latitude, from_datum, to_datum):
+    """
+    convert coordinates between WGS84, GCJ02 and BD09
+    @:param longitude, latitude: scalar or array like values in degree, None and NaN are kept as NaN
+    @:return (longitude, latitude), floats for scalar input, otherwise numpy arrays
+    """
+    for datum in (from_datum, to_datum):
+        if datum not in COORDINATE_SYSTEMS:
+            raise CoordinateSystemError('datum must be one of %s, but got %r' % (COORDINATE_SYSTEMS, datum))
+
+    scalar = np.ndim(longitude) == 0 and np.ndim(latitude) == 0
+    lng, lat = _as_arrays(longitude, latitude)
+    if from_datum != to_datum:
+        for step in _TRANSFORMS[(from_datum, to_datum)]:
+            lng, lat = step(lng, lat)
+    return _as_result(lng, lat, scalar)
+
+
+def wgs84_to_gcj02(longitude, latitude):
+    return transform(longitude, latitude, COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_GCJ02)
+
+
+def gcj02_to_wgs84(longitude, latitude):
+    return transform(longitude, latitude, COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_WGS84)
+
+
+def gcj02_to_bd09(longitude, latitude):
+    return transform(longitude, latitude, COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_BD09)
+
+
+def bd09_to_gcj02(longitude, latitude):
+    return transform(longitude, latitude, COORDINATE_SYSTEM_BD09, COORDINATE_SYSTEM_GCJ02)
+
+
+def wgs84_to_bd09(longitude, latitude):
+    return transform(longitude, latitude, COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_BD09)
+
+
+def bd09_to_wgs84(longitude, latitude):
+    return transform(longitude, latitude, COORDINATE_SYSTEM_BD09, COORDINATE_SYSTEM_WGS84)
+
+
+def transform_points(points: List[Dict], to_datum, default_datum=COORDINATE_SYSTEM_WGS84):
+    """
+    convert a list of coordinate dicts (as stored in parsed data) in place, one vectorized call per source datum
+    @:param points: [{'longitude': 115.6, 'latitude': 35.8, 'datum': 'WGS84', ...}, ...], None items are skipped
+    @:param to_datum: target coordinate system
+    @:param default_datum: datum used for points without 'datum'
+    """
+    groups = {}
+    for point in points:
+        if not point or point.get('longitude') is None or point.get('latitude') is None:
+            continue
+        groups.setdefault(point.get('datum') or default_datum, []).append(point)
+
+    for datum, group in groups.items():
+        if datum == to_datum:
+            continue
+        lng, lat = transform([p['longitude'] for p in group], [p['latitude'] for p in group], datum, to_datum)
+        for point, new_lng, new_lat in zip(group, lng.tolist(), lat.tolist()):
+            point.update({'longitude': new_lng, 'latitude': new_lat, 'datum': to_datum})
+    return points
+
+
+def transform_track(activity_records: List[Dict], to_datum):
+    """
+    convert the coordinates of parsed activity records in place
+    @:param activity_records: FitParser result 'activity_records', [{'coordinate': {...}, ...}, ...]
+    """
+    transform_points([record.get('coordinate') for record in activity_records if record], to_datum)
+    return activity_records
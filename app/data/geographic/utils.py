@@ -1,25 +1,41 @@
+import math
 from typing import Iterable
 
-from base.exceptions import PyrTypeError
+from app.base.exceptions import PyrTypeError
+from app.data.geographic.constants import EARTH_RADIUS
 
 
 def semicircle_to_degree(semicircles):
     """
-    convert coordinate from semicircles to degree
+    convert coordinate from semicircles to degree, 2 ** 31 semicircles are 180 degree
     @:param semicircles, lat, lng or lat&lng pair value in semicircles, support str, int and iterable object
     """
-    if isinstance(semicircles, str) and ',' in semicircles:
-        semicircles = semicircles.split(',')
+    if isinstance(semicircles, str):
+        semicircles = semicircles.strip()
+        if ',' in semicircles:
+            return [semicircle_to_degree(i) for i in semicircles.split(',')]
+        try:
+            semicircles = int(semicircles)
+        except ValueError:
+            raise PyrTypeError('semicircles must be a int, or int transformable object, but got %r ' % semicircles)
     if isinstance(semicircles, Iterable):
         return [semicircle_to_degree(i) for i in semicircles]
-    if isinstance(semicircles, str) and semicircles.isdigit():
-        semicircles = int(semicircles)
-    if isinstance(semicircles, int):
-        return semicircles * semicircles * (180 / 2 ** 31)
+    if isinstance(semicircles, (int, float)) and not isinstance(semicircles, bool):
+        return semicircles * (180 / 2 ** 31)
     else:
         raise PyrTypeError('semicircles must be a int, or int transformable object, but got %r ' % semicircles)
 
 
+def distance(longitude1, latitude1, longitude2, latitude2):
+    """
+    great circle distance between two positions in degree, in meter
+    """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
 def mps_to_kph(value):
     """
     convert speed form m/s to km/h
@@ -46,3 +62,50 @@ def m_to_km(value):
         raise PyrTypeError('distance value must be a numeric, or numeric transformable object, but got %r ' % value)
 
     return ret
+
+
+def _ratio_to_float(value):
+    if isinstance(value, str):
+        if '/' in value:
+            num, den = value.split('/', 1)
+            return float(num) / float(den) if float(den) != 0 else 0.0
+        return float(value)
+    return float(value)
+
+
+def dms_to_degree(dms, ref=None):
+    """
+    convert EXIF degree/minute/second values to signed degree
+    @:param dms: [degree, minute, second] as numbers, exif Ratio or 'num/den' strings
+    @:param ref: 'N', 'S', 'E' or 'W', south and west give negative values
+    """
+    if dms is None:
+        return None
+    if not isinstance(dms, (list, tuple)):
+        dms = [dms]
+    try:
+        values = [_ratio_to_float(i) for i in dms] + [0.0, 0.0]
+    except (TypeError, ValueError, ZeroDivisionError):
+        raise PyrTypeError('dms must be a list of numeric or ratio values, but got %r ' % dms)
+
+    degree = values[0] + values[1] / 60 + values[2] / 3600
+    if isinstance(ref, (list, tuple)):
+        ref = ref[0] if ref else None
+    if ref is not None and str(ref).strip().upper() in ('S', 'W'):
+        degree = -degree
+    return degree
+
+
+def gps_to_position(gps_info):
+    """
+    read the position from PhotoParser gps info
+    @:param gps_info: {'GPSLatitude': [...], 'GPSLatitudeRef': 'N', 'GPSLongitude': [...], ...}
+    @:return (longitude, latitude), or (None, None) if the photo has no position
+    """
+    if not gps_info or 'GPSLatitude' not in gps_info or 'GPSLongitude' not in gps_info:
+        return None, None
+    try:
+        return (dms_to_degree(gps_info['GPSLongitude'], gps_info.get('GPSLongitudeRef')),
+                dms_to_degree(gps_info['GPSLatitude'], gps_info.get('GPSLatitudeRef')))
+    except PyrTypeError:
+        return None, None
@@ -1,8 +1,10 @@
 import abc
+import datetime
 from typing import Dict
 
 from app.base.exceptions import PyrError, PyrTypeError
 from app.utils.date import to_timestamp, timestamp_to_str
+from app.utils.metrics import timer
 
 
 class DataModel(metaclass=abc.ABCMeta):
@@ -28,7 +30,7 @@ class DataModel(metaclass=abc.ABCMeta):
         pass
 
     _data = None
-    _errors: [PyrError] = []
+    _errors: [PyrError] = ()  # errors of the last validation, set on the instance only when there are some
 
     def __init__(self, init_data: Dict):
         self.set_data(init_data)
@@ -42,38 +44,47 @@ class DataModel(metaclass=abc.ABCMeta):
         self._timestamp = timestamp
         self._timezone = timezone
 
+    def error(self, err: PyrError):
+        if '_errors' not in self.__dict__:
+            self._errors = []
+        self._errors.append(err)
+
     def clean(self):
+        self.__dict__.pop('_errors', None)
+        self._clean_timezone()
         self._clean()
 
     @abc.abstractmethod
     def _clean(self):
         """
         check and try to auto convert properties,
-        put error into _errors
+        report errors by error()
         """
-        self._clean_timezone()
 
     def _clean_timezone(self):
-        if self._skip_timezone:
+        if self._skip_timezone or self._timestamp is None:
             return
         if self._timezone is None:
-            self._errors.append(self.DataTimestampError('Missing timezone information'))
+            self.error(self.DataTimestampError('Missing timezone information'))
+            return
+        if isinstance(self._timestamp, (str, datetime.datetime)):
+            self.timestamp = to_timestamp(self._timestamp, self._timezone)
+        elif isinstance(self._timestamp, (int, float)) and not isinstance(self._timestamp, bool):
+            self.timestamp = self._timestamp
         else:
-            if isinstance(self._timestamp, str):
-                self.timestamp = to_timestamp(self._timestamp, self._timezone)
-            elif isinstance(self._timestamp, int):
-                self.timestamp = self._timestamp
-            else:
-                self._errors.append(self.DataTimestampError('Timestamp must be str or int, bug got %s'
-                                                            % type(self._timestamp)))
-
-            if self.time is None:
-                self.time = timestamp_to_str(self.timestamp)
+            self.error(self.DataTimestampError('Timestamp must be str, datetime or number, bug got %s'
+                                               % type(self._timestamp)))
+            return
 
+        if self.timestamp is None:
+            self.error(self.DataTimestampError('unknown datetime format %s' % self._timestamp))
+        elif self.time is None:
+            self.time = timestamp_to_str(self.timestamp)
 
     def is_valid(self):
-        self._clean()
-        return len(self._errors) == 0
+        with timer('model_clean_seconds', model=type(self).__name__):
+            self.clean()
+        return '_errors' not in self.__dict__
 
 
 class Environment(DataModel):
@@ -156,11 +167,11 @@ class Gear(DataModel):
         if self.type is None:
             self.type = self.UNKNOWN
         if self.brand is None:
-            self._errors.append(self.DataNoneValueError("Gear's brand can not be none"))
+            self.error(self.DataNoneValueError("Gear's brand can not be none"))
         if self.manufacturer is None:
-            self._errors.append(self.DataNoneValueError("Gear's manufacturer can not be none"))
+            self.error(self.DataNoneValueError("Gear's manufacturer can not be none"))
         if self.model is None:
-            self._errors.append(self.DataNoneValueError("Gear's model can not be none"))
+            self.error(self.DataNoneValueError("Gear's model can not be none"))
 
 
 class Activity(DataModel):
@@ -0,0 +1,174 @@
+"""
+registries of the gears and traveller profiles found in parsed files.
+
+a device or profile is stored once in its own collection, parse results keep references to it, e.g.
+all rides with a power meter is the indexed query {'data.gear.gear_id': gear_id}
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from app.settings import REGISTRY
+from app.utils.mongodb import DB
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(data: Dict, skip=()):
+    """
+    digest of the public fields of a record
+    """
+    public = {k: v for k, v in data.items() if not k.startswith('_') and v is not None and k not in skip}
+    return hashlib.sha1(json.dumps(public, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Registry:
+    """
+    upserts records by key, a process wide LRU cache of key -> (id, fingerprint) skips the DB round trip
+    for records already registered with the same content. when the DB fails, records are not registered for
+    REGISTRY['RETRY_AFTER'] seconds instead of each of them waiting for the DB to time out
+    """
+    collection = None
+    reference_field = None  # field of the registry id in the references kept by parse results
+    # fields changing from one activity to the next, they stay in the references instead of the registry
+    volatile = ('timestamp', 'time', 'first_seen', 'last_seen')
+
+    def __init__(self, db=None, cache_size=REGISTRY['CACHE_SIZE']):
+        self._db = db
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._indexed = False
+        self._failed_until = 0
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    @property
+    def db(self):
+        if self._db is None:
+            from app.utils.mongodb import mongodb
+            self._db = mongodb
+        return self._db
+
+    def key(self, data: Dict) -> str:
+        raise NotImplementedError
+
+    def ensure_indexes(self):
+        if self._indexed:
+            return
+        self._indexed = True
+        self.db.create_index(self.collection, 'key', unique=True)
+        self.db.create_index(DB.Collections.MEDIA_PARSED_DATA, 'data.%s' % self.reference_field)
+
+    def register(self, data: Dict, by_user=None):
+        """
+        store a record once
+        :return: registry id of the record, None when the DB failed
+        """
+        key = data.get('key') or self.key(data)
+        fingerprint = _fingerprint(data, self.volatile)
+        cached = self._cache.get(key)
+        if cached is not None and cached[1] == fingerprint:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+        if time.monotonic() < self._failed_until:
+            self.failures += 1
+            return None
+
+        self.misses += 1
+        if REGISTRY['ENSURE_INDEXES']:
+            self.ensure_indexes()
+        document = {k: v for k, v in data.items() if not k.startswith('_') and k not in self.volatile}
+        document['key'] = key
+        registry_id = self.db.upsert(self.collection, {'key': key}, document, by_user)
+        if registry_id is None:
+            self.failures += 1
+            self._failed_until = time.monotonic() + REGISTRY['RETRY_AFTER']
+            logger.warning('%s registry failed, records are not registered for %ss'
+                           % (self.collection, REGISTRY['RETRY_AFTER']))
+            return None
+        self._cache[key] = (registry_id, fingerprint)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return registry_id
+
+    def reference(self, data: Dict, by_user=None):
+        """
+        the reference a parse result keeps instead of the record, the whole record when it could not be registered,
+        e.g. while the DB fails, so nothing of it is lost
+        """
+        registry_id = self.register(data, by_user)
+        if registry_id is None:
+            ret = {k: v for k, v in data.items() if not k.startswith('_')}
+        else:
+            ret = {k: data.get(k) for k in self.volatile if k not in ('timestamp', 'time')}
+        ret.update({self.reference_field: registry_id, 'key': data.get('key') or self.key(data)})
+        return ret
+
+    def get(self, registry_id):
+        return self.db.find_one(self.collection, {'_db_pyr_guid': registry_id})
+
+    def activities(self, registry_id, limit=None):
+        """
+        stored parse results referencing the record
+        """
+        return self.db.query(DB.Collections.MEDIA_PARSED_DATA, {'data.%s' % self.reference_field: registry_id},
+                             limit=limit)
+
+
+class GearRegistry(Registry):
+    collection = DB.Collections.GEAR
+    reference_field = 'gear.gear_id'
+    volatile = Registry.volatile + ('device_index', 'battery_voltage', 'battery_status', 'cum_operating_time')
+
+    def reference(self, data: Dict, by_user=None):
+        ret = super().reference(data, by_user)
+        ret['gear_id'] = ret.pop(self.reference_field)
+        return ret
+
+    def key(self, data: Dict):
+        """
+        manufacturer, model and serial number, devices without serial number are keyed by their content.
+        the model of a FIT device is its product, see FitParser._parse_gear
+        """
+        serial_number = data.get('serial_number')
+        if serial_number is None:
+            return 'content:%s' % _fingerprint(data, self.volatile)
+        model = data.get('model') if data.get('model') is not None else data.get('garmin_product')
+        return '%s:%s:%s' % (data.get('manufacturer'), model, serial_number)
+
+
+class ProfileRegistry(Registry):
+    """
+    profiles have no identity of their own, a profile is keyed by its content so each version is stored once
+    """
+    collection = DB.Collections.TRAVELLER_PROFILE
+    reference_field = 'traveller.profile_id'
+
+    def reference(self, data: Dict, by_user=None):
+        ret = super().reference(data, by_user)
+        ret['profile_id'] = ret.pop(self.reference_field)
+        return ret
+
+    def key(self, data: Dict):
+        return 'content:%s' % _fingerprint(data, self.volatile)
+
+
+_registries = {}
+
+
+def get_gear_registry() -> GearRegistry:
+    if 'gear' not in _registries:
+        _registries['gear'] = GearRegistry()
+    return _registries['gear']
+
+
+def get_profile_registry() -> ProfileRegistry:
+    if 'profile' not in _registries:
+        _registries['profile'] = ProfileRegistry()
+    return _registries['profile']
@@ -0,0 +1,361 @@
+"""
+pre-aggregated activity totals per owner and day, week and month, and per gear, kept up to date on save
+
+    rollups = get_rollups()
+    rollups.get('owner', 'alice', 'week', '2019-W39')  # {'activities', 'distance', 'ascent', ...}
+    rollups.series('owner', 'alice', 'month', '2019-01', '2019-12')
+
+    python -m app.data.rollup rebuild
+
+every stored file contributes its totals to the buckets of its start time. the rollup documents remember the
+version of the contribution they hold per source file and are updated by $inc of the difference only when they
+hold a previous version, so applying a contribution twice, re-parsing a file or retrying after a crash never
+counts a file twice
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import sys
+from typing import Dict, List
+
+import pytz
+
+from app.data.codec import iter_track
+from app.parse.constants import FIT_DATA_ACTIVITY, FIT_DATA_ACTIVITY_RECORD, FIT_DATA_GEAR
+from app.settings import ROLLUP
+from app.utils.date import to_timestamp
+from app.utils.metrics import inc
+
+logger = logging.getLogger(__name__)
+
+VALUES = ('activities', 'distance', 'ascent', 'descent', 'elapsed_time', 'timer_time')
+
+# value -> Activity field
+_ACTIVITY_FIELDS = (
+    ('distance', 'total_distance'),
+    ('ascent', 'total_ascent'),
+    ('descent', 'total_descent'),
+    ('elapsed_time', 'total_elapsed_time'),
+    ('timer_time', 'total_timer_time'),
+)
+_PERIODS = {
+    'all': lambda t: 'all',
+    'day': lambda t: t.strftime('%Y-%m-%d'),
+    'week': lambda t: t.strftime('%G-W%V'),
+    'month': lambda t: t.strftime('%Y-%m'),
+}
+_PROJECTION = {'_db_pyr_guid': True, '_db_owner': True, '_db_deleted': True, 'path': True, 'merged_from': True,
+               'data.' + FIT_DATA_ACTIVITY[0]: True, 'data.' + FIT_DATA_ACTIVITY_RECORD[0]: True,
+               'data.' + FIT_DATA_GEAR[0]: True}
+
+
+def source_key(document: Dict):
+    """
+    the identity of a stored file in the rollups, its path so a re-parse replaces the contribution of the last one
+    """
+    if document.get('path'):
+        return 'p' + hashlib.sha1(str(document['path']).encode('utf8')).hexdigest()[:20]
+    return 'g' + str(document['_db_pyr_guid'])
+
+
+def _totals(data: Dict):
+    """
+    totals of the sessions of a parse result, summed up from the activity records when it has none
+    :return: (start timestamp, {value: total})
+    """
+    sessions = [i for i in data.get(FIT_DATA_ACTIVITY[0]) or []
+                if isinstance(i, dict) and i.get('total_distance') is not None]
+    if not sessions:
+        from app.parse.merge import ActivitySummary
+
+        summary = ActivitySummary()
+        for record in iter_track(data.get(FIT_DATA_ACTIVITY_RECORD[0])):
+            summary.add(record)
+        if not summary.records:
+            return None, None
+        sessions = [summary.result()]
+
+    start = None
+    for session in sessions:
+        timestamp = session.get('start_time')
+        timestamp = to_timestamp(timestamp) if timestamp is not None and not isinstance(timestamp, (int, float)) \
+            else timestamp
+        if timestamp is not None and (start is None or timestamp < start):
+            start = timestamp
+    values = {'activities': 1}
+    for value, field in _ACTIVITY_FIELDS:
+        values[value] = round(sum(i.get(field) or 0 for i in sessions), 3)
+    return start, values
+
+
+def buckets(owner, gears: List[str], start, tz=ROLLUP['TIMEZONE']):
+    """
+    keys of the rollup documents a file starting at `start` counts in
+    """
+    local = datetime.datetime.fromtimestamp(start, pytz.timezone(tz))
+    ret = ['owner:%s:%s:%s' % (owner, period, _PERIODS[period](local)) for period in ROLLUP['PERIODS']]
+    ret += ['gear:%s:%s:%s' % (gear, period, _PERIODS[period](local))
+            for gear in gears for period in ROLLUP['GEAR_PERIODS']]
+    return ret
+
+
+def contribution(document: Dict):
+    """
+    the contribution of a stored file to the rollups, None when it contributes nothing: deleted, merged from other
+    files or without activity
+    :return: {'version', 'values', 'buckets'}
+    """
+    data = document.get('data')
+    if document.get('_db_deleted') or document.get('merged_from') or not isinstance(data, dict):
+        return None
+    start, values = _totals(data)
+    if start is None:
+        return None
+    owner = document.get('_db_owner') or ROLLUP['ANONYMOUS']
+    gears = sorted({i['key'] for i in data.get(FIT_DATA_GEAR[0]) or [] if isinstance(i, dict) and i.get('key')})
+    ret = {'values': values, 'buckets': buckets(owner, gears, start)}
+    ret['version'] = hashlib.sha1(json.dumps(ret, sort_keys=True).encode('utf8')).hexdigest()[:12]
+    return ret
+
+
+class Rollups:
+    def __init__(self, db=None):
+        self._db = db
+        self._indexed = False
+
+    @property
+    def db(self):
+        if self._db is None:
+            from app.utils.mongodb import mongodb
+
+            self._db = mongodb
+        if not self._indexed and ROLLUP['ENSURE_INDEXES']:
+            self._indexed = True
+            self.ensure_indexes()
+        return self._db
+
+    def ensure_indexes(self):
+        self._db.create_index(self._db.Collections.ROLLUP, 'key', unique=True)
+        self._db.create_index(self._db.Collections.ROLLUP, [('kind', 1), ('subject', 1), ('period', 1),
+                                                             ('bucket', 1)])
+        self._db.create_index(self._db.Collections.ROLLUP_LEDGER, 'source', unique=True)
+        self._db.create_index(self._db.Collections.ROLLUP_LEDGER, 'parse_id')
+
+    # updates
+
+    def update(self, document: Dict, parse_id=None):
+        """
+        count a stored file in the rollups, replacing what it or an earlier parse of the same file counted
+        @:param document: the stored document, or the data stored by Parser.save
+        :return: True if the rollups changed
+        """
+        parse_id = parse_id or document.get('_db_pyr_guid')
+        source = source_key(dict(document, _db_pyr_guid=parse_id))
+        return self._apply(source, parse_id, contribution(document))
+
+    def refresh(self, parse_id):
+        """
+        count a stored file again after it changed in the DB, e.g. by an incremental FIT parse
+        """
+        collection = self.db.Collections.MEDIA_PARSED_DATA
+        try:
+            document = next(self.db.iterate(collection, {'_db_pyr_guid': parse_id}, _PROJECTION,
+                                            decode_tracks=False), None)
+        except Exception as err:
+            return self._failed(parse_id, err)
+        if document is None:
+            return self.remove(parse_id)
+        return self.update(document, parse_id)
+
+    def remove(self, parse_id):
+        """
+        take a deleted file out of the rollups
+        """
+        try:
+            ledger = self.db.find_one(self.db.Collections.ROLLUP_LEDGER, {'parse_id': parse_id})
+        except Exception as err:
+            return self._failed(parse_id, err)
+        if not ledger:
+            return False
+        return self._apply(ledger['source'], parse_id, None)
+
+    def _apply(self, source, parse_id, new):
+        """
+        move the rollups from the contributions recorded in the ledger to the new one, document by document.
+        the ledger records the new contribution as pending before any document is touched, a document holds the
+        last applied contribution or one of the pending ones and the update takes out whichever it holds. the
+        pending ones are dropped once every document took the new one, when the DB fails half way the next update
+        of the file finishes the move
+        """
+        db = self.db
+        try:
+            ledger = db.find_one(db.Collections.ROLLUP_LEDGER, {'source': source}) or {}
+        except Exception as err:
+            return self._failed(parse_id, err)
+        old = ledger.get('contribution')
+        pending = ledger.get('pending') or []
+        if not pending and (old and old['version']) == (new and new['version']):
+            if old and ledger.get('parse_id') != parse_id:
+                # re-parsed without change, a delete of the new parse has to find it
+                db.upsert(db.Collections.ROLLUP_LEDGER, {'source': source}, {'parse_id': parse_id})
+            inc('rollup_updates_total', result='unchanged')
+            return False
+        if db.upsert(db.Collections.ROLLUP_LEDGER, {'source': source},
+                     {'source': source, 'parse_id': parse_id, 'pending': pending + [new]}) is None:
+            return self._failed(parse_id, 'update of the ledger failed')
+        held = list({i['version']: i for i in [old] + pending if i and i['version'] != (new and new['version'])}
+                    .values())
+        field = 'parses.' + source
+        keys = set(new['buckets'] if new else ()).union(*(i['buckets'] for i in held))
+        for key in sorted(keys):
+            target = new if new and key in new['buckets'] else None
+            updated = False
+            for previous in (i for i in held if key in i['buckets']):
+                update = {'$inc': {'values.' + k: (target['values'].get(k, 0) if target else 0) - v
+                                   for k, v in previous['values'].items()}}
+                if target:
+                    update['$inc'].update({'values.' + k: v for k, v in target['values'].items()
+                                           if k not in previous['values']})
+                    update['$set'] = {field: target['version']}
+                else:
+                    update['$unset'] = {field: ''}
+                updated = db.update(db.Collections.ROLLUP, {'key': key, field: previous['version']}, update)
+                if updated is not False:
+                    break
+            if not updated and updated is not None and target:
+                # the document holds none of the contributions of the file, or already the new one
+                kind, subject, period, bucket = self._split(key)
+                update = {'$inc': {'values.' + k: v for k, v in target['values'].items()},
+                          '$set': {field: target['version']},
+                          '$setOnInsert': {'kind': kind, 'subject': subject, 'period': period, 'bucket': bucket}}
+                condition = {'key': key, field: {'$exists': False}}
+                updated = db.update(db.Collections.ROLLUP, condition, update, upsert=True)
+                if updated is False:
+                    # a concurrent insert of the same bucket failed the upsert on the unique key, the update matches
+                    updated = db.update(db.Collections.ROLLUP, condition, update)
+            if updated is None:
+                return self._failed(parse_id, 'update of %s failed' % key)
+        if db.upsert(db.Collections.ROLLUP_LEDGER, {'source': source},
+                     {'source': source, 'parse_id': parse_id, 'contribution': new, 'pending': []}) is None:
+            return self._failed(parse_id, 'update of the ledger failed')
+        inc('rollup_updates_total', result='removed' if new is None else 'applied')
+        return True
+
+    @staticmethod
+    def _failed(parse_id, err):
+        """
+        the rollups are left as they are when the DB fails, a later update or a rebuild counts the file
+        """
+        logger.warning('rollups of %s skipped: %s' % (parse_id, err))
+        inc('rollup_updates_total', result='failed')
+        return False
+
+    @staticmethod
+    def _split(key):
+        kind, rest = key.split(':', 1)
+        subject, period, bucket = rest.rsplit(':', 2)
+        return kind, subject, period, bucket
+
+    # reads
+
+    def get(self, kind, subject, period, bucket) -> Dict:
+        """
+        totals of an owner or a gear in a bucket, e.g. ('owner', 'alice', 'week', '2019-W39')
+        """
+        key = '%s:%s:%s:%s' % (kind, subject, period, bucket)
+        document = self.db.find_one(self.db.Collections.ROLLUP, {'key': key})
+        values = (document or {}).get('values') or {}
+        return {k: values.get(k, 0) for k in VALUES}
+
+    def series(self, kind, subject, period, start=None, end=None) -> List[Dict]:
+        """
+        totals of the buckets of a period from start to end inclusive, buckets without activity are left out
+        """
+        condition = {'kind': kind, 'subject': subject, 'period': period}
+        if start is not None or end is not None:
+            condition['bucket'] = {k: v for k, v in (('$gte', start), ('$lte', end)) if v is not None}
+        ret = [dict({k: (document.get('values') or {}).get(k, 0) for k in VALUES}, bucket=document['bucket'])
+               for document in self.db.iterate(self.db.Collections.ROLLUP, condition,
+                                               {'bucket': True, 'values': True})]
+        return sorted((i for i in ret if i['activities']), key=lambda i: i['bucket'])
+
+    # rebuild
+
+    def rebuild(self, batch_size=ROLLUP['BATCH_SIZE']):
+        """
+        compute the rollups from scratch out of the stored files, replacing the stored ones. the rollups are
+        missing while they are written, run it while nothing is saved
+        :return: number of files counted
+        """
+        db = self.db
+        sources = {}
+        for document in db.iterate(db.Collections.MEDIA_PARSED_DATA, {}, _PROJECTION, batch_size,
+                                   decode_tracks=False):
+            new = contribution(document)
+            source = source_key(document)
+            if new is not None:
+                # the last stored parse of a file counts, as it would have replaced the earlier ones
+                sources[source] = (document['_db_pyr_guid'], new)
+            else:
+                sources.pop(source, None)
+
+        rollups = {}
+        for source, (_, new) in sources.items():
+            for key in new['buckets']:
+                document = rollups.get(key)
+                if document is None:
+                    kind, subject, period, bucket = self._split(key)
+                    document = rollups[key] = {'key': key, 'kind': kind, 'subject': subject, 'period': period,
+                                               'bucket': bucket, 'values': dict.fromkeys(VALUES, 0), 'parses': {}}
+                for k, v in new['values'].items():
+                    document['values'][k] += v
+                document['parses'][source] = new['version']
+
+        db.drop(db.Collections.ROLLUP)
+        db.drop(db.Collections.ROLLUP_LEDGER)
+        self.ensure_indexes()
+        for document in rollups.values():
+            db.insert(db.Collections.ROLLUP, document)
+        for source, (parse_id, new) in sources.items():
+            db.insert(db.Collections.ROLLUP_LEDGER, {'source': source, 'parse_id': parse_id, 'contribution': new})
+        logger.info('rebuilt %d rollups of %d files' % (len(rollups), len(sources)))
+        return len(sources)
+
+
+_rollups = None
+
+
+def get_rollups() -> Rollups:
+    global _rollups
+    if _rollups is None:
+        _rollups = Rollups()
+    return _rollups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='activity rollups per owner and gear')
+    sub = parser.add_subparsers(dest='command', required=True)
+    rebuild = sub.add_parser('rebuild', help='compute the rollups again from the stored files')
+    rebuild.add_argument('--batch-size', type=int, default=ROLLUP['BATCH_SIZE'])
+    show = sub.add_parser('show', help='print the totals of an owner or a gear')
+    show.add_argument('kind', choices=['owner', 'gear'])
+    show.add_argument('subject')
+    show.add_argument('period', choices=sorted(_PERIODS))
+    show.add_argument('--start')
+    show.add_argument('--end')
+    args = parser.parse_args(argv)
+
+    rollups = get_rollups()
+    if args.command == 'rebuild':
+        rollups.rebuild(args.batch_size)
+    else:
+        for item in rollups.series(args.kind, args.subject, args.period, args.start, args.end):
+            print(json.dumps(item))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+column wise validation of activity records, instead of a model and exception objects per record
+
+    result = validate_track(activity_records)
+    result.masks['latitude_range']  # bool mask of the records with the issue
+    result.summary()  # {'records', 'valid', 'issues': {issue: count}}
+
+state lives in the result of each call, nothing is shared between parses
+"""
+from typing import Dict, List
+
+import numpy as np
+
+from app.data.geographic.constants import LONGITUDE_RANGE, LATITUDE_RANGE
+from app.settings import VALIDATION
+
+# issues that reject the position of a record, the others only drop a value or are informative
+POSITION_ERRORS = ('position_missing', 'position_sentinel', 'longitude_range', 'latitude_range', 'null_island')
+
+# (column, record part, key)
+_COLUMNS = (
+    ('longitude', 'coordinate', 'longitude'),
+    ('latitude', 'coordinate', 'latitude'),
+    ('altitude', 'coordinate', 'altitude'),
+    ('speed', 'physiologic', 'speed'),
+    ('heart_rate', 'physiologic', 'heart_rate'),
+    ('power', 'physiologic', 'power'),
+    ('temperature', 'environment', 'temperature'),
+)
+_PARTS = ('coordinate', 'physiologic', 'environment')
+_SEMICIRCLE = 180 / 2 ** 31
+
+
+class ValidationResult:
+    def __init__(self, size):
+        self.size = size
+        self.masks = {}
+        self.columns = {}
+
+    def flag(self, issue, mask):
+        if mask.any():
+            self.masks[issue] = self.masks[issue] | mask if issue in self.masks else mask
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        return {issue: int(mask.sum()) for issue, mask in self.masks.items()}
+
+    @property
+    def position_valid(self):
+        mask = np.ones(self.size, dtype=bool)
+        for issue in POSITION_ERRORS:
+            if issue in self.masks:
+                mask &= ~self.masks[issue]
+        return mask
+
+    def summary(self):
+        return {'records': self.size, 'valid': int(self.position_valid.sum()), 'issues': self.counts}
+
+
+def _float_column(values):
+    return np.array([v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in values],
+                    dtype=np.float64)
+
+
+def _check_range(result, columns, name):
+    column = columns[name]
+    low, high = VALIDATION['RANGES'][name]
+    sentinel = np.isin(column, VALIDATION['SENTINELS'].get(name, ()))
+    bad = sentinel | (column < low) | (column > high)
+    result.flag('%s_range' % name, bad)
+    column[bad] = np.nan
+
+
+def validate_columns(columns: Dict[str, np.ndarray], timestamps=None) -> ValidationResult:
+    """
+    validate columns of float values, NaN for missing ones. the columns are cleaned in place: semicircle
+    positions are converted to degree, rejected values become NaN
+    """
+    size = len(columns['longitude'])
+    result = ValidationResult(size)
+    result.columns = columns
+    longitude, latitude = columns['longitude'], columns['latitude']
+
+    result.flag('position_missing', np.isnan(longitude) | np.isnan(latitude))
+    sentinel = np.isin(longitude, VALIDATION['SENTINELS']['position']) | \
+        np.isin(latitude, VALIDATION['SENTINELS']['position'])
+    result.flag('position_sentinel', sentinel)
+    longitude[sentinel] = np.nan
+    latitude[sentinel] = np.nan
+
+    # FIT positions are in semicircles, values out of the degree range but in the semicircle range are converted
+    for column, limit in ((longitude, LONGITUDE_RANGE[1]), (latitude, LATITUDE_RANGE[1])):
+        semicircle = (np.abs(column) > limit) & (np.abs(column) <= 2 ** 31)
+        result.flag('position_semicircle', semicircle)
+        column[semicircle] *= _SEMICIRCLE
+    with np.errstate(invalid='ignore'):
+        result.flag('longitude_range', (longitude < LONGITUDE_RANGE[0]) | (longitude > LONGITUDE_RANGE[1]))
+        result.flag('latitude_range', (latitude < LATITUDE_RANGE[0]) | (latitude > LATITUDE_RANGE[1]))
+        if VALIDATION['REJECT_NULL_ISLAND']:
+            result.flag('null_island', (longitude == 0) & (latitude == 0))
+        for name in VALIDATION['RANGES']:
+            if name in columns:
+                _check_range(result, columns, name)
+
+    if timestamps is not None:
+        result.flag('timestamp_missing', np.isnan(timestamps))
+        previous = np.fmax.accumulate(np.concatenate(([-np.inf], timestamps[:-1])))
+        with np.errstate(invalid='ignore'):
+            result.flag('timestamp_duplicate', timestamps == previous)
+            result.flag('timestamp_backwards', timestamps < previous)
+    return result
+
+
+def validate_track(activity_records: List[Dict]) -> ValidationResult:
+    """
+    validate the activity records of a parse result and clean them in place: positions are converted to degree,
+    records with a rejected position lose their coordinate and rejected values are set to None
+    """
+    parts = {part: [record.get(part) if isinstance(record.get(part), dict) else {} for record in activity_records]
+             for part in _PARTS}
+    columns = {name: _float_column([data.get(key) for data in parts[part]]) for name, part, key in _COLUMNS}
+    timestamps = _float_column([next((data['timestamp'] for data in (parts[part][i] for part in _PARTS)
+                                      if data.get('timestamp') is not None), None)
+                                for i in range(len(activity_records))])
+    result = validate_columns(columns, timestamps)
+
+    position_valid = result.position_valid
+    for i in np.flatnonzero(~position_valid).tolist():
+        activity_records[i].pop('coordinate', None)
+    semicircle = result.masks.get('position_semicircle')
+    if semicircle is not None:
+        longitude, latitude = columns['longitude'].tolist(), columns['latitude'].tolist()
+        for i in np.flatnonzero(semicircle & position_valid).tolist():
+            parts['coordinate'][i].update({'longitude': longitude[i], 'latitude': latitude[i]})
+    for name, part, key in _COLUMNS[2:]:
+        mask = result.masks.get('%s_range' % name)
+        if mask is not None:
+            for i in np.flatnonzero(mask).tolist():
+                if key in parts[part][i]:
+                    parts[part][i][key] = None
+    return result
@@ -0,0 +1,119 @@
+"""
+flatten the activity records of parse results into fixed schema column chunks
+"""
+from typing import Dict, Iterable
+
+import numpy as np
+
+from app.data.codec import decode_track
+from app.data.geographic.constants import COORDINATE_SYSTEM_WGS84
+from app.parse.constants import FIT_DATA_ACTIVITY_RECORD
+from app.settings import EXPORT
+
+# (column, dtype, (record part, key)), float columns use NaN for missing values, string columns ''
+SCHEMA = (
+    ('parse_id', 'U', None),
+    ('timestamp', 'f8', None),
+    ('longitude', 'f8', ('coordinate', 'longitude')),
+    ('latitude', 'f8', ('coordinate', 'latitude')),
+    ('altitude', 'f8', ('coordinate', 'altitude')),
+    ('speed', 'f8', ('physiologic', 'speed')),
+    ('heart_rate', 'f8', ('physiologic', 'heart_rate')),
+    ('power', 'f8', ('physiologic', 'power')),
+    ('temperature', 'f8', ('environment', 'temperature')),
+    ('gradient', 'f8', ('environment', 'gradient')),
+    ('address', 'U', ('coordinate', 'address')),
+)
+COLUMNS = tuple(name for name, _, _ in SCHEMA)
+_PARTS = ('coordinate', 'physiologic', 'environment')
+
+
+def _float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _timestamp(record):
+    for part in _PARTS:
+        value = (record.get(part) or {}).get('timestamp')
+        if value is not None:
+            return _float(value)
+    return np.nan
+
+
+class ChunkBuilder:
+    """
+    collect rows and hand them out as chunks of at most `chunk_size` rows
+    """
+
+    def __init__(self, chunk_size=EXPORT['CHUNK_SIZE'], datum=EXPORT['DATUM']):
+        self.chunk_size = chunk_size
+        self.datum = datum
+        self._reset()
+
+    def _reset(self):
+        self._rows = {name: [] for name in COLUMNS}
+        self._datums = []
+
+    def __len__(self):
+        return len(self._datums)
+
+    def add(self, parse_id, activity_records: Iterable[Dict]):
+        """
+        add the records of one parse result, yield every chunk that fills up on the way
+        """
+        for record in activity_records:
+            if not record:
+                continue
+            rows = self._rows
+            rows['parse_id'].append(parse_id)
+            rows['timestamp'].append(_timestamp(record))
+            for name, dtype, source in SCHEMA[2:]:
+                value = (record.get(source[0]) or {}).get(source[1])
+                rows[name].append(_float(value) if dtype == 'f8' else (value or ''))
+            self._datums.append((record.get('coordinate') or {}).get('datum') or COORDINATE_SYSTEM_WGS84)
+            if len(self._datums) >= self.chunk_size:
+                yield self.flush()
+
+    def flush(self):
+        """
+        :return: {column: array} of the rows collected so far, or None if there is none
+        """
+        if not self._datums:
+            return None
+        chunk = {name: np.array(self._rows[name], dtype=dtype if dtype != 'U' else str)
+                 for name, dtype, _ in SCHEMA}
+        datums = np.array(self._datums)
+        self._reset()
+        self._transform(chunk, datums)
+        return chunk
+
+    def _transform(self, chunk, datums):
+        if self.datum is None:
+            return
+        from app.data.geographic.transform import transform
+
+        for datum in np.unique(datums).tolist():
+            if datum == self.datum:
+                continue
+            mask = datums == datum
+            chunk['longitude'][mask], chunk['latitude'][mask] = transform(chunk['longitude'][mask],
+                                                                          chunk['latitude'][mask], datum, self.datum)
+
+
+def iter_chunks(documents: Iterable[Dict], chunk_size=EXPORT['CHUNK_SIZE'], datum=EXPORT['DATUM']):
+    """
+    column chunks of the activity records of stored parse results, only one chunk and one document are
+    in memory at a time
+    @:param documents: media_parsed_data documents, or {'_db_pyr_guid', 'data': parse result} dicts
+    """
+    builder = ChunkBuilder(chunk_size, datum)
+    for document in documents:
+        records = decode_track((document.get('data') or {}).get(FIT_DATA_ACTIVITY_RECORD[0]))
+        if records:
+            yield from builder.add(document.get('_db_pyr_guid') or '', records)
+    chunk = builder.flush()
+    if chunk is not None:
+        yield chunk
@@ -0,0 +1,67 @@
+"""
+export parsed activities of a collection
+
+    python -m app.export.run --format parquet --output tracks.parquet
+    python -m app.export.run --format gpx --output rides.gpx --filter '{"path": {"$regex": "\\.fit$"}}'
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from app.export.columns import iter_chunks
+from app.export.writers import WRITERS, get_writer
+from app.parse.constants import FIT_DATA_ACTIVITY_RECORD
+from app.settings import EXPORT
+
+logger = logging.getLogger(__name__)
+
+_PROJECTION = {'_db_pyr_guid': 1, 'data.' + FIT_DATA_ACTIVITY_RECORD[0]: 1}
+
+
+def export(documents, export_format, path, chunk_size=EXPORT['CHUNK_SIZE'], datum=EXPORT['DATUM']):
+    """
+    stream the activity records of documents into a file
+    :return: the closed writer, with the row and chunk counts
+    """
+    with get_writer(export_format, path) as writer:
+        for chunk in iter_chunks(documents, chunk_size, datum):
+            writer.write(chunk)
+    return writer
+
+
+def export_collection(collection, export_format, path, filter_data=None, chunk_size=EXPORT['CHUNK_SIZE'],
+                      datum=EXPORT['DATUM'], batch_size=EXPORT['BATCH_SIZE']):
+    from app.utils.mongodb import mongodb
+
+    documents = mongodb.iterate(collection, filter_data, _PROJECTION, batch_size)
+    return export(documents, export_format, path, chunk_size, datum)
+
+
+def main(argv=None):
+    from app.utils.mongodb import DB
+
+    parser = argparse.ArgumentParser(description='export parsed activity records')
+    parser.add_argument('--format', default='columnar', choices=['columnar'] + list(WRITERS),
+                        help='columnar is parquet when pyarrow is installed and npz otherwise')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--collection', default=DB.Collections.MEDIA_PARSED_DATA)
+    parser.add_argument('--filter', help='Mongo filter as JSON')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT['CHUNK_SIZE'])
+    parser.add_argument('--batch-size', type=int, default=EXPORT['BATCH_SIZE'])
+    parser.add_argument('--datum', default=EXPORT['DATUM'], help='coordinate system of the exported positions')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    writer = export_collection(args.collection, args.format, args.output,
+                               json.loads(args.filter) if args.filter else None, args.chunk_size, args.datum,
+                               args.batch_size)
+    logger.info('exported %d points in %d chunks to %s in %.1fs'
+                % (writer.rows, writer.chunks, args.output, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+streaming writers of column chunks, every writer keeps at most one chunk in memory
+
+    with get_writer('parquet', path) as writer:
+        for chunk in iter_chunks(documents):
+            writer.write(chunk)
+"""
+import datetime
+import json
+import logging
+import math
+import zipfile
+from typing import Dict
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+from app.base.exceptions import PyrError
+from app.export.columns import SCHEMA
+from app.settings import EXPORT
+
+logger = logging.getLogger(__name__)
+
+
+class ExportError(PyrError):
+    pass
+
+
+def _pyarrow():
+    """
+    pyarrow is optional, None when it is not installed
+    """
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        return None
+
+
+class Writer:
+    format = None
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.chunks = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def open(self):
+        pass
+
+    def write(self, chunk: Dict[str, np.ndarray]):
+        self._write(chunk)
+        self.rows += chunk['parse_id'].size
+        self.chunks += 1
+
+    def _write(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class _ArrowWriter(Writer):
+    def __init__(self, path):
+        super().__init__(path)
+        self._pa = _pyarrow()
+        if self._pa is None:
+            raise ExportError('%s export needs pyarrow, install it or export to npz' % self.format)
+        pa = self._pa
+        self._schema = pa.schema([(name, pa.string() if dtype == 'U' else pa.float64()) for name, dtype, _ in SCHEMA])
+        self._writer = None
+
+    def _batch(self, chunk):
+        pa = self._pa
+        return pa.record_batch([pa.array(chunk[name], type=self._schema.field(name).type, from_pandas=True)
+                                for name, _, _ in SCHEMA], schema=self._schema)
+
+
+class ParquetWriter(_ArrowWriter):
+    format = 'parquet'
+
+    def __init__(self, path, compression=EXPORT['COMPRESSION']):
+        super().__init__(path)
+        self.compression = compression
+
+    def open(self):
+        import pyarrow.parquet
+
+        self._writer = pyarrow.parquet.ParquetWriter(self.path, self._schema, compression=self.compression)
+
+    def _write(self, chunk):
+        # every chunk becomes a row group
+        self._writer.write_table(self._pa.Table.from_batches([self._batch(chunk)]))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ArrowWriter(_ArrowWriter):
+    format = 'arrow'
+
+    def open(self):
+        import pyarrow.ipc
+
+        self._sink = self._pa.OSFile(self.path, 'wb')
+        self._writer = pyarrow.ipc.new_file(self._sink, self._schema)
+
+    def _write(self, chunk):
+        self._writer.write_batch(self._batch(chunk))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+
+
+class NpzWriter(Writer):
+    """
+    chunks are stored as `<column>/<chunk no>.npy` members of one zip file, read them back with read_npz
+    """
+    format = 'npz'
+
+    def open(self):
+        self._zip = zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def _write(self, chunk):
+        for name, _, _ in SCHEMA:
+            with self._zip.open('%s/%06d.npy' % (name, self.chunks), 'w', force_zip64=True) as file:
+                np.lib.format.write_array(file, chunk[name], allow_pickle=False)
+
+    def close(self):
+        if getattr(self, '_zip', None) is not None:
+            self._zip.close()
+            self._zip = None
+
+
+def read_npz(path, columns=None):
+    """
+    read the columns of a npz export
+    :return: {column: array}
+    """
+    ret = {}
+    with zipfile.ZipFile(path) as archive:
+        members = {}
+        for member in sorted(archive.namelist()):
+            column = member.split('/')[0]
+            if columns is None or column in columns:
+                members.setdefault(column, []).append(member)
+        for column, names in members.items():
+            parts = []
+            for name in names:
+                with archive.open(name) as file:
+                    parts.append(np.lib.format.read_array(file, allow_pickle=False))
+            ret[column] = np.concatenate(parts)
+    return ret
+
+
+def _iso_time(timestamp):
+    if math.isnan(timestamp):
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class _TrackWriter(Writer):
+    """
+    writers of one track per parse result, rows of a parse result must be consecutive like iter_chunks makes them
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._file = None
+        self._parse_id = None
+
+    def open(self):
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._start()
+
+    def _write(self, chunk):
+        parse_ids = chunk['parse_id'].tolist()
+        longitude, latitude, altitude = chunk['longitude'].tolist(), chunk['latitude'].tolist(), \
+            chunk['altitude'].tolist()
+        timestamp = chunk['timestamp'].tolist()
+        for i, parse_id in enumerate(parse_ids):
+            if math.isnan(longitude[i]) or math.isnan(latitude[i]):
+                continue
+            if parse_id != self._parse_id:
+                if self._parse_id is not None:
+                    self._end_track()
+                self._parse_id = parse_id
+                self._start_track(parse_id)
+            self._point(longitude[i], latitude[i], altitude[i], timestamp[i])
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._parse_id is not None:
+            self._end_track()
+        self._end()
+        self._file.close()
+        self._file = None
+
+    def _start(self):
+        pass
+
+    def _end(self):
+        pass
+
+    def _start_track(self, parse_id):
+        raise NotImplementedError
+
+    def _end_track(self):
+        raise NotImplementedError
+
+    def _point(self, longitude, latitude, altitude, timestamp):
+        raise NotImplementedError
+
+
+class GpxWriter(_TrackWriter):
+    format = 'gpx'
+
+    def _start(self):
+        self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                         '<gpx version="1.1" creator="flex-travels-parser" '
+                         'xmlns="http://www.topografix.com/GPX/1/1">\n')
+
+    def _end(self):
+        self._file.write('</gpx>\n')
+
+    def _start_track(self, parse_id):
+        self._file.write('<trk><name>%s</name><trkseg>\n' % escape(parse_id))
+
+    def _end_track(self):
+        self._file.write('</trkseg></trk>\n')
+
+    def _point(self, longitude, latitude, altitude, timestamp):
+        point = '<trkpt lat=%s lon=%s>' % (quoteattr('%.7f' % latitude), quoteattr('%.7f' % longitude))
+        if not math.isnan(altitude):
+            point += '<ele>%.1f</ele>' % altitude
+        time = _iso_time(timestamp)
+        if time is not None:
+            point += '<time>%s</time>' % time
+        self._file.write(point + '</trkpt>\n')
+
+
+class GeoJsonWriter(_TrackWriter):
+    """
+    a FeatureCollection with a LineString feature per parse result
+    """
+    format = 'geojson'
+
+    def _start(self):
+        self._file.write('{"type": "FeatureCollection", "features": [\n')
+        self._features = 0
+
+    def _end(self):
+        self._file.write('\n]}\n')
+
+    def _start_track(self, parse_id):
+        if self._features:
+            self._file.write(',\n')
+        self._features += 1
+        self._file.write('{"type": "Feature", "geometry": {"type": "LineString", "coordinates": [')
+        self._points = 0
+        self._times = [None, None]
+
+    def _end_track(self):
+        properties = {'parse_id': self._parse_id, 'points': self._points,
+                      'start_time': _iso_time(self._times[0]) if self._times[0] is not None else None,
+                      'end_time': _iso_time(self._times[1]) if self._times[1] is not None else None}
+        self._file.write(']}, "properties": %s}' % json.dumps(properties, ensure_ascii=False))
+
+    def _point(self, longitude, latitude, altitude, timestamp):
+        if self._points:
+            self._file.write(',')
+        self._points += 1
+        if math.isnan(altitude):
+            self._file.write('[%.7f,%.7f]' % (longitude, latitude))
+        else:
+            self._file.write('[%.7f,%.7f,%.1f]' % (longitude, latitude, altitude))
+        if not math.isnan(timestamp):
+            if self._times[0] is None or timestamp < self._times[0]:
+                self._times[0] = timestamp
+            if self._times[1] is None or timestamp > self._times[1]:
+                self._times[1] = timestamp
+
+
+WRITERS = {cls.format: cls for cls in (ParquetWriter, ArrowWriter, NpzWriter, GpxWriter, GeoJsonWriter)}
+
+
+def get_writer(export_format, path) -> Writer:
+    """
+    @:param export_format: parquet, arrow, npz, gpx, geojson, or columnar for parquet when pyarrow is
+                           installed and npz otherwise
+    """
+    if export_format == 'columnar':
+        export_format = 'parquet' if _pyarrow() is not None else 'npz'
+        logger.info('columnar export as %s' % export_format)
+    if export_format not in WRITERS:
+        raise ExportError('unknown export format %s, use one of %s' % (export_format, ', '.join(WRITERS)))
+    return WRITERS[export_format](path)
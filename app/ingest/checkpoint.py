@@ -0,0 +1,112 @@
+"""
+progress of the ingest daemon in SQLite, so a restart neither parses nor hashes the known files again
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+from app.settings import INGEST
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'  # seen, waiting to settle or for a worker
+STATUS_DONE = 'done'
+STATUS_DUPLICATE = 'duplicate'  # same content as a parsed file
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT,
+    parse_id TEXT,
+    status TEXT,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+CREATE INDEX IF NOT EXISTS files_status ON files (status);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+"""
+
+
+def file_hash(path, block=INGEST['HASH_BLOCK']):
+    """
+    sha1 of the size, the first and the last `block` bytes, cheap for large videos
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        digest.update(str(size).encode('ascii'))
+        digest.update(file.read(block))
+        if size > block:
+            file.seek(max(block, size - block))
+            digest.update(file.read(block))
+    return digest.hexdigest()
+
+
+class IngestCheckpoint:
+    """
+    path, size, mtime and hash of every file seen, with its parse id or error, and the mtime of every
+    directory scanned. only one thread at a time uses it, the one of the daemon loop
+    """
+
+    def __init__(self, path=None):
+        """
+        @:param path: INGEST['CHECKPOINT_PATH'] at the time of the call by default, ':memory:' for a throwaway one
+        """
+        self.path = os.path.expanduser(path or INGEST['CHECKPOINT_PATH'])
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def get(self, path):
+        """
+        :return: (size, mtime_ns, hash, parse_id, status) of a file, None if it is unknown
+        """
+        return self._db.execute('SELECT size, mtime_ns, hash, parse_id, status FROM files WHERE path = ?',
+                                (path,)).fetchone()
+
+    def find_hash(self, file_hash, exclude=None):
+        """
+        :return: (path, parse_id) of a parsed file with the content hash
+        """
+        return self._db.execute('SELECT path, parse_id FROM files WHERE hash = ? AND status = ? AND path != ? '
+                                'LIMIT 1', (file_hash, STATUS_DONE, exclude or '')).fetchone()
+
+    def set(self, path, size, mtime_ns, status, file_hash=None, parse_id=None, error=None):
+        with self._db:
+            self._db.execute('INSERT INTO files (path, size, mtime_ns, hash, parse_id, status, error, updated) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET '
+                             'size = excluded.size, mtime_ns = excluded.mtime_ns, '
+                             'hash = COALESCE(excluded.hash, files.hash), '
+                             'parse_id = COALESCE(excluded.parse_id, files.parse_id), '
+                             'status = excluded.status, error = excluded.error, updated = excluded.updated',
+                             (path, size, mtime_ns, file_hash, parse_id, status, error, time.time()))
+
+    def pending(self):
+        return [row[0] for row in self._db.execute('SELECT path FROM files WHERE status = ?', (STATUS_PENDING,))]
+
+    def dir_mtime(self, path):
+        row = self._db.execute('SELECT mtime_ns FROM dirs WHERE path = ?', (path,)).fetchone()
+        return row[0] if row else None
+
+    def set_dir_mtime(self, path, mtime_ns):
+        with self._db:
+            self._db.execute('INSERT INTO dirs (path, mtime_ns) VALUES (?, ?) '
+                             'ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns', (path, mtime_ns))
+
+    def counts(self):
+        return dict(self._db.execute('SELECT status, COUNT(*) FROM files GROUP BY status').fetchall())
@@ -0,0 +1,289 @@
+"""
+ingest daemon, parses the files devices and sync tools drop into the watched directories
+
+    python -m app.ingest.daemon --directory ~/media
+
+a file is parsed once its size and mtime stayed unchanged for INGEST['SETTLE_SECONDS'], by a bounded pool of
+workers. the progress is kept in an IngestCheckpoint, a restart parses and hashes only the new or changed files
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import signal
+import sys
+import time
+
+from app.ingest.checkpoint import IngestCheckpoint, file_hash, STATUS_PENDING, STATUS_DONE, STATUS_DUPLICATE, \
+    STATUS_FAILED
+from app.ingest.watch import get_watcher
+from app.settings import INGEST, SPATIAL_INDEX, HEATMAP
+from app.utils.metrics import inc, observe
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_file(path, kind, incremental=INGEST['FIT_INCREMENTAL'], index=True):
+    """
+    parse and save a file, runs in the workers
+    @:param index: False to leave the positions out of the spatial index and the heatmap, the daemon adds them
+    :return: (parse id, positions, seconds)
+    """
+    from app.parse.parsers import FitParser, PhotoParser, VideoParser
+
+    start = time.perf_counter()
+    if kind == 'fit':
+        parser = FitParser(path, incremental=incremental)
+    elif kind == 'photo':
+        parser = PhotoParser(path)
+    elif kind == 'video':
+        parser = VideoParser(path)
+    else:
+        raise ValueError('no parser for %s files' % kind)
+    parser.parse()
+    parse_id = parser.save(index=index)
+    return parse_id, parser.positions(), time.perf_counter() - start
+
+
+class IngestDaemon:
+    def __init__(self, directories=INGEST['DIRECTORIES'], checkpoint: IngestCheckpoint = None,
+                 workers=INGEST['WORKERS'], executor=INGEST['EXECUTOR'], watcher=INGEST['WATCHER'],
+                 settle_seconds=INGEST['SETTLE_SECONDS'], full_scan_interval=INGEST['FULL_SCAN_INTERVAL'],
+                 parsers=None):
+        self.directories = [os.path.abspath(os.path.expanduser(i)) for i in directories]
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.executor = executor
+        self.watcher_kind = watcher
+        self.settle_seconds = settle_seconds
+        self.full_scan_interval = full_scan_interval
+        self.parsers = parsers or INGEST['PARSERS']
+        self._index_positions = SPATIAL_INDEX['ENABLED']
+        self._heatmap_tracks = HEATMAP['ENABLED']
+        self._pending = {}  # path -> [size, mtime_ns, stable since]
+        self._running = {}  # future -> (path, size, mtime_ns, hash)
+        self._stopped = False
+        self._pool = None
+        self._watcher = None
+        self._wake = None
+
+    # files
+
+    def _kind(self, path):
+        name = os.path.basename(path)
+        if name.startswith('.') or name.endswith(tuple(INGEST['IGNORE_SUFFIXES'])):
+            return None
+        return self.parsers.get(os.path.splitext(name)[1].lower())
+
+    def _see(self, path):
+        """
+        note a new or changed file, it waits in _pending until it settles
+        """
+        if self._kind(path) is None:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._pending.pop(path, None)
+            return
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        pending = self._pending.get(path)
+        if pending is not None:
+            if pending[0] != size or pending[1] != mtime_ns:
+                self._pending[path] = [size, mtime_ns, time.monotonic()]
+            return
+        known = self.checkpoint.get(path)
+        if known is not None and known[0] == size and known[1] == mtime_ns and known[4] != STATUS_PENDING:
+            return
+        self.checkpoint.set(path, size, mtime_ns, STATUS_PENDING)
+        self._pending[path] = [size, mtime_ns, time.monotonic()]
+
+    def scan(self, directories, full=False):
+        """
+        look for new files, files of the directories with an unchanged mtime are skipped unless full
+        """
+        stack = list(directories)
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+                entries = list(os.scandir(directory))
+            except OSError as err:
+                logger.warning('can not scan %s: %s' % (directory, err))
+                continue
+            changed = full or self.checkpoint.dir_mtime(directory) != mtime_ns
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif changed and entry.is_file():
+                    self._see(entry.path)
+            if changed:
+                self.checkpoint.set_dir_mtime(directory, mtime_ns)
+
+    def _settled(self):
+        now, wall = time.monotonic(), time.time()
+        running = {i[0] for i in self._running.values()}
+        return [path for path, (_, mtime_ns, since) in self._pending.items()
+                if path not in running and now - since >= self.settle_seconds
+                and wall - mtime_ns / 1e9 >= self.settle_seconds]
+
+    def _dispatch(self):
+        for path in self._settled():
+            if len(self._running) >= self.workers * 2:
+                return
+            size, mtime_ns, _ = self._pending.pop(path)
+            try:
+                stat = os.stat(path)
+                if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                    self._pending[path] = [stat.st_size, stat.st_mtime_ns, time.monotonic()]
+                    continue
+                digest = file_hash(path)
+            except OSError as err:
+                logger.info('%s is gone: %s' % (path, err))
+                continue
+            known = self.checkpoint.get(path)
+            if known is not None and known[2] == digest and known[4] in (STATUS_DONE, STATUS_DUPLICATE):
+                # touched only
+                self.checkpoint.set(path, size, mtime_ns, known[4])
+                continue
+            duplicate = self.checkpoint.find_hash(digest, path)
+            if duplicate is not None:
+                logger.info('%s has the content of %s, skip it' % (path, duplicate[0]))
+                self.checkpoint.set(path, size, mtime_ns, STATUS_DUPLICATE, digest, duplicate[1])
+                inc('ingest_files_total', status=STATUS_DUPLICATE)
+                continue
+            # the workers leave the spatial index and the heatmap to the daemon, they are single writer structures
+            future = self._pool.submit(ingest_file, path, self._kind(path), index=False)
+            self._running[future] = (path, size, mtime_ns, digest)
+            future.add_done_callback(self._wake_up)
+
+    def _wake_up(self, _):
+        try:
+            os.write(self._wake[1], b'\0')
+        except OSError:
+            pass
+
+    def _collect(self):
+        for future in [i for i in self._running if i.done()]:
+            path, size, mtime_ns, digest = self._running.pop(future)
+            try:
+                parse_id, positions, seconds = future.result()
+            except Exception as err:
+                logger.error('failed to ingest %s: %s' % (path, err))
+                self.checkpoint.set(path, size, mtime_ns, STATUS_FAILED, digest, error=str(err))
+                inc('ingest_files_total', status=STATUS_FAILED)
+            else:
+                extend = self._kind(path) == 'fit'
+                if self._index_positions and positions is not None:
+                    from app.data.geographic.index import get_spatial_index
+
+                    index = get_spatial_index()
+                    (index.extend if extend else index.add)(parse_id, *positions)
+                if self._heatmap_tracks and positions is not None and positions[2]:
+                    from app.data.geographic.heatmap import get_heatmap
+
+                    heatmap = get_heatmap()
+                    (heatmap.extend if extend else heatmap.add)(parse_id, *positions[:2])
+                self.checkpoint.set(path, size, mtime_ns, STATUS_DONE, digest, parse_id)
+                observe('ingest_parse_seconds', seconds)
+                inc('ingest_files_total', status=STATUS_DONE)
+                logger.info('ingested %s as %s in %.2fs' % (path, parse_id, seconds))
+            # written again while it was parsed
+            self._see(path)
+
+    # loop
+
+    def _timeout(self, next_full_scan):
+        deadlines = []
+        if len(self._running) < self.workers * 2:
+            # a full pool wakes the loop when a worker is done
+            now, wall = time.monotonic(), time.time()
+            running = {i[0] for i in self._running.values()}
+            deadlines = [max(since, now + mtime_ns / 1e9 - wall) + self.settle_seconds
+                         for path, (_, mtime_ns, since) in self._pending.items() if path not in running]
+        if next_full_scan is not None:
+            deadlines.append(next_full_scan)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic()) + 0.01
+
+    def _start(self):
+        if self.checkpoint is None:
+            self.checkpoint = IngestCheckpoint()
+        self._wake = os.pipe()
+        os.set_blocking(self._wake[0], False)
+        os.set_blocking(self._wake[1], False)
+        if self.executor == 'process':
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        else:
+            self._pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='ingest')
+        self._watcher = get_watcher(self.watcher_kind, self.directories, self._wake[0])
+
+    def _shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._collect()
+            self._pool = None
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+        if self._wake is not None:
+            for fd in self._wake:
+                os.close(fd)
+            self._wake = None
+
+    def stop(self):
+        self._stopped = True
+        if self._wake is not None:
+            self._wake_up(None)
+
+    def run(self, once=False):
+        """
+        @:param once: return when every file found by the first scan is ingested
+        """
+        self._start()
+        try:
+            for path in self.checkpoint.pending():
+                self._see(path)
+            self.scan(self.directories)
+            next_full_scan = time.monotonic() + self.full_scan_interval if self.full_scan_interval else None
+            while not self._stopped:
+                self._collect()
+                self._dispatch()
+                if once and not self._pending and not self._running:
+                    break
+                files, directories = self._watcher.wait(self._timeout(next_full_scan))
+                for path in files:
+                    self._see(path)
+                if directories:
+                    self.scan(directories)
+                if next_full_scan is not None and time.monotonic() >= next_full_scan:
+                    self.scan(self.directories, full=True)
+                    next_full_scan = time.monotonic() + self.full_scan_interval
+        finally:
+            self._shutdown()
+        return self.checkpoint.counts()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='parse the files dropped into the media directories')
+    parser.add_argument('--directory', action='append', help='watched directory, can be repeated')
+    parser.add_argument('--checkpoint', default=INGEST['CHECKPOINT_PATH'])
+    parser.add_argument('--workers', type=int, default=INGEST['WORKERS'])
+    parser.add_argument('--executor', default=INGEST['EXECUTOR'], choices=['process', 'thread'])
+    parser.add_argument('--watcher', default=INGEST['WATCHER'], choices=['auto', 'inotify', 'poll'])
+    parser.add_argument('--once', action='store_true', help='ingest what is there and exit')
+    args = parser.parse_args(argv)
+
+    daemon = IngestDaemon(args.directory or INGEST['DIRECTORIES'], IngestCheckpoint(args.checkpoint),
+                          args.workers, args.executor, args.watcher)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: daemon.stop())
+    counts = daemon.run(once=args.once)
+    logger.info('ingest checkpoint: %s' % ', '.join('%s %d' % i for i in sorted(counts.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
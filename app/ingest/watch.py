@@ -0,0 +1,178 @@
+"""
+watchers of the ingest directories, both block in select() while nothing happens so an idle daemon does not spin
+
+    files, directories = watcher.wait(timeout)
+
+files are the paths reported changed, directories the ones to scan
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from app.base.exceptions import PyrError
+from app.settings import INGEST
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT = struct.Struct('iIII')
+
+
+class WatchError(PyrError):
+    pass
+
+
+class Watcher:
+    def __init__(self, directories, wake_fd=None):
+        """
+        @:param wake_fd: readable fd ending a wait, e.g. when a worker finishes
+        """
+        self.directories = [os.path.abspath(os.path.expanduser(i)) for i in directories]
+        self.wake_fd = wake_fd
+
+    def _select(self, fds, timeout):
+        fds = [i for i in fds + [self.wake_fd] if i is not None]
+        if not fds:
+            time.sleep(timeout or 0)
+            return []
+        readable = select.select(fds, [], [], timeout)[0]
+        if self.wake_fd in readable:
+            try:
+                os.read(self.wake_fd, 4096)
+            except BlockingIOError:
+                pass
+        return readable
+
+    def wait(self, timeout=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PollWatcher(Watcher):
+    """
+    scans the directories every `interval` seconds
+    """
+
+    def __init__(self, directories, wake_fd=None, interval=INGEST['POLL_INTERVAL']):
+        super().__init__(directories, wake_fd)
+        self.interval = interval
+        self._next = time.monotonic() + interval
+
+    def wait(self, timeout=None):
+        left = max(0.0, self._next - time.monotonic())
+        self._select([], left if timeout is None else min(timeout, left))
+        if time.monotonic() < self._next:
+            return set(), set()
+        self._next = time.monotonic() + self.interval
+        return set(), set(self.directories)
+
+
+class InotifyWatcher(Watcher):
+    """
+    inotify watches on every directory of the trees, through libc so no extra package is needed
+    """
+
+    def __init__(self, directories, wake_fd=None):
+        super().__init__(directories, wake_fd)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatchError('inotify_init1 failed: %s' % os.strerror(ctypes.get_errno()))
+        self._watches = {}  # watch descriptor -> directory
+        for directory in self.directories:
+            self.add_tree(directory)
+
+    @staticmethod
+    def available():
+        return sys.platform.startswith('linux')
+
+    def add(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logger.warning('out of inotify watches at %s, raise fs.inotify.max_user_watches' % directory)
+            else:
+                logger.warning('can not watch %s: %s' % (directory, os.strerror(error)))
+            return
+        self._watches[wd] = directory
+
+    def add_tree(self, directory):
+        for root, _, _ in os.walk(directory):
+            self.add(root)
+
+    def wait(self, timeout=None):
+        files, directories = set(), set()
+        if self._fd not in self._select([self._fd], timeout):
+            return files, directories
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0'))
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    logger.warning('inotify queue overflow, scan all directories')
+                    directories.update(self.directories)
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                parent = self._watches.get(wd)
+                if parent is None or not name:
+                    continue
+                path = os.path.join(parent, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # files may land in the new directory before it is watched
+                        self.add_tree(path)
+                        directories.add(path)
+                else:
+                    files.add(path)
+        return files, directories
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def get_watcher(kind, directories, wake_fd=None) -> Watcher:
+    """
+    @:param kind: inotify, poll, or auto for inotify when the platform has it
+    """
+    if kind == 'auto':
+        kind = 'inotify' if InotifyWatcher.available() else 'poll'
+    if kind == 'inotify':
+        try:
+            return InotifyWatcher(directories, wake_fd)
+        except (OSError, AttributeError, WatchError) as err:
+            logger.warning('inotify is not usable, poll instead: %s' % err)
+            kind = 'poll'
+    if kind == 'poll':
+        return PollWatcher(directories, wake_fd)
+    raise WatchError('unknown watcher %s, use inotify, poll or auto' % kind)
@@ -0,0 +1,113 @@
+"""
+resource budgets and memory profiling of a single parse
+"""
+import contextlib
+import logging
+import os
+import time
+import tracemalloc
+
+from app.base.exceptions import PyrError
+from app.settings import PARSE_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# the deadline is checked every this many messages, time.monotonic() per message would show in the profile
+_TIME_CHECK_INTERVAL = 256
+
+
+class BudgetExceededError(PyrError):
+    def __init__(self, limit, value, maximum, file_path=None):
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+        self.file_path = file_path
+        super().__init__('%s exceeds the %s budget: %s > %s' % (file_path or 'parse', limit, value, maximum))
+
+
+class ParseBudget:
+    """
+    limits of one parse, a limit of None is unlimited.
+    the timeout is cooperative, it is checked between messages and stages, a single call into a
+    decoding library is not interrupted
+    """
+
+    def __init__(self, max_messages=PARSE_BUDGET['MAX_MESSAGES'], max_points=PARSE_BUDGET['MAX_POINTS'],
+                 max_bytes=PARSE_BUDGET['MAX_BYTES'], timeout=PARSE_BUDGET['TIMEOUT']):
+        self.max_messages = max_messages
+        self.max_points = max_points
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.messages = 0
+        self.points = 0
+        self._file_path = None
+        self._deadline = None
+        self._start = None
+
+    def start(self, file_path, size=None):
+        """
+        reset the counters and check the file size, called before a parse
+        @:param size: size of the input, read from file_path when not given
+        """
+        self._file_path = file_path
+        self.messages = 0
+        self.points = 0
+        self._start = time.monotonic()
+        self._deadline = self._start + self.timeout if self.timeout else None
+        if self.max_bytes is not None:
+            size = os.path.getsize(file_path) if size is None else size
+            if size > self.max_bytes:
+                raise BudgetExceededError('bytes', size, self.max_bytes, file_path)
+
+    def message(self):
+        self.messages += 1
+        if self.max_messages is not None and self.messages > self.max_messages:
+            raise BudgetExceededError('messages', self.messages, self.max_messages, self._file_path)
+        if self._deadline is not None and self.messages % _TIME_CHECK_INTERVAL == 0:
+            self.check_time()
+
+    def point(self, count=1):
+        self.points += count
+        if self.max_points is not None and self.points > self.max_points:
+            raise BudgetExceededError('points', self.points, self.max_points, self._file_path)
+
+    def check_time(self):
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            raise BudgetExceededError('timeout', round(time.monotonic() - self._start, 3), self.timeout,
+                                      self._file_path)
+
+
+@contextlib.contextmanager
+def profiling(top=PARSE_BUDGET['PROFILE_TOP'], frames=PARSE_BUDGET['PROFILE_FRAMES']):
+    """
+    trace the allocations of the block with tracemalloc, the yielded dict is filled on exit with
+    {'seconds', 'peak_bytes', 'retained_bytes', 'top': [{'site', 'size', 'count'}]},
+    `top` are the sites holding the most memory allocated in the block at its end
+    """
+    report = {}
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    else:
+        tracemalloc.reset_peak()
+    ignored = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+    before = tracemalloc.take_snapshot().filter_traces(ignored)
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield report
+    finally:
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(ignored)
+        if started:
+            tracemalloc.stop()
+        sites = [stat for stat in after.compare_to(before, 'traceback') if stat.size_diff > 0][:top]
+        report.update({'seconds': seconds,
+                       'peak_bytes': max(peak - baseline, 0),
+                       'retained_bytes': current - baseline,
+                       'top': [{'site': ' <- '.join('%s:%s' % (frame.filename, frame.lineno)
+                                                    for frame in stat.traceback),
+                                'size': stat.size_diff,
+                                'count': stat.count_diff} for stat in sites],
+                       })
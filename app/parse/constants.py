@@ -3,9 +3,16 @@ FIT_DATA_GEAR = ('gear', ('device_info', 'device_settings'))
 FIT_DATA_ACTIVITY = ('activity', ('session', 'sport', 'activity'))
 FIT_DATA_TRAVELLER = ('traveller', ('user_profile',))
 FIT_DATA_UNCLASSIFIED = ('unclassified',)
+FIT_DATA_UNCLASSIFIED_SUMMARY = ('unclassified_messages',)
+FIT_DATA_VALIDATION = ('validation',)
 PHOTO_DATA_IMAGE = ('image', ('image',))
 PHOTO_DATA_GPS = ('gps', ('gps',))
 PHOTO_DATA_THUMBNAIL = ('thumbnail', ('jpegthumbnail', 'thumbnail'))
 PHOTO_DATA_EXIF = ('exif', ('exif',))
 PHOTO_DATA_MAKER = ('maker', ('makernote',))
 PHOTO_DATA_OTHER = ('other',)
+PHOTO_DATA_HASH = ('hash',)
+VIDEO_DATA_METADATA = ('metadata',)
+VIDEO_DATA_ACTIVITY_RECORD = FIT_DATA_ACTIVITY_RECORD
+VIDEO_DATA_TELEMETRY = ('telemetry',)
+VIDEO_DATA_VALIDATION = FIT_DATA_VALIDATION
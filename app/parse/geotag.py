@@ -0,0 +1,163 @@
+import logging
+import re
+from typing import List, Dict
+
+import numpy as np
+
+from app.data.geographic.constants import COORDINATE_SYSTEM_WGS84
+from app.data.geographic.transform import transform_points
+from app.data.geographic.utils import gps_to_position
+from app.parse.constants import PHOTO_DATA_EXIF, PHOTO_DATA_IMAGE, PHOTO_DATA_GPS, FIT_DATA_ACTIVITY_RECORD
+from app.settings import GEOTAG
+from app.utils.date import to_timestamp
+
+logger = logging.getLogger(__name__)
+
+_EXIF_DATETIME_KEYS = ((PHOTO_DATA_EXIF[0], 'DateTimeOriginal', 'OffsetTimeOriginal'),
+                       (PHOTO_DATA_EXIF[0], 'DateTimeDigitized', 'OffsetTimeDigitized'),
+                       (PHOTO_DATA_IMAGE[0], 'DateTime', 'OffsetTime'))
+_UTC_OFFSET_PATTERN = re.compile(r'^([+-])(\d{2}):?(\d{2})$')
+
+
+def _first(value):
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+    return value
+
+
+def photo_timestamp(photo: Dict, timezone=GEOTAG['CAMERA_TIMEZONE']):
+    """
+    UTC timestamp of a PhotoParser result from its EXIF capture time
+    @:param timezone: camera clock time zone, used when the photo has no EXIF offset time
+    @:return timestamp in second or None
+    """
+    for category, key, offset_key in _EXIF_DATETIME_KEYS:
+        info = photo.get(category) or {}
+        value = _first(info.get(key))
+        if not value or not str(value).strip(' 0:'):
+            continue
+        offset = _UTC_OFFSET_PATTERN.match(str(_first(info.get(offset_key)) or '').strip())
+        if offset is None:
+            timestamp = to_timestamp(value, timezone)
+        else:
+            timestamp = to_timestamp(value, 'UTC')
+            if timestamp is not None:
+                sign = -1 if offset.group(1) == '-' else 1
+                timestamp -= sign * (int(offset.group(2)) * 3600 + int(offset.group(3)) * 60)
+        if timestamp is not None:
+            return timestamp
+    return None
+
+
+def _to_dms(degree):
+    degree = abs(float(degree))
+    d = int(degree)
+    m = int((degree - d) * 60)
+    s = (degree - d - m / 60) * 3600
+    return [d, m, round(s, 4)]
+
+
+class TrackLocator:
+    """
+    position along one or more activity tracks at arbitrary times, built once, queried in batches
+    """
+
+    def __init__(self, activity_records_list: List[List[Dict]], max_gap=GEOTAG['MAX_GAP'],
+                 tolerance=GEOTAG['TOLERANCE']):
+        """
+        @:param activity_records_list: FitParser 'activity_records' of each overlapping activity
+        @:param max_gap: no position is interpolated between points farther apart in second
+        @:param tolerance: photos this many seconds before the first or after the last point snap to it
+        """
+        self.max_gap = max_gap
+        self.tolerance = tolerance
+        points = [dict(record['coordinate']) for records in activity_records_list for record in records
+                  if record and record.get('coordinate') and record['coordinate'].get('timestamp') is not None
+                  and record['coordinate'].get('longitude') is not None
+                  and record['coordinate'].get('latitude') is not None]
+        transform_points(points, COORDINATE_SYSTEM_WGS84)
+
+        timestamps = np.array([p['timestamp'] for p in points], dtype=np.float64)
+        order = np.argsort(timestamps, kind='stable')
+        self.timestamps = timestamps[order]
+        self.longitude = np.array([p['longitude'] for p in points], dtype=np.float64)[order]
+        self.latitude = np.array([p['latitude'] for p in points], dtype=np.float64)[order]
+        self.altitude = np.array([np.nan if p.get('altitude') is None else p['altitude'] for p in points],
+                                 dtype=np.float64)[order]
+
+    def __len__(self):
+        return self.timestamps.size
+
+    def locate(self, timestamps):
+        """
+        interpolate positions at the given times
+        @:param timestamps: array like UTC timestamps in second, None or NaN for unknown
+        @:return (longitude, latitude, altitude, matched) numpy arrays, unmatched entries are NaN
+        """
+        t = np.asarray([np.nan if i is None else i for i in timestamps], dtype=np.float64)
+        longitude = np.full(t.shape, np.nan)
+        latitude = np.full(t.shape, np.nan)
+        altitude = np.full(t.shape, np.nan)
+        if len(self) == 0 or t.size == 0:
+            return longitude, latitude, altitude, np.zeros(t.shape, dtype=bool)
+
+        last = len(self) - 1
+        right = np.clip(np.searchsorted(self.timestamps, t, side='left'), 0, last)
+        left = np.clip(right - 1, 0, last)
+        # before the first or after the last point: snap to it when inside the tolerance
+        before, after = t <= self.timestamps[0], t >= self.timestamps[last]
+        left[before], right[before] = 0, 0
+        left[after], right[after] = last, last
+
+        t0, t1 = self.timestamps[left], self.timestamps[right]
+        span = t1 - t0
+        matched = ~np.isnan(t) & (span <= self.max_gap)
+        matched &= ~(before & (self.timestamps[0] - t > self.tolerance))
+        matched &= ~(after & (t - self.timestamps[last] > self.tolerance))
+
+        ratio = np.where(span > 0, (t - t0) / np.where(span > 0, span, 1), 0.0)
+        for target, source in ((longitude, self.longitude), (latitude, self.latitude), (altitude, self.altitude)):
+            value = source[left] + ratio * (source[right] - source[left])
+            target[matched] = value[matched]
+        matched &= ~(np.isnan(longitude) | np.isnan(latitude))
+        return longitude, latitude, altitude, matched
+
+
+def geotag_photos(photos: List[Dict], activity_records_list: List[List[Dict]], clock_offset=0,
+                  timezone=GEOTAG['CAMERA_TIMEZONE'], overwrite=False, locator: TrackLocator = None):
+    """
+    infer the GPS of photos from the tracks recorded at the same time and write it into their 'gps' info
+    @:param photos: PhotoParser results, updated in place
+    @:param activity_records_list: FitParser 'activity_records' of the overlapping activities
+    @:param clock_offset: seconds to add to the camera clock to get the true time
+    @:param timezone: camera clock time zone, used when the photo has no EXIF offset time
+    @:param overwrite: replace the GPS of photos which already have a position
+    @:return number of photos geotagged
+    """
+    locator = locator or TrackLocator(activity_records_list)
+    targets = []
+    timestamps = []
+    for photo in photos:
+        if not overwrite and gps_to_position(photo.get(PHOTO_DATA_GPS[0]))[0] is not None:
+            continue
+        timestamp = photo_timestamp(photo, timezone)
+        if timestamp is None:
+            continue
+        targets.append(photo)
+        timestamps.append(timestamp + clock_offset)
+
+    longitude, latitude, altitude, matched = locator.locate(timestamps)
+    count = 0
+    for i in np.nonzero(matched)[0].tolist():
+        gps_info = {'GPSLatitude': _to_dms(latitude[i]), 'GPSLatitudeRef': 'N' if latitude[i] >= 0 else 'S',
+                    'GPSLongitude': _to_dms(longitude[i]), 'GPSLongitudeRef': 'E' if longitude[i] >= 0 else 'W',
+                    'GPSMapDatum': COORDINATE_SYSTEM_WGS84,
+                    '_inferred': {'source': FIT_DATA_ACTIVITY_RECORD[0], 'timestamp': int(timestamps[i]),
+                                  'clock_offset': clock_offset}}
+        if not np.isnan(altitude[i]):
+            gps_info.update({'GPSAltitude': round(abs(float(altitude[i])), 2),
+                             'GPSAltitudeRef': 0 if altitude[i] >= 0 else 1})
+        targets[i][PHOTO_DATA_GPS[0]] = gps_info
+        count += 1
+    logger.debug('%s of %s photos geotagged from %s track points' % (count, len(photos), len(locator)))
+    return count
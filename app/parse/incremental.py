@@ -0,0 +1,238 @@
+import hashlib
+import io
+import logging
+import os
+import pickle
+import struct
+
+import fitparse
+from fitparse import records as fit_records
+from fitparse.processors import FitFileDataProcessor
+from fitparse.utils import FitEOFError, fileish_open
+
+from app.base.exceptions import PyrError
+from app.settings import FIT_INCREMENTAL
+
+logger = logging.getLogger(__name__)
+
+_FINGERPRINT_SIZE = 256
+
+
+class CheckpointError(PyrError):
+    pass
+
+
+class FitCheckpoint:
+    """
+    decoder state of a FIT file after the last decoded message,
+    enough to decode the data appended later without reading the file from byte 0 again
+    """
+
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(file_path)
+        self.fingerprint = None
+        self.fingerprint_size = 0
+        self.offset = 0  # end of the last complete message
+        self.segment_start = 0  # header of the current FIT file in a chained file
+        self.segment_header_size = 0
+        self.segment_done = False  # the CRC of the current segment has been consumed
+        self.definitions = {}  # raw definition messages by local message number
+        self.accumulators = {}
+        self.compressed_ts_accumulator = 0
+        self.dev_types = {}
+        self.message_count = 0
+        self.record_count = 0
+        self.parse_id = None
+
+
+class FitCheckpointStore:
+    """
+    pickled checkpoints in a directory, one file per FIT file path
+    """
+
+    def __init__(self, root=None):
+        """
+        @:param root: FIT_INCREMENTAL['CHECKPOINT_ROOT'] at the time of the call by default
+        """
+        self.root = os.path.expanduser(root or FIT_INCREMENTAL['CHECKPOINT_ROOT'])
+
+    def _path(self, file_path):
+        key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, key + '.pkl')
+
+    def load(self, file_path):
+        path = self._path(file_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as err:
+            logger.warning('drop unreadable checkpoint %s of %s: %s' % (path, file_path, err))
+            return None
+
+    def save(self, checkpoint: FitCheckpoint):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(checkpoint.file_path)
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def delete(self, file_path):
+        path = self._path(file_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _fingerprint(file_obj, start, header_size, size=_FINGERPRINT_SIZE):
+    """
+    hash of the segment header without its data size and of the first data bytes,
+    changes when the file is replaced rather than appended to
+    :return: (hash, number of data bytes hashed)
+    """
+    file_obj.seek(start)
+    header = bytearray(file_obj.read(header_size))
+    if len(header) >= 8:
+        header[4:8] = b'\x00\x00\x00\x00'
+    data = file_obj.read(size)
+    return hashlib.sha1(bytes(header) + data).hexdigest(), len(data)
+
+
+def _dump_dev_types():
+    return {index: {'dev_data_index': dev_type['dev_data_index'], 'application_id': dev_type['application_id'],
+                    'fields': {num: {'def_num': field.def_num, 'base_type': field.type.identifier, 'name': field.name,
+                                     'units': field.units, 'native_field_num': field.native_field_num}
+                               for num, field in dev_type['fields'].items()}}
+            for index, dev_type in fit_records.DEV_TYPES.items()}
+
+
+def _load_dev_types(dev_types):
+    for index, dev_type in dev_types.items():
+        fields = {num: fit_records.DevField(dev_data_index=index, def_num=field['def_num'],
+                                            type=fit_records.BASE_TYPES[field['base_type']], name=field['name'],
+                                            units=field['units'], native_field_num=field['native_field_num'])
+                  for num, field in dev_type['fields'].items()}
+        fit_records.DEV_TYPES[index] = dict(dev_type, fields=fields)
+
+
+class ResumableFitFile(fitparse.FitFile):
+    """
+    FitFile which stops cleanly at the current end of a growing file, and continues from a FitCheckpoint.
+    the CRC can not be verified while a file is still growing, so it is not checked
+    """
+
+    def __init__(self, fileish, checkpoint: FitCheckpoint = None):
+        self._message_start = 0
+        self._segment_start = 0
+        self._segment_header_size = 0
+        self._definitions = {}
+        self._pending_header = False  # the CRC of the last segment has been read, a chained file may follow
+        self.truncated = False
+        if checkpoint is None:
+            super().__init__(fileish, check_crc=False)
+            return
+
+        self._file = fileish_open(fileish, 'rb')
+        self.check_crc = False
+        self._crc = fit_records.Crc()
+        self._processor = FitFileDataProcessor()
+        self._file.seek(0, os.SEEK_END)
+        self._filesize = self._file.tell()
+        self._messages = []
+        self._restore(checkpoint)
+
+    def _restore(self, checkpoint: FitCheckpoint):
+        if self._filesize < checkpoint.offset or checkpoint.fingerprint != _fingerprint(
+                self._file, checkpoint.segment_start, checkpoint.segment_header_size, checkpoint.fingerprint_size)[0]:
+            raise CheckpointError('%s has been replaced since the last checkpoint' % checkpoint.file_path)
+
+        _load_dev_types(checkpoint.dev_types)
+        self._segment_start = checkpoint.segment_start
+        self._segment_header_size = checkpoint.segment_header_size
+        self._local_mesgs = {}
+        self._accumulators = {}
+        self._bytes_left = 0
+        for raw in checkpoint.definitions.values():
+            self._replay_definition(raw)
+        self._definitions = dict(checkpoint.definitions)
+        self._accumulators = {k: dict(v) for k, v in checkpoint.accumulators.items()}
+        self._compressed_ts_accumulator = checkpoint.compressed_ts_accumulator
+        self._complete = False
+        self._file.seek(checkpoint.offset)
+
+        if checkpoint.segment_done:
+            self._bytes_left = 0
+            self._pending_header = True
+        else:
+            # the uploader may have rewritten the data size in the header since the last call
+            self._file.seek(self._segment_start + 4)
+            data_size = struct.unpack('<I', self._file.read(4))[0]
+            self._file.seek(checkpoint.offset)
+            self._bytes_left = self._segment_start + self._segment_header_size + data_size - checkpoint.offset
+
+    def _replay_definition(self, raw):
+        """
+        decode a stored definition message, the profile fields it refers to can not be pickled
+        """
+        file_obj, bytes_left = self._file, self._bytes_left
+        self._file, self._bytes_left = io.BytesIO(raw), len(raw)
+        try:
+            self._parse_definition_message(self._parse_message_header())
+        finally:
+            self._file, self._bytes_left = file_obj, bytes_left
+
+    def _parse_file_header(self):
+        self._segment_start = self._file.tell()
+        self._definitions = {}
+        super()._parse_file_header()
+        self._segment_header_size = self._file.tell() - self._segment_start
+
+    def _parse_message(self):
+        if self._complete:
+            return None
+        self._message_start = self._file.tell()
+        # a chained file header resets the decoder state, keep it to roll back a partial read
+        state = (self._bytes_left, self._pending_header, self._segment_start, self._segment_header_size,
+                 self._local_mesgs, self._definitions, self._accumulators, self._compressed_ts_accumulator)
+        try:
+            if self._pending_header:
+                if self._file.tell() >= self._filesize:
+                    self._complete = True
+                    return None
+                # a chained FIT file has been appended
+                self._parse_file_header()
+                self._pending_header = False
+            message = super()._parse_message()
+        except FitEOFError:
+            # the rest of the message has not been uploaded yet, stop before it
+            self._file.seek(self._message_start)
+            self._bytes_left, self._pending_header, self._segment_start, self._segment_header_size, \
+                self._local_mesgs, self._definitions, self._accumulators, self._compressed_ts_accumulator = state
+            self._complete = True
+            self.truncated = True
+            return None
+
+        if isinstance(message, fit_records.DefinitionMessage):
+            end = self._file.tell()
+            self._file.seek(self._message_start)
+            self._definitions[message.header.local_mesg_num] = self._file.read(end - self._message_start)
+        return message
+
+    def checkpoint(self, checkpoint: FitCheckpoint):
+        """
+        store the decoder state after the last complete message into checkpoint
+        """
+        position = self._message_start if self.truncated else self._filesize if self._file is None \
+            else self._file.tell()
+        with open(checkpoint.file_path, 'rb') as file_obj:
+            checkpoint.fingerprint, checkpoint.fingerprint_size = _fingerprint(
+                file_obj, self._segment_start, self._segment_header_size)
+        checkpoint.offset = position
+        checkpoint.segment_start = self._segment_start
+        checkpoint.segment_header_size = self._segment_header_size
+        checkpoint.segment_done = self._pending_header or (not self.truncated and self._bytes_left <= 0)
+        checkpoint.definitions = dict(self._definitions)
+        checkpoint.accumulators = {k: dict(v) for k, v in self._accumulators.items()}
+        checkpoint.compressed_ts_accumulator = self._compressed_ts_accumulator
+        checkpoint.dev_types = _dump_dev_types()
+        return checkpoint
@@ -0,0 +1,257 @@
+"""
+luminance of baseline JPEG images, e.g. the EXIF thumbnails of photos.
+
+only the Huffman coded sequential process (SOF0/SOF1) of the camera thumbnails is decoded, the color components
+are skipped over and progressive or arithmetic coded images are rejected
+
+    pixels = decode_luma(jpeg)  # height x width float64 array, 0 to 255
+"""
+import re
+import struct
+
+import numpy as np
+
+from app.base.exceptions import PyrError
+
+_BASELINE = {0xC0, 0xC1}
+_UNSUPPORTED = {0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_RESTART = set(range(0xD0, 0xD8))
+_RESTART_MARKER = re.compile(b'\xff[\xd0-\xd7]')
+# natural order index of the coefficients in zig-zag order
+_ZIGZAG = sorted(range(64), key=lambda i: (i // 8 + i % 8, i // 8 if (i // 8 + i % 8) % 2 else i % 8))
+
+
+def _idct_matrix():
+    n = np.arange(8)
+    ret = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / 16) * 0.5
+    ret[0] /= np.sqrt(2)
+    return ret
+
+
+_IDCT = _idct_matrix()
+
+
+class JpegError(PyrError):
+    pass
+
+
+def _ceil(a, b):
+    return -(-a // b)
+
+
+def _huffman_table(counts, symbols):
+    """
+    lookup of 16 bit windows to (code length, symbol), length 0 for no code
+    """
+    lengths = np.zeros(1 << 16, dtype=np.int64)
+    values = np.zeros(1 << 16, dtype=np.int64)
+    code, index = 0, 0
+    for length, count in enumerate(counts, 1):
+        for _ in range(count):
+            start, end = code << (16 - length), (code + 1) << (16 - length)
+            if end > 1 << 16:
+                raise JpegError('invalid Huffman table')
+            lengths[start:end] = length
+            values[start:end] = symbols[index]
+            code += 1
+            index += 1
+        code <<= 1
+    return list(zip(lengths.tolist(), values.tolist()))
+
+
+def _windows(data: bytes):
+    """
+    the 16 bits starting at every bit of the entropy coded data, padded by 1 bits as the encoder does
+    """
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).astype(np.int64)
+    bits = np.concatenate((bits, np.ones(32, dtype=np.int64)))
+    ret = np.zeros(bits.size - 16, dtype=np.int64)
+    for shift in range(16):
+        ret |= bits[shift:shift + ret.size] << (15 - shift)
+    return ret.tolist(), 8 * len(data)
+
+
+def _receive(value, size):
+    """
+    the signed value of `size` additional bits
+    """
+    return value if value >= 1 << (size - 1) else value - (1 << size) + 1
+
+
+def _decode_block(windows, position, dc_table, ac_table, block):
+    """
+    decode the zig-zag coefficients of a block into `block`, the DC one as the difference to the last block
+    :return: position after the block
+    """
+    length, size = dc_table[windows[position]]
+    if not length:
+        raise JpegError('invalid DC code at bit %d' % position)
+    position += length
+    block[0] = _receive(windows[position] >> (16 - size), size) if size else 0
+    position += size
+    k = 1
+    while k < 64:
+        length, symbol = ac_table[windows[position]]
+        if not length:
+            raise JpegError('invalid AC code at bit %d' % position)
+        position += length
+        run, size = symbol >> 4, symbol & 15
+        if not size:
+            if run != 15:
+                break
+            k += 16
+            continue
+        k += run
+        if k > 63:
+            raise JpegError('coefficient out of the block at bit %d' % position)
+        block[k] = _receive(windows[position] >> (16 - size), size)
+        position += size
+        k += 1
+    return position
+
+
+def _segments(data):
+    """
+    yield (marker, payload) of the segments before the first scan and of every scan, the entropy coded data of a
+    scan follows it as (None, data)
+    """
+    if data[:2] != b'\xff\xd8':
+        raise JpegError('not a JPEG image')
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise JpegError('no marker at %d' % offset)
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0xD9:
+            return
+        size = struct.unpack_from('>H', data, offset + 2)[0]
+        yield marker, data[offset + 4:offset + 2 + size]
+        offset += 2 + size
+        if marker == 0xDA:
+            end = offset
+            while True:
+                end = data.find(b'\xff', end)
+                if end < 0 or end + 1 >= len(data):
+                    end = len(data)
+                    break
+                if data[end + 1] and data[end + 1] not in _RESTART:
+                    break
+                end += 2
+            yield None, data[offset:end]
+            offset = end
+
+
+def decode_luma(data: bytes) -> np.ndarray:
+    """
+    the luminance of a baseline JPEG image
+    :return: height x width float64 array
+    """
+    try:
+        return _decode_luma(bytes(data))
+    except (IndexError, KeyError, struct.error) as err:
+        raise JpegError('truncated or corrupt JPEG image: %r' % err)
+
+
+def _decode_luma(data):
+    quantization, huffman, frame, restart = {}, {}, None, 0
+    coefficients, scan = None, None
+    for marker, payload in _segments(data):
+        if marker == 0xDB:
+            offset = 0
+            while offset < len(payload):
+                precision, table = payload[offset] >> 4, payload[offset] & 15
+                dtype = '>u2' if precision else 'u1'
+                values = np.frombuffer(payload, dtype=dtype, count=64, offset=offset + 1).astype(np.float64)
+                quantization[table] = values
+                offset += 1 + 64 * (2 if precision else 1)
+        elif marker == 0xC4:
+            offset = 0
+            while offset < len(payload):
+                counts = list(payload[offset + 1:offset + 17])
+                symbols = list(payload[offset + 17:offset + 17 + sum(counts)])
+                huffman[payload[offset] >> 4, payload[offset] & 15] = _huffman_table(counts, symbols)
+                offset += 17 + sum(counts)
+        elif marker == 0xDD:
+            restart = struct.unpack_from('>H', payload)[0]
+        elif marker in _UNSUPPORTED:
+            raise JpegError('unsupported JPEG process, SOF%d' % (marker - 0xC0))
+        elif marker in _BASELINE:
+            if payload[0] != 8:
+                raise JpegError('unsupported sample precision %d' % payload[0])
+            height, width, count = struct.unpack_from('>HHB', payload, 1)
+            if not height or not width or not count:
+                raise JpegError('empty image of %d x %d' % (width, height))
+            components = [(payload[6 + 3 * i], payload[7 + 3 * i] >> 4, payload[7 + 3 * i] & 15,
+                           payload[8 + 3 * i]) for i in range(count)]
+            h_max, v_max = max(i[1] for i in components), max(i[2] for i in components)
+            frame = (height, width, components, h_max, v_max)
+            luma = components[0]
+            # the blocks of the MCUs, padded to whole MCUs
+            coefficients = np.zeros((_ceil(height, 8 * v_max) * luma[2], _ceil(width, 8 * h_max) * luma[1], 64))
+        elif marker == 0xDA:
+            if frame is None:
+                raise JpegError('scan before the frame header')
+            scan = [(payload[1 + 2 * i], payload[2 + 2 * i] >> 4, payload[2 + 2 * i] & 15)
+                    for i in range(payload[0])]
+        elif marker is None and scan is not None:
+            _decode_scan(payload, frame, scan, huffman, restart, coefficients)
+            scan = None
+    if frame is None:
+        raise JpegError('no frame header')
+    height, width, components, h_max, v_max = frame
+    luma = components[0]
+    blocks = np.zeros(coefficients.shape)
+    blocks[..., _ZIGZAG] = coefficients * quantization[luma[3]]
+    blocks = _IDCT.T @ blocks.reshape(blocks.shape[:2] + (8, 8)) @ _IDCT
+    pixels = blocks.transpose(0, 2, 1, 3).reshape(blocks.shape[0] * 8, blocks.shape[1] * 8) + 128
+    return np.clip(pixels[:_ceil(height * luma[2], v_max), :_ceil(width * luma[1], h_max)], 0, 255)
+
+
+def _decode_scan(data, frame, scan, huffman, restart, coefficients):
+    """
+    decode the luminance blocks of a scan into coefficients, the DC ones as values
+    """
+    height, width, components, h_max, v_max = frame
+    sampling = {i[0]: i[1:3] for i in components}
+    luma = components[0][0]
+    if len(scan) == 1:
+        if scan[0][0] != luma:
+            return
+        # a scan of one component has no MCU padding
+        h, v = sampling[luma]
+        rows, columns = _ceil(_ceil(height * v, v_max), 8), _ceil(_ceil(width * h, h_max), 8)
+        layout = [(scan[0], 1, 1)]
+    else:
+        rows, columns = _ceil(height, 8 * v_max), _ceil(width, 8 * h_max)
+        layout = [(i, sampling[i[0]][0], sampling[i[0]][1]) for i in scan]
+    tables = [(huffman[0, dc], huffman[1, ac]) for _, dc, ac in (i[0] for i in layout)]
+
+    intervals = _RESTART_MARKER.split(data) if restart else [data]
+    mcus = rows * columns
+    per_interval = restart or mcus
+    block = [0] * 64
+    mcu = 0
+    for interval in intervals:
+        windows, size = _windows(interval.replace(b'\xff\x00', b'\xff'))
+        position = 0
+        predictions = [0] * len(layout)
+        for _ in range(min(per_interval, mcus - mcu)):
+            row, column = divmod(mcu, columns)
+            for index, ((component, _, _), h, v) in enumerate(layout):
+                dc_table, ac_table = tables[index]
+                for y in range(v):
+                    for x in range(h):
+                        block[:] = [0] * 64
+                        position = _decode_block(windows, position, dc_table, ac_table, block)
+                        predictions[index] += block[0]
+                        block[0] = predictions[index]
+                        if component == luma:
+                            coefficients[row * v + y, column * h + x] = block
+            mcu += 1
+            if position > size + 8:
+                raise JpegError('entropy coded data ends early')
+        if mcu >= mcus:
+            break
@@ -0,0 +1,278 @@
+"""
+merge the activity records of several files into one timeline, e.g. the daily files of a tour or the files of
+two devices recording the same ride
+
+    merger = TimelineMerger([FitParser(path).iter_records() for path in paths], names=['edge', 'watch'])
+    for record in merger:
+        ...
+    merger.summary()
+
+sources are merged by timestamp with a heap, records of the sources closer than MERGE['RESOLUTION'] become
+one record taking each field from the preferred source having it. only the head record of every source is in
+memory, the sources must be in time order
+"""
+import heapq
+import logging
+from typing import Dict, Iterable, List
+
+from app.data.codec import iter_track, TrackEncoder
+from app.data.geographic.utils import distance
+from app.parse.constants import FIT_DATA_ACTIVITY_RECORD, FIT_DATA_ACTIVITY
+from app.settings import MERGE
+
+logger = logging.getLogger(__name__)
+
+# (field, record part, keys), the position keys go together so a point is never mixed from two devices
+_FIELDS = (
+    ('position', 'coordinate', ('longitude', 'latitude', 'datum', 'address')),
+    ('altitude', 'coordinate', ('altitude',)),
+    ('speed', 'physiologic', ('speed',)),
+    ('heart_rate', 'physiologic', ('heart_rate',)),
+    ('power', 'physiologic', ('power',)),
+    ('temperature', 'environment', ('temperature',)),
+    ('gradient', 'environment', ('gradient',)),
+)
+_PARTS = ('coordinate', 'physiologic', 'environment')
+
+
+def record_timestamp(record: Dict):
+    for part in _PARTS:
+        value = (record.get(part) or {}).get('timestamp')
+        if value is not None:
+            return value
+    return None
+
+
+def _iter_source(source):
+    """
+    records of a parse result, a stored media_parsed_data document, a FitParser or any record iterable
+    """
+    if hasattr(source, 'iter_records'):
+        return source.iter_records()
+    if isinstance(source, dict):
+        data = source.get('data') if isinstance(source.get('data'), dict) else source
+        return iter_track(data.get(FIT_DATA_ACTIVITY_RECORD[0]))
+    return iter(source)
+
+
+class ActivitySummary:
+    """
+    activity summary of a record stream, updated record by record
+    """
+
+    def __init__(self, max_gap=MERGE['MAX_GAP'], moving_speed=MERGE['MOVING_SPEED'],
+                 ascent_threshold=MERGE['ASCENT_THRESHOLD']):
+        self.max_gap = max_gap
+        self.moving_speed = moving_speed
+        self.ascent_threshold = ascent_threshold
+        self.records = 0
+        self.start_time = self.end_time = None
+        self.start_position = None
+        self.total_distance = 0.0
+        self.total_timer_time = 0.0
+        self.total_moving_time = 0.0
+        self.total_ascent = self.total_descent = 0.0
+        self.bounds = None  # [min longitude, min latitude, max longitude, max latitude]
+        self._sums = {}  # key -> [sum, count, max]
+        self._position = None
+        self._altitude = None  # altitude of the last counted climb or descent
+
+    def _value(self, key, value):
+        if value is None:
+            return
+        stat = self._sums.get(key)
+        if stat is None:
+            self._sums[key] = [value, 1, value]
+        else:
+            stat[0] += value
+            stat[1] += 1
+            if value > stat[2]:
+                stat[2] = value
+
+    def add(self, record: Dict):
+        timestamp = record_timestamp(record)
+        if timestamp is None:
+            return
+        self.records += 1
+        gap = timestamp - self.end_time if self.end_time is not None else None
+        if self.start_time is None:
+            self.start_time = timestamp
+        self.end_time = timestamp
+
+        physiologic = record.get('physiologic') or {}
+        speed = physiologic.get('speed')
+        for key in ('speed', 'heart_rate', 'power'):
+            self._value(key, physiologic.get(key))
+        self._value('temperature', (record.get('environment') or {}).get('temperature'))
+        if gap is not None and gap <= self.max_gap:
+            self.total_timer_time += gap
+            if speed is not None and speed >= self.moving_speed:
+                self.total_moving_time += gap
+
+        coordinate = record.get('coordinate') or {}
+        longitude, latitude = coordinate.get('longitude'), coordinate.get('latitude')
+        if longitude is not None and latitude is not None:
+            if self._position is None:
+                self.start_position = (longitude, latitude)
+                self.bounds = [longitude, latitude, longitude, latitude]
+            else:
+                self.total_distance += distance(self._position[0], self._position[1], longitude, latitude)
+                self.bounds = [min(self.bounds[0], longitude), min(self.bounds[1], latitude),
+                               max(self.bounds[2], longitude), max(self.bounds[3], latitude)]
+            self._position = (longitude, latitude)
+
+        altitude = coordinate.get('altitude')
+        if altitude is not None:
+            if self._altitude is None:
+                self._altitude = altitude
+            elif altitude - self._altitude >= self.ascent_threshold:
+                self.total_ascent += altitude - self._altitude
+                self._altitude = altitude
+            elif self._altitude - altitude >= self.ascent_threshold:
+                self.total_descent += self._altitude - altitude
+                self._altitude = altitude
+
+    def result(self) -> Dict:
+        """
+        the summary with the field names of Activity, speed in km/h, distance and altitude in meter
+        """
+        ret = {'start_time': self.start_time,
+               'timestamp': self.end_time,
+               'total_elapsed_time': self.end_time - self.start_time if self.start_time is not None else None,
+               'total_timer_time': self.total_timer_time,
+               'total_moving_time': self.total_moving_time,
+               'total_distance': self.total_distance,
+               'total_ascent': self.total_ascent,
+               'total_descent': self.total_descent,
+               'start_position': self.start_position,
+               'swc_position': tuple(self.bounds[:2]) if self.bounds else None,
+               'nec_position': tuple(self.bounds[2:]) if self.bounds else None,
+               'records': self.records}
+        for key, (total, count, maximum) in self._sums.items():
+            ret['avg_%s' % key] = total / count
+            ret['max_%s' % key] = maximum
+        return ret
+
+
+class TimelineMerger:
+    def __init__(self, sources: List, names: List[str] = None, preferences: Dict = None,
+                 resolution=MERGE['RESOLUTION'], summary: ActivitySummary = None):
+        """
+        @:param sources: parse results, stored documents, FitParsers or record iterables, each in time order
+        @:param names: names of the sources used by preferences, 'source<n>' by default
+        @:param preferences: {field: [source names]} preferred sources per field, MERGE['PREFERENCES'] by default
+        """
+        self.sources = sources
+        self.names = list(names) if names is not None else ['source%d' % i for i in range(len(sources))]
+        self.resolution = resolution
+        preferences = MERGE['PREFERENCES'] if preferences is None else preferences
+        # field -> source indexes, best first
+        self._ranks = {}
+        for field, _, _ in _FIELDS:
+            preferred = [self.names.index(name) for name in preferences.get(field, ()) if name in self.names]
+            self._ranks[field] = preferred + [i for i in range(len(sources)) if i not in preferred]
+        self._summary = summary or ActivitySummary()
+        self.counts = [0] * len(sources)
+        self.merged = 0  # records folded into a record of another source
+        self.late = 0  # records older than the merged timeline, their source is not in time order
+        self.untimed = 0
+
+    def _bucket(self, timestamp):
+        return timestamp // self.resolution if self.resolution else timestamp
+
+    def _combine(self, group):
+        """
+        one record out of the records of the sources at the same time
+        """
+        by_source = {}
+        for index, record in group:
+            by_source.setdefault(index, record)
+        self.merged += len(group) - 1
+        ret = {}
+        for field, part, keys in _FIELDS:
+            for index in self._ranks[field]:
+                data = by_source.get(index, {}).get(part)
+                if not data or data.get(keys[0]) is None:
+                    continue
+                target = ret.setdefault(part, {'timestamp': data.get('timestamp'), 'time': data.get('time')})
+                target.update({key: data.get(key) for key in keys if key in data})
+                break
+        return ret
+
+    def __iter__(self):
+        heap = []
+        iterators = [_iter_source(source) for source in self.sources]
+
+        def push(index):
+            for record in iterators[index]:
+                timestamp = record_timestamp(record) if record else None
+                if timestamp is None:
+                    self.untimed += 1
+                    continue
+                self.counts[index] += 1
+                heapq.heappush(heap, (timestamp, index, self.counts[index], record))
+                return
+
+        for index in range(len(iterators)):
+            push(index)
+
+        group, bucket = [], None
+        while heap:
+            timestamp, index, _, record = heapq.heappop(heap)
+            push(index)
+            current = self._bucket(timestamp)
+            if bucket is not None and current < bucket:
+                self.late += 1
+                continue
+            if group and current != bucket:
+                yield self._emit(group)
+                group = []
+            bucket = current
+            group.append((index, record))
+        if group:
+            yield self._emit(group)
+
+    def _emit(self, group):
+        record = group[0][1] if len(group) == 1 else self._combine(group)
+        self._summary.add(record)
+        return record
+
+    def summary(self) -> Dict:
+        """
+        the activity summary of the records merged so far, with the record counts per source
+        """
+        ret = self._summary.result()
+        ret.update({'sources': dict(zip(self.names, self.counts)), 'merged': self.merged, 'late': self.late,
+                    'untimed': self.untimed})
+        return ret
+
+
+def merge_parse_results(sources: List, names: List[str] = None, preferences: Dict = None) -> Dict:
+    """
+    a parse result of the merged timeline, its activity records encoded chunk by chunk on the way
+    """
+    merger = TimelineMerger(sources, names, preferences)
+    encoder = TrackEncoder()
+    encoder.extend(merger)
+    return {FIT_DATA_ACTIVITY_RECORD[0]: encoder.result(), FIT_DATA_ACTIVITY[0]: [merger.summary()]}
+
+
+def merge_stored(parse_ids: Iterable[str], names: List[str] = None, preferences: Dict = None, db=None,
+                 collection=None, by_user=None):
+    """
+    merge stored parse results into a new one
+    :return: parse id of the merged result
+    """
+    if db is None:
+        from app.utils.mongodb import mongodb as db
+    collection = collection or db.Collections.MEDIA_PARSED_DATA
+    parse_ids = list(parse_ids)
+    projection = {'_db_pyr_guid': True, 'data.' + FIT_DATA_ACTIVITY_RECORD[0]: True}
+    # the tracks stay encoded, they are decoded a chunk at a time while merging
+    sources = [next(db.iterate(collection, {'_db_pyr_guid': parse_id}, projection, decode_tracks=False), None)
+               for parse_id in parse_ids]
+    missing = [parse_id for parse_id, source in zip(parse_ids, sources) if source is None]
+    if missing:
+        raise KeyError('parse results %s not found' % ', '.join(missing))
+    result = merge_parse_results(sources, names or parse_ids, preferences)
+    return db.insert(collection, {'data': result, 'merged_from': parse_ids}, by_user)
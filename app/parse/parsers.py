@@ -2,26 +2,35 @@ import abc
 import base64
 import logging
 import os
+import struct
 from typing import Dict
 
-import exifread
-import fitparse
-
 from app.base.exceptions import PyrTypeError, PyrError
 from app.data.models import Environment, Physiologic, Activity, DataModel, Gear, TravellerProfile, Unclassified
 from app.data.geographic.constants import COORDINATE_SYSTEM_WGS84
-from app.data.geographic.utils import mps_to_kph
-from app.settings import DATA_MODEL
+from app.data.geographic.utils import mps_to_kph, gps_to_position
+from app.settings import DATA_MODEL, SPATIAL_INDEX, GEOCODING, PARSE_BUDGET, VIDEO, TRACK_CODEC, REGISTRY, \
+    MERGE, ROLLUP, HEATMAP, DEDUPE
 from app.data.geographic.models import Coordinate
+from app.parse.budget import ParseBudget, BudgetExceededError, profiling
+from app.parse.source import ParseSource
+from app.parse.unclassified import UnclassifiedCollector
 from app.parse.constants import FIT_DATA_ACTIVITY_RECORD, FIT_DATA_GEAR, FIT_DATA_ACTIVITY, PHOTO_DATA_OTHER, \
-    PHOTO_DATA_MAKER, \
-    PHOTO_DATA_THUMBNAIL, PHOTO_DATA_EXIF, PHOTO_DATA_GPS, PHOTO_DATA_IMAGE, FIT_DATA_TRAVELLER, FIT_DATA_UNCLASSIFIED
+    PHOTO_DATA_MAKER, PHOTO_DATA_HASH, PHOTO_DATA_THUMBNAIL, PHOTO_DATA_EXIF, PHOTO_DATA_GPS, PHOTO_DATA_IMAGE, \
+    FIT_DATA_TRAVELLER, FIT_DATA_UNCLASSIFIED, FIT_DATA_UNCLASSIFIED_SUMMARY, FIT_DATA_VALIDATION, \
+    VIDEO_DATA_METADATA, VIDEO_DATA_ACTIVITY_RECORD, VIDEO_DATA_TELEMETRY, VIDEO_DATA_VALIDATION
+from app.utils.date import to_timestamp, timestamp_to_str
 from app.utils.filesystem import get_relative_path
+from app.utils.metrics import timer, timed_iter, inc
 from app.utils.mongodb import mongodb
 
 logger = logging.getLogger(__name__)
 
 
+def _kph(speed):
+    return mps_to_kph(speed) if speed is not None else None
+
+
 class Parser(metaclass=abc.ABCMeta):
     class FileParsingError(PyrError):
         pass
@@ -32,26 +41,33 @@ class Parser(metaclass=abc.ABCMeta):
     _result = None
     _sampling_frequency: int
     _file_path: str
+    _source: ParseSource
 
-    def __init__(self, file):
+    def __init__(self, file, budget: ParseBudget = None, profile=None):
+        """
+        :param file: a path, bytes, a memoryview, an mmap, a file object or an upload, see ParseSource
+        :param budget: resource limits of a parse, the PARSE_BUDGET settings by default
+        :param profile: trace the allocations of a parse into `self.profile`, PARSE_BUDGET['PROFILE'] by default
+        """
         self._get_file_path(file)
+        self._budget = budget or ParseBudget()
+        self._profile = PARSE_BUDGET['PROFILE'] if profile is None else profile
+        self.profile = None
 
     def _get_file_path(self, obj):
-        if obj is None:
-            raise PyrTypeError('file path should not be None')
-
-        elif isinstance(obj, str):
-            file_path = obj
-        else:
-            raise PyrTypeError('file path should be a string or File/Media object, but got %r' % obj)
-
-        self._file_path = file_path
+        """
+        the input of the parser, `_file_path` is its path or, for the inputs in memory, its name
+        """
+        self._source = ParseSource(obj)
+        self._file_path = self._source.path or self._source.name
 
     @abc.abstractmethod
     def _parse(self):
         pass
 
     def _file_clean(self, mute=True):
+        if self._source.path is None:
+            return True
         if not os.access(self._file_path, os.F_OK):
             if mute:
                 return False
@@ -66,6 +82,7 @@ class Parser(metaclass=abc.ABCMeta):
         return True
 
     @staticmethod
+    @timer('parser_model_seconds')
     def _get_data_from_model(record: dict, model_cls, skip_unorganized=DATA_MODEL['SAVE_UNCLASSIFIED']):
         if not hasattr(model_cls, '__new__'):
             logger.debug('Model class must be a class, bug got %s' % type(model_cls))
@@ -87,14 +104,14 @@ class Parser(metaclass=abc.ABCMeta):
         unorganized = {}
         for k in valid_keys:
             if skip_unorganized:
-                data.update({k, record[k]})
+                data.update({k: record[k]})
             else:
                 if k.startswith('unknown'):  # k.startswith('unknown') is for handle unknown fields in FIT file
                     continue
                 if k in properties:
-                    data.update({k, record[k]})
+                    data.update({k: record[k]})
                 else:
-                    unorganized.update({k, record[k]})
+                    unorganized.update({k: record[k]})
 
         if len(unorganized) != 0:
             data.update({'_unorganized': unorganized})
@@ -104,98 +121,367 @@ class Parser(metaclass=abc.ABCMeta):
     def parse(self):
         # check file exit and can be read
         self._file_clean()
-        return self._parse()
+        try:
+            self._budget.start(self._file_path, self._source.size)
+            if not self._profile:
+                with timer('parser_parse_seconds', parser=type(self).__name__):
+                    self._result = self._parse()
+                return self._result
+
+            with profiling() as report, timer('parser_parse_seconds', parser=type(self).__name__):
+                self._result = self._parse()
+        except BudgetExceededError as err:
+            raise self.FileParsingError(err) from err
+        self.profile = report
+        logger.info('parsed %s in %.3fs, peak %d KB, retained %d KB, top allocation site %s' % (
+            self._file_path, report['seconds'], report['peak_bytes'] // 1024, report['retained_bytes'] // 1024,
+            report['top'][0]['site'] if report['top'] else None))
+        return self._result
+
+    def positions(self):
+        """
+        positions of the parse result for indexing them out of save(), see _get_positions
+        """
+        return self._get_positions()
+
+    def _get_positions(self):
+        """
+        positions of the parse result for the spatial index
+        :return: (longitudes, latitudes, is_track) in WGS84, or None if the result has no position
+        """
+        return None
+
+    @staticmethod
+    def _get_track_positions(activity_records):
+        """
+        positions of the coordinates of activity records, in WGS84
+        """
+        if not activity_records:
+            return None
+        points = [dict(record['coordinate']) for record in activity_records if record.get('coordinate')]
+        if not points:
+            return None
+        from app.data.geographic.transform import transform_points
+
+        transform_points(points, COORDINATE_SYSTEM_WGS84)
+        return [p.get('longitude') for p in points], [p.get('latitude') for p in points], True
 
-    def save(self, extra_data: Dict = None, collection=mongodb.Collections.MEDIA_PARSED_DATA):
-        if not isinstance(extra_data, Dict):
+    def _result_for_store(self):
+        """
+        the parse result with its activity records encoded by the track codec when TRACK_CODEC is enabled
+        """
+        records = self._result.get(FIT_DATA_ACTIVITY_RECORD[0]) if isinstance(self._result, dict) else None
+        if not TRACK_CODEC['ENABLED'] or records is None:
+            return self._result
+        from app.data.codec import encode_track
+
+        return dict(self._result, **{FIT_DATA_ACTIVITY_RECORD[0]: encode_track(records)})
+
+    def _index_positions(self, parse_id, extend=False):
+        """
+        add the positions of the parse result to the spatial index and the tracks to the heatmap
+        @:param extend: the result continues the one saved as parse_id
+        """
+        if not SPATIAL_INDEX['ENABLED'] and not HEATMAP['ENABLED']:
+            return
+        positions = self._get_positions()
+        if positions is None:
+            return
+        if SPATIAL_INDEX['ENABLED']:
+            from app.data.geographic.index import get_spatial_index
+
+            index = get_spatial_index()
+            (index.extend if extend else index.add)(parse_id, *positions)
+        if HEATMAP['ENABLED'] and positions[2]:
+            from app.data.geographic.heatmap import get_heatmap
+
+            heatmap = get_heatmap()
+            (heatmap.extend if extend else heatmap.add)(parse_id, *positions[:2])
+
+    def _source_fields(self):
+        """
+        the fields of the stored result naming its input, the inputs in memory have a name but no path
+        """
+        if self._source.path is not None:
+            return {'path': get_relative_path(self._source.path)}
+        return {'path': None, 'name': self._source.name}
+
+    def save(self, extra_data: Dict = None, collection=mongodb.Collections.MEDIA_PARSED_DATA, index=True):
+        """
+        @:param index: False to leave the positions out of the spatial index and the heatmap, for callers adding
+                       them themselves like the ingest daemon
+        """
+        if extra_data is not None and not isinstance(extra_data, Dict):
             raise PyrTypeError('Extra data should be a Dict object, bug got %s' % type(extra_data))
 
-        data_for_store = {'data': self._result, 'path': get_relative_path(self._file_path)}
+        data_for_store = dict(self._source_fields(), data=self._result_for_store())
         if extra_data is not None:
             data_for_store.update(extra_data)
 
-        return mongodb.insert(collection, data_for_store)
+        parse_id = mongodb.insert(collection, data_for_store)
+        if index:
+            self._index_positions(parse_id)
+        if ROLLUP['ENABLED']:
+            from app.data.rollup import get_rollups
+
+            get_rollups().update(data_for_store, parse_id)
+        return parse_id
 
 
 class FitParser(Parser):
-    _activity_record: [] = []
-    _gears: [] = []
-    _activity: [] = []
-    _traveller: [] = []
-    _unclassified: [] = []
+    _activity_record: []
+    _gears: []
+    _activity: []
+    _traveller: []
+    _unclassified: []
+
+    def __init__(self, file, incremental=False, checkpoint_store=None,
+                 budget: ParseBudget = None, profile=None, unclassified_policies: Dict = None):
+        """
+        :param incremental: decode only the data appended since the last saved parse of the same file,
+                            the result then holds the new messages only and save() appends them to the stored one
+        :param checkpoint_store: FitCheckpointStore of the incremental parses
+        :param unclassified_policies: {message: policy} of the unclassified messages,
+                                      DATA_MODEL['UNCLASSIFIED_POLICIES'] by default
+        """
+        super().__init__(file, budget, profile)
+        if incremental and self._source.path is None:
+            raise PyrTypeError('incremental parses are of files growing on disk, %s has no path' % self._source.name)
+        self._unclassified_policies = unclassified_policies
+        self._unclassified_collector = None
+        self._incremental = incremental
+        if incremental and checkpoint_store is None:
+            from app.parse.incremental import FitCheckpointStore
+
+            checkpoint_store = FitCheckpointStore()
+        self._checkpoint_store = checkpoint_store
+        self._checkpoint = None
+
+    def _open_fit_file(self):
+        if not self._incremental:
+            import fitparse
+
+            return fitparse.FitFile(self._source.open())
+
+        from app.parse.incremental import ResumableFitFile, FitCheckpoint, CheckpointError
+
+        checkpoint = self._checkpoint_store.load(self._file_path)
+        if checkpoint is not None:
+            try:
+                fit_file = ResumableFitFile(self._file_path, checkpoint)
+                self._checkpoint = checkpoint
+                return fit_file
+            except CheckpointError as err:
+                logger.info('%s, parse it from the beginning' % err)
+        self._checkpoint = FitCheckpoint(self._file_path)
+        return ResumableFitFile(self._file_path)
 
     def _parse(self):
+        from fitparse import FitParseError
+
+        self._activity_record = []
+        self._gears = []
+        self._activity = []
+        self._traveller = []
+        self._unclassified = []
+        self._unclassified_collector = UnclassifiedCollector(self._unclassified_policies)
+        # registry key -> index in _gears / _traveller, a device is listed once per parse
+        self._gear_keys = {}
+        self._traveller_keys = {}
+
+        message_count = 0
         try:
-            fit_file = fitparse.FitFile(self.file_path)
-            data = fit_file.get_messages()
-        except fitparse.FitParseError as err:
+            fit_file = self._open_fit_file()
+            for item in timed_iter(fit_file.get_messages(), 'fit_decode_seconds'):
+                message_count += 1
+                self._budget.message()
+                name = item.name.lower()
+                if name in FIT_DATA_ACTIVITY_RECORD[1]:
+                    self._budget.point()
+                    self._parse_activity_record(item.get_values())
+                elif name in FIT_DATA_GEAR[1]:
+                    self._parse_gear(item.get_values())
+                elif name in FIT_DATA_ACTIVITY[1]:
+                    self._parse_activity(item.get_values())
+                elif name in FIT_DATA_TRAVELLER[1]:
+                    self._parse_traveller(item.get_values())
+                elif self._unclassified_collector.add(name, item):
+                    self._parse_misc(item.get_values())
+        except FitParseError as err:
             raise self.FileParsingError(err)
 
-        for item in data:
-            value = item.get_values()
-            if item.name.lower() in FIT_DATA_ACTIVITY_RECORD[1]:
-                self._parse_activity_record(value)
-            elif item.name.lower() in FIT_DATA_GEAR[1]:
-                self._parse_gear(value)
-            elif item.name.lower() in FIT_DATA_ACTIVITY[1]:
-                self._parse_activity(value)
-            elif item.name.lower() in FIT_DATA_TRAVELLER[1]:
-                self._parse_activity(value)
-            else:
-                self._parse_misc(value)
+        if self._incremental:
+            fit_file.checkpoint(self._checkpoint)
+            self._checkpoint.message_count += message_count
+            self._checkpoint.record_count += len(self._activity_record)
+
+        from app.data.validation import validate_track
+
+        self._validation = validate_track(self._activity_record)
+        if GEOCODING['ENABLED']:
+            from app.data.geographic.geocoding import annotate_track
 
-        self._result = {FIT_DATA_ACTIVITY_RECORD(0): self._activity_record,
-                        FIT_DATA_GEAR(0): self._gears,
-                        FIT_DATA_ACTIVITY(0): self._activity,
-                        FIT_DATA_TRAVELLER(0): self._traveller,
-                        FIT_DATA_UNCLASSIFIED(0): self._unclassified,
-                        }
+            self._budget.check_time()
+            annotate_track(self._activity_record)
+        self._budget.check_time()
+
+        return {FIT_DATA_ACTIVITY_RECORD[0]: self._activity_record,
+                FIT_DATA_GEAR[0]: self._gears,
+                FIT_DATA_ACTIVITY[0]: self._activity,
+                FIT_DATA_TRAVELLER[0]: self._traveller,
+                FIT_DATA_UNCLASSIFIED[0]: self._unclassified,
+                FIT_DATA_UNCLASSIFIED_SUMMARY[0]: self._unclassified_collector.summary(),
+                FIT_DATA_VALIDATION[0]: self._validation.summary(),
+                }
+
+    def _result_for_store(self):
+        """
+        gears and traveller profiles are stored once in their registries, the result keeps references to them
+        """
+        ret = super()._result_for_store()
+        if not REGISTRY['ENABLED'] or not isinstance(ret, dict):
+            return ret
+        from app.data.registry import get_gear_registry, get_profile_registry
+
+        gears, profiles = get_gear_registry(), get_profile_registry()
+        return dict(ret, **{FIT_DATA_GEAR[0]: [gears.reference(i) for i in ret.get(FIT_DATA_GEAR[0]) or []],
+                            FIT_DATA_TRAVELLER[0]: [profiles.reference(i)
+                                                    for i in ret.get(FIT_DATA_TRAVELLER[0]) or []]})
+
+    def save(self, extra_data: Dict = None, collection=mongodb.Collections.MEDIA_PARSED_DATA, index=True):
+        if not self._incremental:
+            parse_id = super().save(extra_data, collection, index)
+            self._unclassified_collector.save(parse_id)
+            return parse_id
+
+        if self._checkpoint.parse_id is None:
+            self._checkpoint.parse_id = super().save(extra_data, collection, index)
+        else:
+            data = {'data.' + k: v for k, v in self._result_for_store().items()}
+            # a device or profile is listed once per file, the slices before saw most of them already
+            stored = next(mongodb.iterate(collection, {'_db_pyr_guid': self._checkpoint.parse_id},
+                                          {'data.' + FIT_DATA_GEAR[0]: True, 'data.' + FIT_DATA_TRAVELLER[0]: True},
+                                          decode_tracks=False), None) or {}
+            replace = {'data.' + k: self._merge_references((stored.get('data') or {}).get(k) or [],
+                                                           data.pop('data.' + k))
+                       for k in (FIT_DATA_GEAR[0], FIT_DATA_TRAVELLER[0])}
+            unique = {'data.' + FIT_DATA_ACTIVITY[0]: data.pop('data.' + FIT_DATA_ACTIVITY[0])}
+            track = data.pop('data.' + FIT_DATA_ACTIVITY_RECORD[0])
+            if isinstance(track, dict):
+                # encoded by the track codec, the new chunks go after the stored ones
+                data['data.%s.chunks' % FIT_DATA_ACTIVITY_RECORD[0]] = track['chunks']
+            else:
+                data['data.' + FIT_DATA_ACTIVITY_RECORD[0]] = track
+            summary = data.pop('data.' + FIT_DATA_UNCLASSIFIED_SUMMARY[0])
+            increment = {'data.%s.%s.count' % (FIT_DATA_UNCLASSIFIED_SUMMARY[0], message): value['count']
+                         for message, value in summary.items()}
+            validation = data.pop('data.' + FIT_DATA_VALIDATION[0])
+            increment.update({'data.%s.%s' % (FIT_DATA_VALIDATION[0], k): validation[k] for k in ('records', 'valid')})
+            increment.update({'data.%s.issues.%s' % (FIT_DATA_VALIDATION[0], issue): count
+                              for issue, count in validation['issues'].items()})
+            mongodb.append(collection, self._checkpoint.parse_id, data, increment=increment, unique=unique,
+                           replace=replace)
+            if index:
+                self._index_positions(self._checkpoint.parse_id, extend=True)
+            if ROLLUP['ENABLED']:
+                from app.data.rollup import get_rollups
+
+                # the totals are of the whole file, the stored one has the earlier records
+                get_rollups().refresh(self._checkpoint.parse_id)
+        self._unclassified_collector.save(self._checkpoint.parse_id)
+        self._checkpoint_store.save(self._checkpoint)
+        return self._checkpoint.parse_id
+
+    def _get_positions(self):
+        if not self._result:
+            return None
+        return self._get_track_positions(self._result.get(FIT_DATA_ACTIVITY_RECORD[0]))
 
+    @timer('parser_handler_seconds', handler='activity_record')
     def _parse_activity_record(self, record):
         """
         parse fit activity record to geographic and misc data
         :param record: {
                     "timestamp": "2019-09-27 00:32:11",
-                    "positionLat": 358587055,
-                    "positionLong": 1156290179,
+                    "position_lat": 358587055,
+                    "position_long": 1156290179,
                     "distance": 2.09,
-                    "enhancedAltitude": 3284.0,
+                    "enhanced_altitude": 3284.0,
                     "altitude": 18920,
-                    "enhancedSpeed": 2.641,
+                    "enhanced_speed": 2.641,
                     "speed": 2641,
                     "unknown61": 18920,
                     "unknown66": 2236,
                     "temperature": 5
                 },
-        :return:
         """
-        timestamp = record.pop('timestamp', None)
-        coordinate = Coordinate({'latitude': record.pop('positionLong', None),
-                                 'longitude': record.pop('positionLat', None),
-                                 'altitude': record.pop('enhancedAltitude', None),
-                                 'datum': self._COORDINATE_SYSTEM})
-        physiologic = Physiologic({'speed': mps_to_kph(record.pop('enhancedSpeed', None))})
-        environment = Environment({'temperature': record.pop('temperature', None)})
+        self._activity_record.append(self._to_activity_record(record))
 
-        coordinate.set_time(timestamp, 'UTC')
-        physiologic.set_time(timestamp, 'UTC')
-        environment.set_time(timestamp, 'UTC')
-        activity_record = {}
-        if coordinate.is_valid():
-            activity_record.update({'coordinate': coordinate.__dict__})
+    def _to_activity_record(self, record):
+        timestamp = record.pop('timestamp', None)
+        if timestamp is not None and not isinstance(timestamp, (int, float)):
+            timestamp = to_timestamp(timestamp, 'UTC')
+        # converted once for all parts of the record
+        time = {'timestamp': timestamp, 'time': timestamp_to_str(timestamp) if timestamp is not None else None}
+        coordinate = Coordinate(dict(time, latitude=record.pop('position_lat', None),
+                                     longitude=record.pop('position_long', None),
+                                     altitude=record.pop('enhanced_altitude', None),
+                                     datum=self._COORDINATE_SYSTEM))
+        speed = record.pop('enhanced_speed', None)
+        physiologic = Physiologic(dict(time, speed=mps_to_kph(speed) if speed is not None else None))
+        environment = Environment(dict(time, temperature=record.pop('temperature', None)))
+
+        # positions are checked column wise by validate_track once the file is decoded
+        activity_record = {'coordinate': coordinate.__dict__}
         if physiologic.is_valid():
             activity_record.update({'physiologic': physiologic.__dict__})
         if environment.is_valid():
             activity_record.update({'environment': environment.__dict__})
-        self._activity_record.append(activity_record)
+        return activity_record
 
+    def iter_records(self, batch_size=MERGE['BATCH_SIZE']):
+        """
+        yield the activity records while decoding the file, validated `batch_size` at a time, the other
+        messages are not kept. for streaming long files, e.g. into app.parse.merge
+        """
+        import fitparse
+        from fitparse import FitParseError
+
+        from app.data.validation import validate_track
+
+        self._file_clean(mute=False)
+        self._budget.start(self._file_path, self._source.size)
+        batch = []
+        try:
+            for item in fitparse.FitFile(self._source.open()).get_messages(FIT_DATA_ACTIVITY_RECORD[1]):
+                self._budget.point()
+                batch.append(self._to_activity_record(item.get_values()))
+                if len(batch) >= batch_size:
+                    validate_track(batch)
+                    yield from batch
+                    batch = []
+        except FitParseError as err:
+            raise self.FileParsingError(err)
+        except BudgetExceededError as err:
+            raise self.FileParsingError(err) from err
+        validate_track(batch)
+        yield from batch
+
+    @timer('parser_handler_seconds', handler='gear')
     def _parse_gear(self, record):
         timestamp = record.pop('timestamp', None)
+        # FIT devices name their manufacturer and product only
+        record.setdefault('brand', record.get('manufacturer'))
+        record.setdefault('model', record.get('product') if record.get('product') is not None
+                          else record.get('garmin_product'))
         gear = self._get_data_from_model(record, Gear)
         gear.set_time(timestamp, 'UTC')
         if gear.is_valid():
-            self._activity.append(gear.__dict__)
+            from app.data.registry import get_gear_registry
+
+            self._add_unique(self._gears, self._gear_keys, get_gear_registry().key(gear.__dict__), gear.__dict__)
 
+    @timer('parser_handler_seconds', handler='activity')
     def _parse_activity(self, record):
         timestamp = record.pop('timestamp', None)
         start_position = Coordinate({'latitude': record.pop('start_position_lat', None),
@@ -213,8 +499,8 @@ class FitParser(Parser):
         activity_data = {'start_position': start_position.position,
                          'nec_position': nec_position.position,
                          'swc_position': swc_position.position,
-                         'avg_speed': mps_to_kph(record.pop('enhanced_avg_speed', None)),
-                         'max_speed': mps_to_kph(record.pop('enhanced_max_speed', None)),
+                         'avg_speed': _kph(record.pop('enhanced_avg_speed', None)),
+                         'max_speed': _kph(record.pop('enhanced_max_speed', None)),
                          }
         activity = self._get_data_from_model(record, Activity)
         activity.set_data(activity_data)
@@ -222,12 +508,53 @@ class FitParser(Parser):
         if activity.is_valid():
             self._activity.append(activity.__dict__)
 
+    @timer('parser_handler_seconds', handler='traveller')
     def _parse_traveller(self, record):
         traveller = self._get_data_from_model(record, TravellerProfile)
         traveller.set_time(None, None, skip=True)
         if traveller.is_valid():
-            self._traveller.append(traveller.__dict__)
+            from app.data.registry import get_profile_registry
+
+            self._add_unique(self._traveller, self._traveller_keys,
+                             get_profile_registry().key(traveller.__dict__), traveller.__dict__)
 
+    @staticmethod
+    def _merge_references(stored, new):
+        """
+        gears or profiles of the stored result and of the appended part, one per key
+        """
+        ret = [dict(i) for i in stored]
+        keys = {item.get('key'): i for i, item in enumerate(ret)}
+        for item in new:
+            if item.get('key') not in keys:
+                keys[item.get('key')] = len(ret)
+                ret.append(item)
+                continue
+            known = ret[keys[item['key']]]
+            known.update({k: v for k, v in item.items() if v is not None and k not in ('first_seen', 'last_seen')})
+            for field, pick in (('first_seen', min), ('last_seen', max)):
+                values = [i for i in (known.get(field), item.get(field)) if i is not None]
+                known[field] = pick(values) if values else None
+        return ret
+
+    @staticmethod
+    def _add_unique(items, keys, key, data):
+        """
+        add a gear or profile once, later messages of the same one fill in its fields and its last_seen time
+        """
+        timestamp = data.get('timestamp')
+        if key not in keys:
+            data.update({'key': key, 'first_seen': timestamp, 'last_seen': timestamp})
+            keys[key] = len(items)
+            items.append(data)
+            return
+        known = items[keys[key]]
+        known.update({k: v for k, v in data.items() if v is not None and k not in ('first_seen', 'last_seen')})
+        if timestamp is not None:
+            known['first_seen'] = timestamp if known['first_seen'] is None else min(known['first_seen'], timestamp)
+            known['last_seen'] = timestamp if known['last_seen'] is None else max(known['last_seen'], timestamp)
+
+    @timer('parser_handler_seconds', handler='misc')
     def _parse_misc(self, record):
         unclassified = self._get_data_from_model(record, Unclassified, skip_unorganized=False)
         unclassified.set_time(None, None, True)
@@ -238,12 +565,79 @@ class FitParser(Parser):
 class PhotoParser(Parser):
 
     def _parse(self):
-        return self.parse_exif(self._file_path)
+        ret = self.parse_exif(self._source, self._budget)
+        if DEDUPE['ENABLED']:
+            ret[PHOTO_DATA_HASH[0]] = self._hashes(ret)
+        return ret
+
+    def _hashes(self, result):
+        """
+        content hash of the file and perceptual hash of its EXIF thumbnail, see app.data.dedupe
+        """
+        from app.data.dedupe import content_hash, perceptual_hash
+
+        with self._source.open() as file:
+            sha1 = content_hash(file)
+        thumbnail = result.get(PHOTO_DATA_THUMBNAIL[0], {}).get('base64')
+        phash = perceptual_hash(base64.b64decode(thumbnail)) if thumbnail else None
+        return {'sha1': sha1, 'phash': '%x' % phash if phash is not None else None}
+
+    def save(self, extra_data: Dict = None, collection=mongodb.Collections.MEDIA_PARSED_DATA, index=True):
+        """
+        a photo with the content of a stored one is saved as a link to it, a near duplicate is saved with a link
+        to the closest stored one and, by DEDUPE['DROP_NEAR_DUPLICATE_THUMBNAIL'], without thumbnail
+        """
+        hashes = self._result.get(PHOTO_DATA_HASH[0]) if DEDUPE['ENABLED'] and self._result else None
+        if not hashes:
+            return super().save(extra_data, collection, index)
+        from app.data.dedupe import get_photo_index
+
+        if extra_data is not None and not isinstance(extra_data, Dict):
+            raise PyrTypeError('Extra data should be a Dict object, bug got %s' % type(extra_data))
+        photo_index = get_photo_index()
+        phash = int(hashes['phash'], 16) if hashes['phash'] else None
+        duplicate = photo_index.find(hashes['sha1'], phash)
+        if duplicate is not None and duplicate['exact']:
+            inc('photo_duplicates_total', kind='exact')
+            data_for_store = dict(self._source_fields(), data={PHOTO_DATA_HASH[0]: hashes},
+                                  duplicate_of=duplicate['parse_id'])
+            data_for_store.update(extra_data or {})
+            return mongodb.insert(collection, data_for_store)
+
+        if duplicate is not None:
+            inc('photo_duplicates_total', kind='near')
+            extra_data = dict(extra_data or {}, similar_to={'parse_id': duplicate['parse_id'],
+                                                            'distance': duplicate['distance']})
+            if DEDUPE['DROP_NEAR_DUPLICATE_THUMBNAIL']:
+                self._result = dict(self._result, **{PHOTO_DATA_THUMBNAIL[0]: {}})
+        parse_id = super().save(extra_data, collection, index)
+        photo_index.add(parse_id, hashes['sha1'], phash)
+        return parse_id
+
+    def _get_positions(self):
+        if not self._result:
+            return None
+        longitude, latitude = gps_to_position(self._result.get(PHOTO_DATA_GPS[0]))
+        if longitude is None or latitude is None:
+            return None
+        return longitude, latitude, False
 
     @staticmethod
-    def parse_exif(file_path):
-        f = open(file_path, 'rb')
-        tags = exifread.process_file(f)
+    def parse_exif(file, budget: ParseBudget = None):
+        """
+        :param file: a path or any other input of ParseSource
+        """
+        import exifread
+
+        try:
+            from exifread.core.ifd_tag import IfdTag as ifd_tag
+        except ImportError:  # exifread 2
+            from exifread.classes import IfdTag as ifd_tag
+
+        with ParseSource(file).open() as f, timer('exif_decode_seconds'):
+            tags = exifread.process_file(f)
+        if budget is not None:
+            budget.check_time()
         image_info = {}
         gps_info = {}
         thumbnail_info = {}
@@ -251,11 +645,13 @@ class PhotoParser(Parser):
         exit_info = {}
         other_info = {}
         for tag in tags:
+            if budget is not None:
+                budget.message()
             key_array = tag.split(' ')
             category = key_array[0].lower()
 
             key = category if len(key_array) == 1 else '_'.join(key_array[1:])
-            value = tags[tag].values if isinstance(tags[tag], exifread.IfdTag) else str(tags[tag])
+            value = tags[tag].values if isinstance(tags[tag], ifd_tag) else str(tags[tag])
 
             # store base64 encoded thumbnail
             if tag.lower() == 'jpegthumbnail':
@@ -286,5 +682,68 @@ class PhotoParser(Parser):
 
 class VideoParser(Parser):
 
+    def __init__(self, file, budget: ParseBudget = None, profile=None):
+        super().__init__(file, budget or ParseBudget(max_bytes=VIDEO['MAX_BYTES']), profile)
+
     def _parse(self):
-        return {}
+        """
+        metadata from moov, GPS telemetry as activity records like FitParser does and the IMU telemetry
+        as columns {fourcc: {'name', 'unit', 'timestamp': [], 'values': [[]]}}
+        """
+        from app.parse import video
+
+        with self._source.buffer() as buf:
+            if buf is None:
+                raise self.FileParsingError('%s is empty' % self._file_path)
+            try:
+                with timer('video_decode_seconds', stage='moov'):
+                    metadata, telemetry = video.parse_movie(buf)
+                self._budget.check_time()
+                with timer('video_decode_seconds', stage='telemetry'):
+                    columns = video.read_telemetry(buf, telemetry, VIDEO['GPS_STREAMS'] + VIDEO['IMU_STREAMS'],
+                                                   metadata['creation_time'], self._budget)
+            except (video.VideoParsingError, struct.error, ValueError) as err:
+                raise self.FileParsingError('%s: %s' % (self._file_path, err))
+        self._budget.check_time()
+
+        activity_records = []
+        gps = next((columns[k] for k in VIDEO['GPS_STREAMS'] if k in columns), None)
+        if gps is not None:
+            for row in video.gps_rows(video.downsample(gps, VIDEO['GPS_RATE']), VIDEO['MIN_GPS_FIX']):
+                self._budget.point()
+                activity_records.append(self._parse_gps_row(row))
+        from app.data.validation import validate_track
+
+        validation = validate_track(activity_records)
+        if activity_records and GEOCODING['ENABLED']:
+            from app.data.geographic.geocoding import annotate_track
+
+            annotate_track(activity_records)
+
+        return {VIDEO_DATA_METADATA[0]: metadata,
+                VIDEO_DATA_ACTIVITY_RECORD[0]: activity_records,
+                VIDEO_DATA_TELEMETRY[0]: {k: video.columns_to_lists(video.downsample(columns[k], VIDEO['IMU_RATE']))
+                                          for k in VIDEO['IMU_STREAMS'] if k in columns},
+                VIDEO_DATA_VALIDATION[0]: validation.summary(),
+                }
+
+    def _get_positions(self):
+        if not self._result:
+            return None
+        return self._get_track_positions(self._result.get(VIDEO_DATA_ACTIVITY_RECORD[0]))
+
+    def _parse_gps_row(self, row):
+        timestamp = row['timestamp']
+        coordinate = Coordinate({'latitude': row['latitude'],
+                                 'longitude': row['longitude'],
+                                 'altitude': row['altitude'],
+                                 'datum': self._COORDINATE_SYSTEM,
+                                 'timestamp': timestamp})
+        physiologic = Physiologic({'speed': _kph(row['speed']), 'timestamp': timestamp})
+        coordinate.set_time(timestamp, 'UTC')
+        physiologic.set_time(timestamp, 'UTC')
+        # positions are checked column wise by validate_track
+        activity_record = {'coordinate': coordinate.__dict__}
+        if physiologic.is_valid():
+            activity_record.update({'physiologic': physiologic.__dict__})
+        return activity_record
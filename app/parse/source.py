@@ -0,0 +1,209 @@
+"""
+inputs of the parsers: a path, bytes, a memoryview, an mmap or a file-like object such as an upload, read where
+they are instead of being written to a temp file first
+
+    FitParser(request.files['file'])
+    PhotoParser(ParseSource(data, name='IMG_0001.JPG'))
+"""
+import contextlib
+import io
+import mmap
+import os
+import stat
+
+from app.base.exceptions import PyrTypeError
+
+_BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+
+class BufferReader(io.RawIOBase):
+    """
+    read only file object over a buffer, a read copies the bytes asked for only
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        start = self._position
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), start + size)
+        if end <= start:
+            return b''
+        self._position = end
+        return self._view[start:end].tobytes()
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        target = memoryview(b).cast('B')
+        start = self._position
+        size = max(0, min(len(target), len(self._view) - start))
+        target[:size] = self._view[start:start + size]
+        self._position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            # an mmap can only be closed once no view of it is left
+            self._view.release()
+        super().close()
+
+
+class _BorrowedFile:
+    """
+    a file object of the caller, the parsers closing their input leave it open
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self.closed = False
+
+    def __getattr__(self, item):
+        return getattr(self._file, item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+
+class ParseSource:
+    def __init__(self, obj, name=None):
+        """
+        @:param obj: a path, bytes, bytearray, memoryview, mmap, a binary file object, a Django UploadedFile or
+                     a Flask FileStorage
+        @:param name: file name for logs and the stored result, taken from the object when it has one
+        """
+        self.path = None
+        self._buffer = None
+        self._file = None
+        if obj is None:
+            raise PyrTypeError('file path should not be None')
+        elif isinstance(obj, ParseSource):
+            self.path, self._buffer, self._file = obj.path, obj._buffer, obj._file
+            name = name or obj.name
+        elif isinstance(obj, (str, os.PathLike)):
+            self.path = os.fspath(obj)
+        elif isinstance(obj, _BUFFER_TYPES):
+            self._buffer = obj
+        elif callable(getattr(obj, 'temporary_file_path', None)):
+            # a large Django upload, already on disk
+            self.path = obj.temporary_file_path()
+        elif hasattr(getattr(obj, 'stream', None), 'read'):
+            # a Flask FileStorage
+            self._file = obj.stream
+        elif hasattr(obj, 'read'):
+            # file objects and Django uploads in memory
+            self._file = obj
+        else:
+            raise PyrTypeError('file should be a path, bytes, a memoryview, an mmap or a file object, but got %r'
+                               % type(obj))
+        self.name = name or self.path or getattr(obj, 'filename', None) or getattr(obj, 'name', None) or \
+            '<%s>' % type(obj).__name__
+
+    def __repr__(self):
+        return 'ParseSource(%r)' % self.name
+
+    def _seekable_file(self):
+        """
+        the file object, read into memory once when it can not seek
+        """
+        seekable = getattr(self._file, 'seekable', None)
+        if seekable is not None and not seekable():
+            self._buffer, self._file = self._file.read(), None
+        return self._file
+
+    @property
+    def size(self):
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        if self._buffer is not None:
+            return memoryview(self._buffer).nbytes
+        file = self._seekable_file()
+        if file is None:
+            return memoryview(self._buffer).nbytes
+        position = file.tell()
+        try:
+            return file.seek(0, io.SEEK_END)
+        finally:
+            file.seek(position)
+
+    def readable(self):
+        if self.path is not None:
+            return os.access(self.path, os.R_OK)
+        return True
+
+    def open(self):
+        """
+        a binary file object at the start of the input, closing it leaves a file object of the caller open
+        """
+        if self.path is not None:
+            return open(self.path, 'rb')
+        file = self._seekable_file() if self._file is not None else None
+        if file is None:
+            return BufferReader(self._buffer)
+        file.seek(0)
+        return _BorrowedFile(file)
+
+    @contextlib.contextmanager
+    def buffer(self):
+        """
+        the whole input as a read only buffer, None when it is empty. files are mapped rather than read
+        """
+        if self._buffer is not None:
+            view = memoryview(self._buffer).cast('B')
+            try:
+                yield view if len(view) else None
+            finally:
+                view.release()
+            return
+
+        file = open(self.path, 'rb') if self.path is not None else None
+        buffer, mapped = None, False
+        try:
+            fileno = (file or self._file).fileno()
+            status = os.fstat(fileno)
+            if stat.S_ISREG(status.st_mode):
+                buffer = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) if status.st_size else None
+                mapped = True
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            if file is not None:
+                raise
+        finally:
+            if file is not None:
+                file.close()
+        if not mapped:
+            # an in memory file object or a stream
+            with self.open() as stream:
+                buffer = stream.read() or None
+        try:
+            yield buffer
+        finally:
+            if mapped and buffer is not None:
+                buffer.close()
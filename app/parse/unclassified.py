@@ -0,0 +1,151 @@
+"""
+handling of the FIT messages no model organizes, by policy per message type:
+
+    inline  an Unclassified model per message, stored in the parse result
+    drop    skipped
+    count   only counted
+    raw     the raw field values, compressed in a side collection
+    lazy    the decoded values, compressed in a side collection and decoded when read by iter_unclassified
+
+only inline and lazy messages are decoded to values, the parse result keeps a summary of every message type
+"""
+import base64
+import json
+import logging
+from typing import Dict
+
+from app.settings import DATA_MODEL
+
+logger = logging.getLogger(__name__)
+
+POLICY_INLINE = 'inline'
+POLICY_DROP = 'drop'
+POLICY_COUNT = 'count'
+POLICY_RAW = 'raw'
+POLICY_LAZY = 'lazy'
+POLICIES = (POLICY_INLINE, POLICY_DROP, POLICY_COUNT, POLICY_RAW, POLICY_LAZY)
+_STORED = (POLICY_RAW, POLICY_LAZY)
+
+
+class UnclassifiedCollector:
+    """
+    applies the policies to the unclassified messages of a parse
+    """
+
+    def __init__(self, policies: Dict = None, default=None, chunk_size=None, compression=None):
+        self.policies = DATA_MODEL['UNCLASSIFIED_POLICIES'] if policies is None else policies
+        self.default = default or DATA_MODEL['UNCLASSIFIED_DEFAULT']
+        for policy in set(self.policies.values()) | {self.default}:
+            if policy not in POLICIES:
+                raise ValueError('unknown unclassified policy %s, use one of %s' % (policy, ', '.join(POLICIES)))
+        self.chunk_size = chunk_size or DATA_MODEL['UNCLASSIFIED_CHUNK_SIZE']
+        self.compression = compression or DATA_MODEL['UNCLASSIFIED_COMPRESSION']
+        self.counts = {}
+        self._fields = {}  # message -> field names of the raw rows
+        self._rows = {}
+        self._chunks = []
+
+    def policy(self, message):
+        return self.policies.get(message, self.default)
+
+    def add(self, message, item):
+        """
+        :param message: lower case message name
+        :param item: fitparse DataMessage
+        :return: True if the message is to be parsed inline
+        """
+        policy = self.policy(message)
+        if policy == POLICY_DROP:
+            return False
+        self.counts[message] = self.counts.get(message, 0) + 1
+        if policy == POLICY_RAW:
+            fields = tuple(field.name for field in item.fields)
+            if self._fields.get(message) != fields:
+                self._flush(message)
+                self._fields[message] = fields
+            self._rows.setdefault(message, []).append([field.raw_value for field in item.fields])
+        elif policy == POLICY_LAZY:
+            self._rows.setdefault(message, []).append(item.get_values())
+        else:
+            return policy == POLICY_INLINE
+        if len(self._rows[message]) >= self.chunk_size:
+            self._flush(message)
+        return False
+
+    def _flush(self, message):
+        rows = self._rows.pop(message, None)
+        if not rows:
+            return
+        from app.data.codec import compress
+
+        policy = self.policy(message)
+        data, compression = compress(json.dumps(rows, ensure_ascii=False, default=str).encode('utf-8'),
+                                     self.compression)
+        self._chunks.append({'message': message,
+                             'policy': policy,
+                             'seq': len(self._chunks),
+                             'count': len(rows),
+                             'fields': list(self._fields[message]) if policy == POLICY_RAW else None,
+                             'compression': compression,
+                             'data': base64.b64encode(data).decode('ascii')})
+
+    def summary(self):
+        """
+        {message: {'policy', 'count'}} of the messages not dropped
+        """
+        return {message: {'policy': self.policy(message), 'count': count} for message, count in self.counts.items()}
+
+    def chunks(self):
+        """
+        the side collection documents of the raw and lazy messages, all pending rows included
+        """
+        for message in list(self._rows):
+            self._flush(message)
+        return self._chunks
+
+    def save(self, parse_id, db=None, collection=None):
+        """
+        store the raw and lazy messages of the parse result `parse_id`, then forget them. the chunks are numbered
+        after the ones stored for the parse result before, e.g. by the earlier slices of an incremental parse
+        """
+        chunks = self.chunks()
+        if not chunks:
+            return
+        if db is None:
+            from app.utils.mongodb import mongodb as db
+        collection = collection or db.Collections.FIT_UNCLASSIFIED
+        start = 1 + max((i.get('seq', -1) for i in db.iterate(collection, {'parse_id': parse_id}, {'seq': True})),
+                        default=-1)
+        for chunk in chunks:
+            db.insert(collection, dict(chunk, parse_id=parse_id, seq=start + chunk['seq']))
+        self._chunks = []
+
+
+def decode_chunk(chunk: Dict):
+    """
+    :return: value dicts of the messages in a side collection document
+    """
+    from app.data.codec import decompress
+
+    rows = json.loads(decompress(base64.b64decode(chunk['data']), chunk.get('compression')).decode('utf-8'))
+    if chunk.get('fields') is None:
+        return rows
+    return [dict(zip(chunk['fields'], row)) for row in rows]
+
+
+def iter_unclassified(parse_id, message=None, db=None, collection=None):
+    """
+    decode the stored raw and lazy messages of a parse result, one chunk at a time in the order they were parsed
+    """
+    if db is None:
+        from app.utils.mongodb import mongodb as db
+    collection = collection or db.Collections.FIT_UNCLASSIFIED
+    filter_data = {'parse_id': parse_id}
+    if message is not None:
+        filter_data['message'] = message
+    keys = [(i['seq'], i['_db_pyr_guid']) for i in db.iterate(collection, filter_data, {'seq': True,
+                                                                                        '_db_pyr_guid': True})]
+    for _, guid in sorted(keys):
+        chunk = db.find_one(collection, {'_db_pyr_guid': guid})
+        for values in decode_chunk(chunk):
+            yield chunk['message'], values
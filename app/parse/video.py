@@ -0,0 +1,471 @@
+"""
+MP4/MOV metadata and GoPro GPMF telemetry.
+
+files are mapped with mmap (see ParseSource.buffer) and only the box headers, `moov` and the telemetry samples are
+touched, `mdat` media data is never read, so the I/O of a parse doesn't grow with the size of the video
+"""
+import datetime
+import logging
+import struct
+from typing import Dict, List
+
+import numpy as np
+
+from app.base.exceptions import PyrError
+
+logger = logging.getLogger(__name__)
+
+# seconds between 1904-01-01, the epoch of MP4 times, and 1970-01-01
+_MP4_EPOCH_OFFSET = 2082844800
+_GPS9_EPOCH = int(datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+_SAMPLE_TABLE_BOXES = {b'stts', b'stsz', b'stsc', b'stco', b'co64'}
+_TELEMETRY_FORMATS = {b'gpmd'}
+
+# GPMF value types to numpy dtypes, big endian
+_GPMF_DTYPES = {
+    'b': np.dtype('i1'), 'B': np.dtype('u1'),
+    's': np.dtype('>i2'), 'S': np.dtype('>u2'),
+    'l': np.dtype('>i4'), 'L': np.dtype('>u4'),
+    'j': np.dtype('>i8'), 'J': np.dtype('>u8'),
+    'f': np.dtype('>f4'), 'd': np.dtype('>f8'),
+    'q': np.dtype('>i4'), 'Q': np.dtype('>i8'),  # fixed point Q15.16 and Q31.32
+}
+_GPMF_FIXED_POINT = {'q': 1 << 16, 'Q': 1 << 32}
+_GPMF_NESTED = 0
+
+
+class VideoParsingError(PyrError):
+    pass
+
+
+# box structure
+
+def iter_boxes(buf, start, end):
+    """
+    yield (box type, payload start, box end) of the boxes in buf[start:end]
+    """
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise VideoParsingError('truncated box header at %d' % offset)
+            size = struct.unpack_from('>Q', buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise VideoParsingError('invalid size %d of box %r at %d' % (size, box_type, offset))
+        box_end = offset + size
+        if box_end > end:
+            # an unfinished recording, the box is cut at the end of the file
+            logger.debug('box %r at %d is truncated' % (box_type, offset))
+            box_end = end
+        yield box_type, offset + header, box_end
+        offset = box_end
+
+
+def _find(buf, start, end, *path):
+    """
+    payload (start, end) of the first box at path below buf[start:end], or None
+    """
+    for box_type, payload, box_end in iter_boxes(buf, start, end):
+        if box_type == path[0]:
+            return (payload, box_end) if len(path) == 1 else _find(buf, payload, box_end, *path[1:])
+    return None
+
+
+def _full_box(buf, offset):
+    """
+    (version, payload start after version and flags)
+    """
+    return buf[offset], offset + 4
+
+
+def _parse_mvhd(buf, offset):
+    version, offset = _full_box(buf, offset)
+    if version == 1:
+        creation, _, timescale, duration = struct.unpack_from('>QQIQ', buf, offset)
+    else:
+        creation, _, timescale, duration = struct.unpack_from('>IIII', buf, offset)
+    return {'creation_time': creation - _MP4_EPOCH_OFFSET if creation else None,
+            'duration': duration / timescale if timescale else None}
+
+
+def _parse_tkhd(buf, offset, end):
+    version, offset = _full_box(buf, offset)
+    track_id = struct.unpack_from('>I', buf, offset + (16 if version == 1 else 8))[0]
+    # width and height are 16.16 fixed point at the end of the box
+    width, height = struct.unpack_from('>II', buf, end - 8)
+    return {'id': track_id, 'width': width >> 16, 'height': height >> 16}
+
+
+def _parse_mdhd(buf, offset):
+    version, offset = _full_box(buf, offset)
+    if version == 1:
+        _, _, timescale, duration, language = struct.unpack_from('>QQIQH', buf, offset)
+    else:
+        _, _, timescale, duration, language = struct.unpack_from('>IIIIH', buf, offset)
+    # ISO 639-2 code packed as three 5 bit letters
+    language = ''.join(chr(((language >> shift) & 0x1f) + 0x60) for shift in (10, 5, 0)) if language else None
+    return {'timescale': timescale, 'duration': duration / timescale if timescale else None, 'language': language}
+
+
+def _parse_stsd(buf, offset, handler):
+    _, offset = _full_box(buf, offset)
+    if struct.unpack_from('>I', buf, offset)[0] == 0:
+        return {}
+    size, codec = struct.unpack_from('>I4s', buf, offset + 4)
+    ret = {'codec': codec.decode('latin-1').strip()}
+    if handler == 'vide' and size >= 36:
+        # visual sample entry, width and height follow 24 bytes of reserved and pre defined fields
+        ret['width'], ret['height'] = struct.unpack_from('>HH', buf, offset + 4 + 32)
+    elif handler == 'soun' and size >= 36:
+        channels = struct.unpack_from('>H', buf, offset + 4 + 24)[0]
+        ret.update({'channels': channels, 'sample_rate': struct.unpack_from('>I', buf, offset + 4 + 32)[0] >> 16})
+    return ret
+
+
+def _sample_table(buf, boxes):
+    """
+    file offsets, sizes, start times and durations (in track timescale units) of all samples of a track
+    """
+    payload, _ = boxes[b'stsz']
+    _, payload = _full_box(buf, payload)
+    sample_size, count = struct.unpack_from('>II', buf, payload)
+    if sample_size:
+        sizes = np.full(count, sample_size, dtype=np.int64)
+    else:
+        sizes = np.frombuffer(buf, dtype='>u4', count=count, offset=payload + 8).astype(np.int64)
+
+    if b'co64' in boxes:
+        payload, _ = boxes[b'co64']
+        dtype = '>u8'
+    else:
+        payload, _ = boxes[b'stco']
+        dtype = '>u4'
+    _, payload = _full_box(buf, payload)
+    chunk_count = struct.unpack_from('>I', buf, payload)[0]
+    chunk_offsets = np.frombuffer(buf, dtype=dtype, count=chunk_count, offset=payload + 4).astype(np.int64)
+
+    payload, _ = boxes[b'stsc']
+    _, payload = _full_box(buf, payload)
+    entry_count = struct.unpack_from('>I', buf, payload)[0]
+    stsc = np.frombuffer(buf, dtype='>u4', count=entry_count * 3, offset=payload + 4).reshape(-1, 3).astype(np.int64)
+    # samples per chunk for every chunk, an entry holds from its first chunk to the first chunk of the next entry
+    first_chunks = np.append(stsc[:, 0] - 1, chunk_count)
+    samples_per_chunk = np.repeat(stsc[:, 1], np.clip(np.diff(first_chunks), 0, None))[:chunk_count]
+
+    chunk_of_sample = np.repeat(np.arange(samples_per_chunk.size), samples_per_chunk)[:count]
+    sizes = sizes[:chunk_of_sample.size]
+    position = np.cumsum(sizes) - sizes
+    chunk_first_sample = (np.cumsum(samples_per_chunk) - samples_per_chunk)[chunk_of_sample]
+    offsets = chunk_offsets[chunk_of_sample] + position - position[chunk_first_sample]
+
+    payload, _ = boxes[b'stts']
+    _, payload = _full_box(buf, payload)
+    entry_count = struct.unpack_from('>I', buf, payload)[0]
+    stts = np.frombuffer(buf, dtype='>u4', count=entry_count * 2, offset=payload + 4).reshape(-1, 2).astype(np.int64)
+    durations = np.repeat(stts[:, 1], stts[:, 0])
+    if durations.size < offsets.size:
+        durations = np.append(durations, np.full(offsets.size - durations.size, durations[-1] if durations.size else 0))
+    durations = durations[:offsets.size]
+    starts = np.cumsum(durations) - durations
+    return offsets, sizes, starts, durations
+
+
+def _parse_trak(buf, start, end):
+    track = {}
+    tkhd = _find(buf, start, end, b'tkhd')
+    if tkhd:
+        track.update(_parse_tkhd(buf, tkhd[0], tkhd[1]))
+    mdia = _find(buf, start, end, b'mdia')
+    if mdia is None:
+        return track, None
+
+    mdhd = _find(buf, mdia[0], mdia[1], b'mdhd')
+    if mdhd:
+        track.update(_parse_mdhd(buf, mdhd[0]))
+    hdlr = _find(buf, mdia[0], mdia[1], b'hdlr')
+    if hdlr:
+        track['handler'] = bytes(buf[hdlr[0] + 8:hdlr[0] + 12]).decode('latin-1')
+        name = bytes(buf[hdlr[0] + 24:hdlr[1]]).strip(b'\x00 ')
+        track['name'] = name.decode('utf-8', 'replace') or None
+    stbl = _find(buf, mdia[0], mdia[1], b'minf', b'stbl')
+    if stbl is None:
+        return track, None
+
+    boxes = {box_type: (payload, box_end) for box_type, payload, box_end in iter_boxes(buf, *stbl)
+             if box_type in _SAMPLE_TABLE_BOXES or box_type == b'stsd'}
+    if b'stsd' in boxes:
+        track.update(_parse_stsd(buf, boxes[b'stsd'][0], track.get('handler')))
+    if b'stsz' in boxes:
+        track['sample_count'] = struct.unpack_from('>I', buf, boxes[b'stsz'][0] + 8)[0]
+
+    samples = None
+    if track.get('codec', '').encode('latin-1') in _TELEMETRY_FORMATS and \
+            all(k in boxes for k in (b'stsz', b'stsc', b'stts')) and (b'stco' in boxes or b'co64' in boxes):
+        samples = _sample_table(buf, boxes)
+    return track, samples
+
+
+def parse_movie(buf):
+    """
+    metadata of a MP4/MOV file and the sample tables of its telemetry tracks
+    :return: (metadata dict, {track id: (track, offsets, sizes, starts, durations)})
+    """
+    metadata = {'brand': None, 'creation_time': None, 'duration': None, 'tracks': []}
+    telemetry = {}
+    moov = None
+    for box_type, payload, box_end in iter_boxes(buf, 0, len(buf)):
+        if box_type == b'ftyp':
+            metadata['brand'] = bytes(buf[payload:payload + 4]).decode('latin-1').strip()
+        elif box_type == b'moov':
+            moov = (payload, box_end)
+    if moov is None:
+        raise VideoParsingError('no moov box, not a MP4/MOV file or the recording is unfinished')
+
+    for box_type, payload, box_end in iter_boxes(buf, *moov):
+        if box_type == b'mvhd':
+            metadata.update(_parse_mvhd(buf, payload))
+        elif box_type == b'trak':
+            track, samples = _parse_trak(buf, payload, box_end)
+            metadata['tracks'].append(track)
+            if samples is not None:
+                telemetry[track.get('id')] = (track,) + samples
+
+    video = next((t for t in metadata['tracks'] if t.get('handler') == 'vide'), None)
+    if video is not None:
+        metadata.update({'codec': video.get('codec'),
+                         'width': video.get('width'),
+                         'height': video.get('height')})
+    return metadata, telemetry
+
+
+# GPMF telemetry
+
+def iter_klv(buf, start, end):
+    """
+    yield (fourcc, type, struct size, repeat, data start) of the GPMF KLV items in buf[start:end]
+    """
+    offset = start
+    while offset + 8 <= end:
+        key = bytes(buf[offset:offset + 4])
+        if key == b'\x00\x00\x00\x00':
+            break
+        value_type, struct_size, repeat = struct.unpack_from('>BBH', buf, offset + 4)
+        size = struct_size * repeat
+        if offset + 8 + size > end:
+            logger.debug('truncated GPMF item %r at %d' % (key, offset))
+            break
+        yield key.decode('latin-1'), value_type, struct_size, repeat, offset + 8
+        offset += 8 + ((size + 3) & ~3)
+
+
+def _complex_dtype(type_string):
+    """
+    structured dtype of a '?' item from its TYPE definition, None if not supported
+    """
+    fields = []
+    for i, char in enumerate(type_string):
+        dtype = _GPMF_DTYPES.get(char)
+        if dtype is None:
+            return None
+        fields.append(('f%d' % i, dtype))
+    return np.dtype(fields)
+
+
+def _decode_value(buf, value_type, struct_size, repeat, offset, complex_type=None):
+    """
+    :return: string, list of strings, or 2d float array of `repeat` rows
+    """
+    char = chr(value_type)
+    size = struct_size * repeat
+    if char == 'c':
+        if struct_size > 1 and repeat > 1:
+            # one string per element, e.g. the units of the columns
+            return [bytes(buf[i:i + struct_size]).rstrip(b'\x00').decode('latin-1')
+                    for i in range(offset, offset + size, struct_size)]
+        return bytes(buf[offset:offset + size]).rstrip(b'\x00').decode('latin-1')
+    if char == 'U':
+        return bytes(buf[offset:offset + 16]).decode('latin-1')
+    if char == '?':
+        dtype = _complex_dtype(complex_type or '')
+        if dtype is None or dtype.itemsize != struct_size:
+            return None
+        values = np.frombuffer(buf, dtype=dtype, count=repeat, offset=offset)
+        return np.column_stack([values[name].astype(np.float64) for name in dtype.names])
+    dtype = _GPMF_DTYPES.get(char)
+    if dtype is None or struct_size % dtype.itemsize:
+        return None
+    values = np.frombuffer(buf, dtype=dtype, count=size // dtype.itemsize, offset=offset).astype(np.float64)
+    if char in _GPMF_FIXED_POINT:
+        values /= _GPMF_FIXED_POINT[char]
+    return values.reshape(repeat, struct_size // dtype.itemsize)
+
+
+def _gpsu_to_timestamp(value):
+    """
+    GPSU 'yymmddhhmmss.sss' UTC to timestamp in second
+    """
+    try:
+        t = datetime.datetime.strptime(value[:13], '%y%m%d%H%M%S.')
+        return t.replace(tzinfo=datetime.timezone.utc).timestamp() + float('0' + value[12:16])
+    except ValueError:
+        return None
+
+
+def decode_gpmf(buf, start, end, streams, sample_start, sample_duration):
+    """
+    decode the GPMF payload of one telemetry sample
+    @:param streams: fourccs of the streams to decode, e.g. GPS5, GPS9, ACCL, GYRO
+    @:param sample_start, sample_duration: in second, relative to the start of the movie
+    :return: list of {'key', 'name', 'unit', 'values', 'time', 'utc', 'fix', 'precision'},
+             'time' are the relative times of the rows, 'utc' is the GPSU time of the payload if any
+    """
+    ret = []
+    for key, value_type, struct_size, repeat, offset in iter_klv(buf, start, end):
+        if key != 'DEVC' or value_type != _GPMF_NESTED:
+            continue
+        end_of_device = offset + struct_size * repeat
+        for strm, strm_type, strm_size, strm_repeat, strm_offset in iter_klv(buf, offset, end_of_device):
+            if strm != 'STRM' or strm_type != _GPMF_NESTED:
+                continue
+            item = _decode_stream(buf, strm_offset, strm_offset + strm_size * strm_repeat, streams)
+            if item is None or item['values'].shape[0] == 0:
+                continue
+            rows = item['values'].shape[0]
+            item['time'] = sample_start + np.arange(rows) * (sample_duration / rows)
+            ret.append(item)
+    return ret
+
+
+def _decode_stream(buf, start, end, streams):
+    sticky = {}
+    item = None
+    for key, value_type, struct_size, repeat, offset in iter_klv(buf, start, end):
+        if key in streams:
+            values = _decode_value(buf, value_type, struct_size, repeat, offset, sticky.get('TYPE'))
+            if not isinstance(values, np.ndarray):
+                logger.debug('unsupported GPMF value type %r of %s' % (chr(value_type), key))
+                continue
+            item = {'key': key, 'values': values}
+        elif key in ('SCAL', 'TYPE', 'STNM', 'SIUN', 'UNIT', 'GPSU', 'GPSF', 'GPSP'):
+            sticky[key] = _decode_value(buf, value_type, struct_size, repeat, offset)
+    if item is None:
+        return None
+
+    scale = sticky.get('SCAL')
+    if isinstance(scale, np.ndarray) and scale.size:
+        scale = scale.ravel()
+        if scale.size == 1 or scale.size == item['values'].shape[1]:
+            item['values'] = item['values'] / np.where(scale == 0, 1, scale)
+    item['name'] = sticky.get('STNM')
+    item['unit'] = sticky.get('SIUN') or sticky.get('UNIT')
+    item['utc'] = _gpsu_to_timestamp(sticky['GPSU']) if isinstance(sticky.get('GPSU'), str) else None
+    item['fix'] = int(sticky['GPSF'].ravel()[0]) if isinstance(sticky.get('GPSF'), np.ndarray) else None
+    item['precision'] = float(sticky['GPSP'].ravel()[0]) / 100 if isinstance(sticky.get('GPSP'), np.ndarray) \
+        else None
+    return item
+
+
+def read_telemetry(buf, telemetry, streams, creation_time=None, budget=None):
+    """
+    stream decode the telemetry tracks sample by sample
+    @:param telemetry: telemetry tracks by id as returned by parse_movie
+    @:param creation_time: timestamp of the movie start, used when a payload has no GPS time
+    @:param budget: ParseBudget, every sample counts as a message
+    :return: {fourcc: {'name', 'unit', 'timestamp': array, 'values': 2d array, 'fix': array, 'precision': array}}
+    """
+    columns = {}
+    for track, offsets, sizes, starts, durations in telemetry.values():
+        timescale = track.get('timescale') or 1
+        for offset, size, start, duration in zip(offsets.tolist(), sizes.tolist(), starts.tolist(),
+                                                 durations.tolist()):
+            if offset + size > len(buf):
+                logger.debug('telemetry sample at %d is beyond the end of the file' % offset)
+                break
+            if budget is not None:
+                budget.message()
+            for item in decode_gpmf(buf, offset, offset + size, streams, start / timescale, duration / timescale):
+                rows = item['values'].shape[0]
+                if item['key'] == 'GPS9' and item['values'].shape[1] >= 7:
+                    # GPS9 carries its own time: days since 2000 and seconds since midnight
+                    timestamp = _GPS9_EPOCH + item['values'][:, 5] * 86400 + item['values'][:, 6]
+                elif item['utc'] is not None:
+                    timestamp = item['utc'] + item['time'] - item['time'][0]
+                elif creation_time is not None:
+                    timestamp = creation_time + item['time']
+                else:
+                    timestamp = np.full(rows, np.nan)
+                column = columns.setdefault(item['key'], {'name': item['name'], 'unit': item['unit'],
+                                                          'timestamp': [], 'values': [], 'fix': [],
+                                                          'precision': []})
+                column['timestamp'].append(timestamp)
+                column['values'].append(item['values'])
+                column['fix'].append(np.full(rows, np.nan if item['fix'] is None else item['fix']))
+                column['precision'].append(np.full(rows, np.nan if item['precision'] is None else item['precision']))
+
+    for column in columns.values():
+        width = max(v.shape[1] for v in column['values'])
+        column['values'] = np.vstack([v if v.shape[1] == width else
+                                      np.pad(v, ((0, 0), (0, width - v.shape[1])), constant_values=np.nan)
+                                      for v in column['values']])
+        for k in ('timestamp', 'fix', 'precision'):
+            column[k] = np.concatenate(column[k])
+    return columns
+
+
+def downsample(column: Dict, rate):
+    """
+    average the rows of a telemetry column into buckets of 1 / rate second, timestamped at the start of the bucket
+    """
+    if not rate or column['timestamp'].size == 0 or np.isnan(column['timestamp']).all():
+        return column
+    bucket = np.floor(column['timestamp'] * rate)
+    keep = np.flatnonzero(np.append(True, np.diff(bucket) != 0))
+    counts = np.diff(np.append(keep, bucket.size))
+    if counts.max() <= 1:
+        return column
+    ret = dict(column)
+    ret['timestamp'] = bucket[keep] / rate
+    for k in ('values', 'precision'):
+        ret[k] = np.add.reduceat(column[k], keep, axis=0) / (counts[:, None] if column[k].ndim == 2 else counts)
+    ret['fix'] = np.minimum.reduceat(column['fix'], keep)
+    return ret
+
+
+def columns_to_lists(column: Dict) -> Dict:
+    """
+    JSON friendly copy of a telemetry column, NaN becomes None
+    """
+    ret = {'name': column['name'], 'unit': column['unit']}
+    for k in ('timestamp', 'values', 'fix', 'precision'):
+        value = column[k].astype(object)
+        value[np.isnan(column[k])] = None
+        ret[k] = value.tolist()
+    return ret
+
+
+def gps_rows(column: Dict, min_fix=2) -> List[Dict]:
+    """
+    rows of a GPS5/GPS9 column, {'timestamp', 'latitude', 'longitude', 'altitude', 'speed' in m/s, 'precision'},
+    rows without a `min_fix` fix are dropped. timestamps keep their milliseconds, several points share a second
+    when the GPS is not downsampled
+    """
+    values = column['values']
+    keep = ~np.isnan(values[:, 0]) & ~np.isnan(values[:, 1]) & ~((values[:, 0] == 0) & (values[:, 1] == 0))
+    if min_fix:
+        keep &= np.isnan(column['fix']) | (column['fix'] >= min_fix)
+    ret = []
+    for i in np.flatnonzero(keep).tolist():
+        timestamp = column['timestamp'][i]
+        precision = column['precision'][i]
+        ret.append({'timestamp': None if np.isnan(timestamp) else round(float(timestamp), 3),
+                    'latitude': float(values[i, 0]),
+                    'longitude': float(values[i, 1]),
+                    'altitude': float(values[i, 2]) if values.shape[1] > 2 else None,
+                    'speed': float(values[i, 3]) if values.shape[1] > 3 else None,
+                    'precision': None if np.isnan(precision) else float(precision)})
+    return ret
@@ -26,8 +26,202 @@ DATABASES = {
     }
 }
 
+# node of the deployment, part of every guid
+PYRENEES_CLUSTER = {
+    'GROUP_NAME': 'pcc',
+    'NODE_NAME': 'parser-01',
+}
+
+MEDIA_ROOT = '~/Workspaces/data/pcc/media'  # uploads are saved under it
+
 DATA_MODEL = {
-    'SAVE_UNCLASSIFIED': True
+    'SAVE_UNCLASSIFIED': True,
+    # policy of the FIT messages no model organizes: inline, drop, count, raw or lazy, see app.parse.unclassified
+    'UNCLASSIFIED_DEFAULT': 'inline',
+    'UNCLASSIFIED_POLICIES': {
+        'hrv': 'raw',  # a message per heart beat
+        'event': 'lazy',
+        'developer_data_id': 'count',
+        'field_description': 'count',
+    },
+    'UNCLASSIFIED_CHUNK_SIZE': 10000,  # messages per side collection document
+    'UNCLASSIFIED_COMPRESSION': 'zstd',
+}
+
+SPATIAL_INDEX = {
+    'ENABLED': True,
+    'PATH': '~/Workspaces/data/pcc/spatial_index.pkl',
+    'CELL_SIZE': 0.01,  # in degree, about 1.1 km of latitude
+    'MAX_SEGMENT_CELLS': 4096,  # a longer jump between two points is a GPS glitch, don't fill all cells
+    'COMPACT_THRESHOLD': 1000,  # journal entries before `python -m app.data.geographic.index compact` rewrites it
+}
+
+GEOCODING = {
+    'ENABLED': True,
+    'QUANTUM': 0.01,  # in degree, points in the same cell share one lookup
+    'CACHE_SIZE': 65536,  # cells kept in the LRU cache
+    'MAX_DISTANCE': 300000,  # in meter, farther points are not resolved to a place
+}
+
+FIT_INCREMENTAL = {
+    'CHECKPOINT_ROOT': '~/Workspaces/data/pcc/fit_checkpoints',
+}
+
+GEOTAG = {
+    'CAMERA_TIMEZONE': 'Asia/Shanghai',  # camera clock time zone when the photo has no EXIF offset time
+    'MAX_GAP': 300,  # in second, don't interpolate across longer recording pauses
+    'TOLERANCE': 60,  # in second, photos this close to either end of a track snap to it
+}
+
+METRICS = {
+    'ENABLED': True,
+    'TRACE_SAMPLE_RATE': 0.01,  # share of outermost timers which record a trace of their nested timers
+    'TRACE_MAX_SPANS': 1000,  # child spans kept per span, e.g. per record handlers of a parse
+    'TRACE_BUFFER': 256,  # recent traces kept in memory
+    'BUCKETS': (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),  # in second
+}
+
+PARSE_BUDGET = {
+    'MAX_MESSAGES': 5000000,  # FIT messages of one file, a 24h ride at 1Hz is about 100k
+    'MAX_POINTS': 2000000,  # track points of one file
+    'MAX_BYTES': 512 * 1024 * 1024,  # file size
+    'TIMEOUT': 300,  # in second, wall clock of one parse
+    'PROFILE': False,  # trace the allocations of every parse with tracemalloc, slows parsing down a lot
+    'PROFILE_TOP': 10,  # allocation sites reported
+    'PROFILE_FRAMES': 1,  # stack frames kept per allocation site
+}
+
+VIDEO = {
+    'MAX_BYTES': 256 * 1024 * 1024 * 1024,  # media data is never read, only the size of moov matters
+    'GPS_STREAMS': ('GPS5', 'GPS9'),
+    'IMU_STREAMS': ('ACCL', 'GYRO', 'GRAV'),
+    'GPS_RATE': 1,  # in Hz, GPS is averaged down to the FIT record rate, None keeps every point
+    'IMU_RATE': 10,  # in Hz, None keeps every sample
+    'MIN_GPS_FIX': 2,  # 2D fix
+}
+
+EXPORT = {
+    'CHUNK_SIZE': 65536,  # track points per written chunk, Parquet row group or Arrow record batch
+    'BATCH_SIZE': 20,  # documents fetched from Mongo per round trip, a document holds a whole track
+    'DATUM': 'WGS84',  # coordinates are exported in this coordinate system
+    'COMPRESSION': 'zstd',  # Parquet compression
+}
+
+TRACK_CODEC = {
+    'ENABLED': True,  # store activity records encoded, they are decoded on read
+    'CHUNK_SIZE': 1024,  # records per chunk, the unit of random access
+    'COMPRESSION': 'zstd',  # zstd when zstandard is installed, zlib otherwise, None for no compression
+    'LEVEL': 6,
+    # stored values are rounded to 1 / scale, the scales are stored with the chunks
+    'SCALES': {
+        'timestamp': 1000,  # ms, the GPS of videos is sampled at 18 Hz
+        'longitude': 10 ** 7,  # about 1 cm
+        'latitude': 10 ** 7,
+        'altitude': 100,
+        'speed': 1000,
+        'heart_rate': 1,
+        'power': 1,
+        'temperature': 10,
+        'gradient': 100,
+    },
+}
+
+REGISTRY = {
+    'ENABLED': True,  # store gears and traveller profiles once, parse results keep references to them
+    'CACHE_SIZE': 4096,  # registered records remembered per process, skips the upsert of known ones
+    'ENSURE_INDEXES': True,  # create the registry indexes on first use
+    'RETRY_AFTER': 60,  # in second, records are not registered for so long after the DB failed
+}
+
+INGEST = {
+    'DIRECTORIES': ('~/Workspaces/data/pcc/media',),  # watched recursively, the media tree of the devices
+    'CHECKPOINT_PATH': '~/Workspaces/data/pcc/ingest.sqlite3',
+    'WATCHER': 'auto',  # inotify, poll, or auto for inotify when the platform has it
+    'POLL_INTERVAL': 30,  # seconds between the scans of the poll watcher
+    'FULL_SCAN_INTERVAL': 6 * 3600,  # seconds between scans checking every file, 0 for never
+    'SETTLE_SECONDS': 5,  # a file is parsed once its size and mtime stay unchanged this long
+    'WORKERS': 2,
+    'EXECUTOR': 'process',  # process or thread
+    'HASH_BLOCK': 1 << 20,  # bytes hashed at the start and the end of a file
+    'FIT_INCREMENTAL': True,  # growing FIT files are parsed incrementally
+    'PARSERS': {
+        '.fit': 'fit',
+        '.jpg': 'photo',
+        '.jpeg': 'photo',
+        '.tif': 'photo',
+        '.tiff': 'photo',
+        '.heic': 'photo',
+        '.mp4': 'video',
+        '.mov': 'video',
+    },
+    'IGNORE_SUFFIXES': ('.part', '.tmp', '.crdownload', '~'),
+}
+
+VALIDATION = {
+    # values out of range are dropped, speed in km/h
+    'RANGES': {
+        'altitude': (-500, 9000),
+        'speed': (0, 300),
+        'heart_rate': (20, 250),
+        'power': (0, 3000),
+        'temperature': (-60, 70),
+    },
+    # invalid values of devices writing them instead of leaving the field out
+    'SENTINELS': {
+        'position': (2 ** 31 - 1, -2 ** 31, 2 ** 32 - 1),
+        'heart_rate': (255,),
+        'power': (65535,),
+        'temperature': (127,),
+    },
+    'REJECT_NULL_ISLAND': True,  # 0, 0 is a device without fix
+}
+
+MERGE = {
+    'RESOLUTION': 1,  # in second, records of the merged files closer than this are one point
+    'BATCH_SIZE': 1024,  # records decoded and validated at a time when streaming a FIT file
+    # source names by preference per field, sources not listed follow in their given order
+    'PREFERENCES': {
+        'position': (),
+        'altitude': (),
+        'speed': (),
+        'heart_rate': (),
+        'power': (),
+        'temperature': (),
+        'gradient': (),
+    },
+    'MAX_GAP': 300,  # in second, longer pauses don't count as timer time
+    'MOVING_SPEED': 2,  # in km/h, slower records don't count as moving time
+    'ASCENT_THRESHOLD': 3,  # in meter, altitude changes below it are noise for the ascent and descent
+}
+
+ROLLUP = {
+    'ENABLED': True,  # update the rollups when a parse result is saved
+    'TIMEZONE': 'Asia/Shanghai',  # days, weeks and months of the owner rollups start at midnight of this time zone
+    'PERIODS': ('day', 'week', 'month'),  # buckets of the owner rollups, weeks are ISO weeks
+    'GEAR_PERIODS': ('all', 'month'),  # buckets of the gear rollups, all for the lifetime totals
+    'ANONYMOUS': 'anonymous',  # owner of the files saved without user
+    'ENSURE_INDEXES': True,
+    'BATCH_SIZE': 100,  # documents fetched at a time by a rebuild
+}
+
+HEATMAP = {
+    'ENABLED': True,  # count the tracks of the saved parse results in the heatmap tiles
+    'PATH': '~/Workspaces/data/pcc/heatmap',  # directory of the z/x/y tiles
+    'MIN_ZOOM': 2,
+    'MAX_ZOOM': 14,  # about 10 m pixels, deeper zooms scale these tiles up
+    'TILE_SIZE': 256,  # in pixel, a power of 2 up to 256
+    'MAX_SEGMENT_PIXELS': 2048,  # in MAX_ZOOM pixel, a longer jump between two points is a GPS glitch
+    'SATURATION': 50,  # tracks through a pixel for the strongest color
+    'MAX_AGE': 300,  # in second, HTTP cache time of the served tiles
+    'BATCH_SIZE': 20,  # documents fetched at a time by a rebuild
+}
+
+DEDUPE = {
+    'ENABLED': True,  # link saved photos to a stored photo with the same content or a near identical thumbnail
+    'HASH_SIZE': 8,  # the perceptual hash has HASH_SIZE * HASH_SIZE bits
+    'MAX_DISTANCE': 6,  # in bit, thumbnails with hashes this close are near duplicates, e.g. burst shots
+    'HASH_BLOCK': 1 << 20,  # bytes read at a time for the content hash
+    'DROP_NEAR_DUPLICATE_THUMBNAIL': True,  # near duplicates are stored without their thumbnail
 }
 
 
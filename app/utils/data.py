@@ -3,11 +3,8 @@ from decimal import Decimal
 import uuid
 import re
 
-from django.core.exceptions import ValidationError
-from django.core.validators import validate_email
-
-from entry.settings import PYRENEES_CLUSTER
-from utils.date import now
+from app.settings import PYRENEES_CLUSTER
+from app.utils.date import now
 
 
 def clean_values(data, instance):
@@ -73,6 +70,9 @@ def is_mobile(text):
 
 
 def is_email(text):
+    from django.core.exceptions import ValidationError
+    from django.core.validators import validate_email
+
     try:
         validate_email(text)
         return True
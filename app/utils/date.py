@@ -37,6 +37,8 @@ def get_25():
 
 def to_timestamp(value, tz_str='UTC'):
     tz = pytz.timezone(tz_str)
+    if isinstance(value, datetime.datetime):
+        return int((value if value.tzinfo is not None else tz.localize(value)).timestamp())
     if not isinstance(value, str):
         value = str(value)
     value = value.replace('-', '').replace(':', '').replace(' ', '')
@@ -44,8 +46,8 @@ def to_timestamp(value, tz_str='UTC'):
         logger.debug('unknown datetime format with value %s' % value)
         return None
     t = datetime.datetime.strptime(value, '%Y%m%d%H%M%S')
-    t = t.replace(tzinfo=tz).astimezone(tz=pytz.timezone('UTC')).timestamp()
-    return int(t)
+    # replace(tzinfo=) would take the LMT offset of pytz zones, localize takes the one in effect at that time
+    return int(tz.localize(t).timestamp())
 
 
 def add_timezone(value, to_tz_str, org_tz_str='UTC'):
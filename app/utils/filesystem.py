@@ -1,8 +1,6 @@
-from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
-
-from entry import settings
-from utils.data import guid
-from utils.date import get_10
+from app import settings
+from app.utils.data import guid
+from app.utils.date import get_10
 import os
 import logging
 
@@ -31,12 +29,14 @@ def make_dirs_by_date(root_path):
         return None
 
 
-def get_relative_path(abspath, sub_path=settings.MEDIA_ROOT):
+def get_relative_path(abspath, sub_path=os.path.expanduser(settings.MEDIA_ROOT)):
     return abspath.replace(sub_path, '', 1)
 
 
-def save_file(file, name=None, extension=None, save_to_path=settings.MEDIA_ROOT,
+def save_file(file, name=None, extension=None, save_to_path=os.path.expanduser(settings.MEDIA_ROOT),
               save_to_name=None, use_date_directory=False):
+    from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+
     file_name = save_to_name if save_to_name else guid()
     file_extension = extension if extension else (name.split('.')[-1] if name else '')
     file_extension = '.' + file_extension if file_extension[0] != '.' else file_extension
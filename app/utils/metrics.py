@@ -0,0 +1,266 @@
+"""
+lightweight in-process metrics: counters, histograms and sampled traces, exposed in Prometheus text format.
+when METRICS['ENABLED'] is off every timer is a single flag check
+"""
+import bisect
+import collections
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from typing import Dict, Tuple
+
+from app.settings import METRICS
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_DOCUMENTATION = {
+    'parser_parse_seconds': 'Time of Parser.parse by parser class',
+    'parser_handler_seconds': 'Time of the per message _parse_* handlers',
+    'parser_model_seconds': 'Time of mapping decoded messages to data models',
+    'model_clean_seconds': 'Time of data model validation and cleaning',
+    'fit_decode_seconds': 'Time spent in fitparse decoding per file',
+    'fit_decode_items_total': 'FIT messages decoded',
+    'exif_decode_seconds': 'Time of exifread decoding per photo',
+    'video_decode_seconds': 'Time of reading the moov box and the telemetry of a video',
+    'db_operation_seconds': 'Time of DB operations',
+    'db_encode_seconds': 'Time of JSON encoding documents for and from DB',
+    'http_request_seconds': 'Time of HTTP requests by endpoint',
+    'ingest_files_total': 'Files handled by the ingest daemon by status',
+    'ingest_parse_seconds': 'Time of parsing and saving a file in an ingest worker',
+    'rollup_updates_total': 'Rollup updates of saved files by result',
+    'photo_duplicates_total': 'Saved photos linked to a stored one by kind, exact or near',
+}
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _label_key(labels: Dict):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: Tuple, extra: Dict = None):
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for k, v in items)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] += value
+
+    def expose(self):
+        with self._lock:
+            values = list(self._values.items())
+        return ['%s%s %s' % (self.name, _format_labels(key), repr(float(value))) for key, value in values]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=METRICS['BUCKETS']):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def expose(self):
+        with self._lock:
+            values = [(key, list(counts[0]), counts[1], counts[2]) for key, counts in self._values.items()]
+        lines = []
+        for key, buckets, total, count in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                labels = _format_labels(key, {'le': repr(float(bound))})
+                lines.append('%s_bucket%s %d' % (self.name, labels, cumulative))
+            lines.append('%s_bucket%s %d' % (self.name, _format_labels(key, {'le': '+Inf'}), count))
+            lines.append('%s_sum%s %s' % (self.name, _format_labels(key), repr(total)))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(key), count))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.traces = collections.deque(maxlen=METRICS['TRACE_BUFFER'])
+
+    def _get(self, cls, name, documentation):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, cls(name, documentation))
+        return metric
+
+    def counter(self, name, documentation=None) -> Counter:
+        return self._get(Counter, name, documentation or _DOCUMENTATION.get(name, name))
+
+    def histogram(self, name, documentation=None) -> Histogram:
+        return self._get(Histogram, name, documentation or _DOCUMENTATION.get(name, name))
+
+    def expose(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def is_enabled():
+    return METRICS['ENABLED']
+
+
+class _Span:
+    __slots__ = ('name', 'labels', 'start', 'children', 'sampled')
+
+    def __init__(self, name, labels, sampled):
+        self.name = name
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.children = []
+        self.sampled = sampled
+
+
+class timer:
+    """
+    time a block into a histogram `name` with labels, usable as context manager and decorator.
+    a sampled share of the outermost timers also record a trace of the nested timers
+    """
+
+    __slots__ = ('name', 'labels', '_start', '_span', '_token')
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self._start = None
+        self._span = None
+        self._token = None
+
+    def __enter__(self):
+        if not METRICS['ENABLED']:
+            return self
+        parent = _current_span.get()
+        if parent is not None and len(parent.children) < METRICS['TRACE_MAX_SPANS']:
+            self._span = _Span(self.name, self.labels, True)
+            parent.children.append(self._span)
+            self._token = _current_span.set(self._span)
+        elif METRICS['TRACE_SAMPLE_RATE'] and random.random() < METRICS['TRACE_SAMPLE_RATE']:
+            self._span = _Span(self.name, self.labels, True)
+            self._token = _current_span.set(self._span)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._start is None:
+            return False
+        elapsed = time.perf_counter() - self._start
+        registry.histogram(self.name).observe(elapsed, **self.labels)
+        if exc_type is not None:
+            registry.counter(self.name.rsplit('_seconds', 1)[0] + '_errors_total').inc(**self.labels)
+        if self._token is not None:
+            _current_span.reset(self._token)
+            if _current_span.get() is None:
+                _finish_trace(self._span, elapsed)
+        self._start = self._span = self._token = None
+        return False
+
+    def __call__(self, func):
+        name, labels = self.name, self.labels
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS['ENABLED']:
+                return func(*args, **kwargs)
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def _span_to_dict(span: _Span, end=None):
+    return {'name': span.name, 'labels': span.labels,
+            'seconds': (end if end is not None else time.perf_counter()) - span.start,
+            'children': [_span_to_dict(child) for child in span.children]}
+
+
+def _finish_trace(span: _Span, elapsed):
+    trace = _span_to_dict(span, span.start + elapsed)
+    registry.traces.append(trace)
+    logger.debug('trace %s %.6fs with %s child spans' % (span.name, elapsed, len(span.children)))
+
+
+def inc(name, value=1, **labels):
+    if METRICS['ENABLED']:
+        registry.counter(name).inc(value, **labels)
+
+
+def observe(name, value, **labels):
+    if METRICS['ENABLED']:
+        registry.histogram(name).observe(value, **labels)
+
+
+def timed_iter(iterable, name, **labels):
+    """
+    yield from iterable and observe the total time spent producing the items once it is exhausted,
+    used for lazy decoders where decoding is interleaved with processing
+    """
+    if not METRICS['ENABLED']:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    spent = 0.0
+    count = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                spent += time.perf_counter() - start
+                break
+            spent += time.perf_counter() - start
+            count += 1
+            yield item
+    finally:
+        registry.histogram(name).observe(spent, **labels)
+        registry.counter(name.rsplit('_seconds', 1)[0] + '_items_total').inc(count, **labels)
+
+
+def expose():
+    """
+    all metrics in Prometheus text exposition format
+    """
+    return registry.expose()
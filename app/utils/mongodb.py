@@ -1,13 +1,12 @@
 import datetime
 import json
 import logging
+import sys
 
-import exifread
-from bson import ObjectId
-from pymongo import MongoClient
 from app.settings import DATABASES
 from app.utils.data import guid
 from app.utils.date import now
+from app.utils.metrics import timer
 
 logger = logging.getLogger(__name__)
 
@@ -16,17 +15,34 @@ class JSONEncoder(json.JSONEncoder):
     """convert ObjectId and datetime to string"""
 
     def default(self, o):
-        if isinstance(o, ObjectId):
-            return str(o)
         if isinstance(o, datetime.datetime):
             return datetime.datetime.strftime(o, '%Y-%m-%d %H:%M:%S')
         if isinstance(o, datetime.time):
             return datetime.time.strftime(o, '%H:%M:%S')
-        if isinstance(o, exifread.Ratio):
+        # there can't be an ObjectId or Ratio before bson or exifread is imported, don't import them here
+        bson, exif_utils = sys.modules.get('bson'), sys.modules.get('exifread.utils')
+        if bson is not None and isinstance(o, bson.ObjectId):
+            return str(o)
+        if exif_utils is not None and isinstance(o, exif_utils.Ratio):
             return str(o)
         return json.JSONEncoder.default(self, o)
 
 
+def _decode_tracks(record):
+    """
+    decode the tracks stored by the track codec in place, see app.data.codec
+    """
+    data = record.get('data') if isinstance(record, dict) else None
+    if not isinstance(data, dict):
+        return record
+    for key, value in data.items():
+        if isinstance(value, dict) and '_codec' in value:
+            from app.data.codec import decode_track
+
+            data[key] = decode_track(value)
+    return record
+
+
 class DB:
     """
     'mongo': {
@@ -39,6 +55,8 @@ class DB:
     """
 
     def __init__(self, connect_str=None, db_settings_key=None):
+        from pymongo import MongoClient
+
         if connect_str is None:
             if db_settings_key is None:
                 connect_str = self._get_connect_string(DATABASES['mongodb'])
@@ -65,26 +83,112 @@ class DB:
         else:
             return 'mongodb://%s:%s/%s' % (host_config['HOST'], host_config['PORT'], host_config['NAME'],)
 
+    @timer('db_operation_seconds', operation='insert')
     def insert(self, collection, data, by_user=None):
         if '_db_pyr_guid' not in data:
             data.update({'_db_pyr_guid': guid()})
         self.touch(data, by_user)
         try:
-            json_data = JSONEncoder().encode(data)
-            self.db[collection].insert(json.loads(json_data))
+            with timer('db_encode_seconds', operation='insert'):
+                json_data = json.loads(JSONEncoder().encode(data))
+            self.db[collection].insert_one(json_data)
         except Exception as err:
             logger.error(err)
         return data['_db_pyr_guid']
 
+    @timer('db_operation_seconds', operation='append')
+    def append(self, collection, guid, data, by_user=None, increment=None, unique=None, replace=None):
+        """
+        append items to array fields of a stored document
+        @:param data: {'field.path': [items]}
+        @:param increment: {'field.path': number} added to number fields
+        @:param unique: {'field.path': [items]} appended unless an equal item is there already
+        @:param replace: {'field.path': value} set instead of appended, e.g. lists merged by the caller
+        """
+        data = {k: v for k, v in data.items() if v}
+        unique = {k: v for k, v in (unique or {}).items() if v}
+        update = {'$set': {'_db_updated_time': now(), '_db_updated_by': by_user.username if by_user else None}}
+        with timer('db_encode_seconds', operation='append'):
+            data, unique, replace = json.loads(JSONEncoder().encode([data, unique, replace or {}]))
+        if data:
+            update.update({'$push': {k: {'$each': v} for k, v in data.items()}})
+        if unique:
+            update.update({'$addToSet': {k: {'$each': v} for k, v in unique.items()}})
+        update['$set'].update(replace)
+        if increment:
+            update.update({'$inc': increment})
+        try:
+            self.db[collection].update_one({'_db_pyr_guid': guid}, update)
+        except Exception as err:
+            logger.error(err)
+        return guid
+
+    @timer('db_operation_seconds', operation='upsert')
+    def upsert(self, collection, filter_data, data, by_user=None):
+        """
+        update the document matching filter_data with data, insert it when there is none
+        :return: guid of the document, None when the DB failed
+        """
+        from pymongo import ReturnDocument
+
+        created = {'_db_pyr_guid': guid()}
+        self.touch(created, by_user)
+        updated = {k: created.pop(k) for k in ('_db_updated_time', '_db_updated_by')}
+        with timer('db_encode_seconds', operation='upsert'):
+            json_data = json.loads(JSONEncoder().encode(dict(data, **updated)))
+        try:
+            ret = self.db[collection].find_one_and_update(filter_data,
+                                                          {'$set': json_data, '$setOnInsert': created},
+                                                          projection={'_db_pyr_guid': True}, upsert=True,
+                                                          return_document=ReturnDocument.AFTER)
+        except Exception as err:
+            logger.error(err)
+            return None
+        return ret['_db_pyr_guid']
+
+    @timer('db_operation_seconds', operation='update')
+    def update(self, collection, filter_data, update, upsert=False):
+        """
+        apply an update to the document matching filter_data, for conditional updates like $inc deltas
+        :return: True if a document was updated or inserted, False if none matched, None if the DB failed
+        """
+        try:
+            ret = self.db[collection].update_one(filter_data, update, upsert=upsert)
+        except Exception as err:
+            from pymongo.errors import DuplicateKeyError
+
+            if isinstance(err, DuplicateKeyError):
+                # an upsert colliding with a unique index, the document is there but does not match the filter
+                logger.debug(err)
+                return False
+            logger.warning(err)
+            return None
+        return bool(ret.modified_count or ret.upserted_id is not None)
+
+    def drop(self, collection):
+        try:
+            self.db[collection].drop()
+        except Exception as err:
+            logger.error(err)
+
+    def create_index(self, collection, field, unique=False):
+        try:
+            self.db[collection].create_index(field, unique=unique)
+        except Exception as err:
+            logger.error(err)
+
+    @timer('db_operation_seconds', operation='find_one')
     def find_one(self, collection, filter_data=None):
         if filter_data is None:
             filter_data = {}
         if isinstance(type, str):
             filter_data = {'_db_pyr_guid': filter_data}
-        ret = self.db[collection].find_one(filter_data)
-        tmp = JSONEncoder().encode(ret)
-        return json.loads(tmp)
+        ret = _decode_tracks(self.db[collection].find_one(filter_data))
+        with timer('db_encode_seconds', operation='find_one'):
+            tmp = JSONEncoder().encode(ret)
+            return json.loads(tmp)
 
+    @timer('db_operation_seconds', operation='query')
     def query(self, collection, filter_data=None, sort_data=None, limit=None):
         if filter_data is None:
             filter_data = {}
@@ -97,10 +201,27 @@ class DB:
         records = self.db[collection].find(filter_data).sort(sort_data).limit(limit)
         result = []
         for record in records:
-            tmp = JSONEncoder().encode(record)
-            result.append(json.dumps(tmp))
+            _decode_tracks(record)
+            with timer('db_encode_seconds', operation='query'):
+                tmp = JSONEncoder().encode(record)
+                result.append(json.dumps(tmp))
         return result
 
+    def iterate(self, collection, filter_data=None, projection=None, batch_size=None, decode_tracks=True):
+        """
+        yield the stored documents one by one, fetched from the server `batch_size` at a time
+        @:param decode_tracks: False to get the tracks as stored, for streaming them with app.data.codec.iter_track
+        """
+        cursor = self.db[collection].find(filter_data or {}, projection)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        try:
+            for record in cursor:
+                record.pop('_id', None)
+                yield _decode_tracks(record) if decode_tracks else record
+        finally:
+            cursor.close()
+
     @staticmethod
     def touch(data, by_user=None):
         if '_db_created_time' not in data:
@@ -135,6 +256,33 @@ class DB:
     class Collections:
         MEDIA_PARSED_DATA = 'media_parsed_data'
         MEDIA_ANALYSIS_DATA = 'media_analysis_data'
+        GEAR = 'gear'
+        TRAVELLER_PROFILE = 'traveller_profile'
+        FIT_UNCLASSIFIED = 'fit_unclassified'
+        ROLLUP = 'rollup'
+        ROLLUP_LEDGER = 'rollup_ledger'
+        PHOTO_HASH = 'photo_hash'
+
+
+class _LazyDB:
+    """
+    stands for the default DB, connects on first use so importing a module using it stays cheap
+    """
+    Collections = DB.Collections
+
+    def __init__(self):
+        self._db = None
+
+    def use(self, db):
+        """
+        replace the default DB, for the modules using it through this handle, e.g. by an in memory one
+        """
+        self._db = db
+
+    def __getattr__(self, item):
+        if self._db is None:
+            self._db = DB()
+        return getattr(self._db, item)
 
 
-mongodb = DB()
+mongodb = _LazyDB()
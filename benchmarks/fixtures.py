@@ -0,0 +1,553 @@
+"""
+synthetic FIT, EXIF JPEG and GoPro style MP4 fixtures for the benchmarks, deterministic for a given seed
+"""
+import datetime
+import math
+import os
+import random
+import struct
+
+import numpy as np
+
+FIT_EPOCH = 631065600  # 1989-12-31 00:00:00 UTC
+FIT_HEADER_SIZE = 14
+FIT_PROTOCOL_VERSION = 0x20
+FIT_PROFILE_VERSION = 2132
+
+# base type: (id, struct format)
+_BASE_TYPES = {
+    'enum': (0x00, 'B'),
+    'sint8': (0x01, 'b'),
+    'uint8': (0x02, 'B'),
+    'sint16': (0x83, 'h'),
+    'uint16': (0x84, 'H'),
+    'sint32': (0x85, 'i'),
+    'uint32': (0x86, 'I'),
+    'uint32z': (0x8C, 'I'),
+}
+
+# message name: (global message number, [(field number, field name, base type), ...])
+FIT_MESSAGES = {
+    'file_id': (0, [(0, 'type', 'enum'), (1, 'manufacturer', 'uint16'), (2, 'product', 'uint16'),
+                    (3, 'serial_number', 'uint32z'), (4, 'time_created', 'uint32')]),
+    'user_profile': (3, [(1, 'gender', 'enum'), (2, 'age', 'uint8'), (3, 'height', 'uint8'),
+                         (4, 'weight', 'uint16'), (8, 'resting_heart_rate', 'uint8')]),
+    'session': (18, [(253, 'timestamp', 'uint32'), (2, 'start_time', 'uint32'), (5, 'sport', 'enum'),
+                     (7, 'total_elapsed_time', 'uint32'), (8, 'total_timer_time', 'uint32'),
+                     (9, 'total_distance', 'uint32'), (22, 'total_ascent', 'uint16'),
+                     (23, 'total_descent', 'uint16')]),
+    'record': (20, [(253, 'timestamp', 'uint32'), (0, 'position_lat', 'sint32'), (1, 'position_long', 'sint32'),
+                    (5, 'distance', 'uint32'), (78, 'enhanced_altitude', 'uint32'), (73, 'enhanced_speed', 'uint32'),
+                    (3, 'heart_rate', 'uint8'), (4, 'cadence', 'uint8'), (7, 'power', 'uint16'),
+                    (13, 'temperature', 'sint8')]),
+    'event': (21, [(253, 'timestamp', 'uint32'), (0, 'event', 'enum'), (1, 'event_type', 'enum')]),
+    'device_info': (23, [(253, 'timestamp', 'uint32'), (0, 'device_index', 'uint8'), (2, 'manufacturer', 'uint16'),
+                         (3, 'serial_number', 'uint32z'), (4, 'product', 'uint16'),
+                         (5, 'software_version', 'uint16')]),
+    'activity': (34, [(253, 'timestamp', 'uint32'), (0, 'total_timer_time', 'uint32'), (1, 'num_sessions', 'uint16'),
+                      (2, 'type', 'enum')]),
+}
+
+_CRC_TABLE = (0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+              0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400)
+
+
+def fit_crc(data, crc=0):
+    for byte in data:
+        tmp = _CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ _CRC_TABLE[byte & 0xF]
+        tmp = _CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ _CRC_TABLE[(byte >> 4) & 0xF]
+    return crc
+
+
+class FitWriter:
+    """
+    minimal FIT encoder, one local message type per message name
+    """
+
+    def __init__(self):
+        self._body = bytearray()
+        self._local = {}
+
+    def _define(self, name):
+        local = len(self._local)
+        global_num, fields = FIT_MESSAGES[name]
+        self._body += struct.pack('<BBBHB', 0x40 | local, 0, 0, global_num, len(fields))
+        for number, _, base_type in fields:
+            type_id, fmt = _BASE_TYPES[base_type]
+            self._body += struct.pack('<BBB', number, struct.calcsize(fmt), type_id)
+        self._local[name] = (local, '<' + ''.join(_BASE_TYPES[f[2]][1] for f in fields), fields)
+
+    def write(self, name, **values):
+        """
+        @:param values: raw field values, scale and offset already applied
+        """
+        if name not in self._local:
+            self._define(name)
+        local, fmt, fields = self._local[name]
+        self._body.append(local)
+        self._body += struct.pack(fmt, *[values.get(field_name, 0) for _, field_name, _ in fields])
+
+    def to_bytes(self):
+        header = struct.pack('<BBHI4s', FIT_HEADER_SIZE, FIT_PROTOCOL_VERSION, FIT_PROFILE_VERSION, len(self._body),
+                             b'.FIT')
+        header += struct.pack('<H', fit_crc(header))
+        data = header + bytes(self._body)
+        return data + struct.pack('<H', fit_crc(data))
+
+
+def _semicircles(degree):
+    return int(round(degree * 2 ** 31 / 180))
+
+
+def make_fit(duration=3600, sampling_rate=1.0, start_time=1569544331, start_position=(104.0657, 30.6595),
+             sensors=3, device_info_interval=600, event_interval=300, seed=0):
+    """
+    FIT activity file of a synthetic ride
+    @:param duration: in second
+    @:param sampling_rate: records per second, rates above 1 Hz repeat timestamps like sub-second loggers do
+    @:param sensors: number of paired sensors, each repeats a device_info message every device_info_interval
+    @:return bytes
+    """
+    rng = random.Random(seed)
+    writer = FitWriter()
+    writer.write('file_id', type=4, manufacturer=1, product=2713, serial_number=3900000000 + seed,
+                 time_created=start_time - FIT_EPOCH)
+    writer.write('user_profile', gender=1, age=35, height=178, weight=720, resting_heart_rate=52)
+
+    longitude, latitude = start_position
+    altitude, distance, heading = 500.0, 0.0, rng.uniform(0, 2 * math.pi)
+    count = int(duration * sampling_rate)
+    for i in range(count):
+        elapsed = i / sampling_rate
+        timestamp = start_time + int(elapsed) - FIT_EPOCH
+        if i % max(int(device_info_interval * sampling_rate), 1) == 0:
+            for index in range(sensors + 1):
+                writer.write('device_info', timestamp=timestamp, device_index=index, manufacturer=1 + index,
+                             serial_number=1000 + index, product=1900 + index, software_version=1000 + index)
+        if event_interval and i % max(int(event_interval * sampling_rate), 1) == 0:
+            writer.write('event', timestamp=timestamp, event=0, event_type=0 if i == 0 else 3)
+
+        speed = max(0.0, 7.0 + 2.0 * math.sin(elapsed / 300) + rng.gauss(0, 0.3))
+        heading += rng.gauss(0, 0.05)
+        step = speed / sampling_rate
+        latitude += step * math.cos(heading) / 111320
+        longitude += step * math.sin(heading) / (111320 * math.cos(math.radians(latitude)))
+        altitude += rng.gauss(0, 0.2)
+        distance += step
+        writer.write('record', timestamp=timestamp, position_lat=_semicircles(latitude),
+                     position_long=_semicircles(longitude), distance=int(distance * 100),
+                     enhanced_altitude=int((altitude + 500) * 5), enhanced_speed=int(speed * 1000),
+                     heart_rate=int(120 + 20 * math.sin(elapsed / 600)), cadence=85, power=int(180 + 40 * speed / 7),
+                     temperature=18)
+
+    end_time = start_time + int(duration) - FIT_EPOCH
+    writer.write('session', timestamp=end_time, start_time=start_time - FIT_EPOCH, sport=2,
+                 total_elapsed_time=int(duration * 1000), total_timer_time=int(duration * 1000),
+                 total_distance=int(distance * 100), total_ascent=120, total_descent=118)
+    writer.write('activity', timestamp=end_time, total_timer_time=int(duration * 1000), num_sessions=1, type=0)
+    return writer.to_bytes()
+
+
+# TIFF field types
+_ASCII, _SHORT, _LONG, _RATIONAL, _UNDEFINED, _BYTE = 2, 3, 4, 5, 7, 1
+
+
+def _ascii(text):
+    data = text.encode('ascii') + b'\x00'
+    return _ASCII, len(data), data
+
+
+def _short(*values):
+    return _SHORT, len(values), struct.pack('<%dH' % len(values), *values)
+
+
+def _long(*values):
+    return _LONG, len(values), struct.pack('<%dI' % len(values), *values)
+
+
+def _rational(*values):
+    data = b''.join(struct.pack('<II', int(round(v * 10000)), 10000) for v in values)
+    return _RATIONAL, len(values), data
+
+
+def _dms(degree):
+    degree = abs(degree)
+    d = int(degree)
+    m = int((degree - d) * 60)
+    return d, m, (degree - d - m / 60) * 3600
+
+
+class _Ifd:
+    def __init__(self, entries):
+        # tag: (type, count, data) or tag: _Ifd / ('offset', name) pointer placeholders
+        self.entries = entries
+        self.offset = 0
+
+    def overflow_size(self):
+        return sum(len(v[2]) + len(v[2]) % 2 for v in self.entries.values()
+                   if isinstance(v, tuple) and len(v) == 3 and len(v[2]) > 4)
+
+    def size(self):
+        return 2 + 12 * len(self.entries) + 4 + self.overflow_size()
+
+    def pack(self, next_offset, pointers):
+        head = struct.pack('<H', len(self.entries))
+        overflow = bytearray()
+        overflow_start = self.offset + 2 + 12 * len(self.entries) + 4
+        for tag in sorted(self.entries):
+            value = self.entries[tag]
+            if isinstance(value, _Ifd):
+                value = _long(value.offset)
+            elif isinstance(value, str):
+                value = _long(pointers[value])
+            field_type, count, data = value
+            if len(data) > 4:
+                head += struct.pack('<HHII', tag, field_type, count, overflow_start + len(overflow))
+                overflow += data + b'\x00' * (len(data) % 2)
+            else:
+                head += struct.pack('<HHI', tag, field_type, count) + data.ljust(4, b'\x00')
+        return bytes(head) + struct.pack('<I', next_offset) + bytes(overflow)
+
+
+# luminance quantization table and Huffman tables of the JPEG standard, annex K
+_JPEG_QUANTIZATION = np.array([
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55, 14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62, 18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99], dtype=np.float64)
+_JPEG_DC = ((0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0), tuple(range(12)))
+_JPEG_AC = ((0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7D),
+            (0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07, 0x22,
+             0x71, 0x14, 0x32, 0x81, 0x91, 0xA1, 0x08, 0x23, 0x42, 0xB1, 0xC1, 0x15, 0x52, 0xD1, 0xF0, 0x24, 0x33,
+             0x62, 0x72, 0x82, 0x09, 0x0A, 0x16, 0x17, 0x18, 0x19, 0x1A, 0x25, 0x26, 0x27, 0x28, 0x29, 0x2A, 0x34,
+             0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49, 0x4A, 0x53, 0x54, 0x55,
+             0x56, 0x57, 0x58, 0x59, 0x5A, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69, 0x6A, 0x73, 0x74, 0x75, 0x76,
+             0x77, 0x78, 0x79, 0x7A, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89, 0x8A, 0x92, 0x93, 0x94, 0x95, 0x96,
+             0x97, 0x98, 0x99, 0x9A, 0xA2, 0xA3, 0xA4, 0xA5, 0xA6, 0xA7, 0xA8, 0xA9, 0xAA, 0xB2, 0xB3, 0xB4, 0xB5,
+             0xB6, 0xB7, 0xB8, 0xB9, 0xBA, 0xC2, 0xC3, 0xC4, 0xC5, 0xC6, 0xC7, 0xC8, 0xC9, 0xCA, 0xD2, 0xD3, 0xD4,
+             0xD5, 0xD6, 0xD7, 0xD8, 0xD9, 0xDA, 0xE1, 0xE2, 0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9, 0xEA, 0xF1,
+             0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7, 0xF8, 0xF9, 0xFA))
+_ZIGZAG = sorted(range(64), key=lambda i: (i // 8 + i % 8, i // 8 if (i // 8 + i % 8) % 2 else i % 8))
+
+
+def _huffman_codes(counts, symbols):
+    """
+    symbol: (code, length) of a Huffman table
+    """
+    ret, code, index = {}, 0, 0
+    for length, count in enumerate(counts, 1):
+        for _ in range(count):
+            ret[symbols[index]] = (code, length)
+            code += 1
+            index += 1
+        code <<= 1
+    return ret
+
+
+def encode_jpeg(pixels, quality=90):
+    """
+    baseline JPEG of a height x width gray or height x width x 3 RGB image, RGB is stored as YCbCr with the chroma
+    subsampled by 2 like the thumbnails of cameras
+    @:return bytes
+    """
+    pixels = np.asarray(pixels, dtype=np.float64)
+    height, width = pixels.shape[:2]
+    scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+    table = np.clip(np.floor((_JPEG_QUANTIZATION * scale + 50) / 100), 1, 255)
+    if pixels.ndim == 2:
+        planes, sampling = [pixels], 1
+    else:
+        r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+        planes = [0.299 * r + 0.587 * g + 0.114 * b, 128 - 0.168736 * r - 0.331264 * g + 0.5 * b,
+                  128 + 0.5 * r - 0.418688 * g - 0.081312 * b]
+        sampling = 2
+    rows, columns = -(-height // (8 * sampling)), -(-width // (8 * sampling))
+    n = np.arange(8)
+    dct = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / 16) * 0.5
+    dct[0] /= math.sqrt(2)
+
+    blocks = []  # per plane: rows x columns x blocks per MCU x 64 zig-zag coefficients
+    for index, plane in enumerate(planes):
+        plane = np.pad(plane, ((0, rows * 8 * sampling - height), (0, columns * 8 * sampling - width)), mode='edge')
+        factor = sampling if index == 0 else 1
+        if index:
+            plane = plane.reshape(rows * 8, sampling, columns * 8, sampling).mean(axis=(1, 3))
+        tiles = plane.reshape(rows, factor, 8, columns, factor, 8).transpose(0, 3, 1, 4, 2, 5) - 128
+        coefficients = np.rint((dct @ tiles @ dct.T).reshape(rows, columns, factor * factor, 64) / table)
+        blocks.append(coefficients[..., _ZIGZAG].astype(np.int64).tolist())
+
+    dc_codes, ac_codes = _huffman_codes(*_JPEG_DC), _huffman_codes(*_JPEG_AC)
+    bits, length = 0, 0
+    predictions = [0] * len(planes)
+
+    def put(code, size):
+        nonlocal bits, length
+        bits, length = bits << size | code, length + size
+
+    def put_value(value):
+        size = abs(value).bit_length()
+        return value if value >= 0 else value + (1 << size) - 1, size
+
+    for row in range(rows):
+        for column in range(columns):
+            for index in range(len(planes)):
+                for block in blocks[index][row][column]:
+                    value, size = put_value(block[0] - predictions[index])
+                    predictions[index] = block[0]
+                    put(*dc_codes[size])
+                    put(value, size)
+                    run = 0
+                    last = max([k for k in range(1, 64) if block[k]] or [0])
+                    for k in range(1, last + 1):
+                        if not block[k]:
+                            run += 1
+                            continue
+                        while run > 15:
+                            put(*ac_codes[0xF0])
+                            run -= 16
+                        value, size = put_value(block[k])
+                        put(*ac_codes[run << 4 | size])
+                        put(value, size)
+                        run = 0
+                    if last < 63:
+                        put(*ac_codes[0x00])
+    padding = -length % 8
+    put((1 << padding) - 1, padding)
+    data = bits.to_bytes(length // 8, 'big').replace(b'\xff', b'\xff\x00')
+
+    def segment(marker, payload):
+        return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+    components = [(1, sampling << 4 | sampling)] + [(2, 0x11), (3, 0x11)][:len(planes) - 1]
+    huffman = b''.join(bytes([kind]) + bytes(counts) + bytes(symbols) for kind, (counts, symbols)
+                       in ((0x00, _JPEG_DC), (0x10, _JPEG_AC)))
+    return b''.join((b'\xff\xd8',
+                     segment(0xDB, b'\x00' + table[_ZIGZAG].astype(np.uint8).tobytes()),
+                     segment(0xC0, struct.pack('>BHHB', 8, height, width, len(planes))
+                             + b''.join(struct.pack('>BBB', i, j, 0) for i, j in components)),
+                     segment(0xC4, huffman),
+                     segment(0xDA, bytes([len(planes)]) + b''.join(struct.pack('>BB', i, 0) for i, _ in components)
+                             + b'\x00\x3f\x00'),
+                     data, b'\xff\xd9'))
+
+
+def _jpeg_payload(size):
+    """
+    a JPEG stream of about size bytes, pixel data is replaced by a padding segment, EXIF readers don't decode it
+    """
+    data = bytearray(b'\xff\xd8')
+    remaining = max(size - 4, 0)
+    while remaining > 0:
+        chunk = min(remaining, 65533 - 2)
+        data += b'\xff\xfe' + struct.pack('>H', chunk + 2) + bytes(chunk)
+        remaining -= chunk + 4
+    return bytes(data + b'\xff\xd9')
+
+
+def make_jpeg(timestamp='2019:09:27 08:40:00', position=(104.0657, 30.6595, 512.0), maker_note_size=0,
+              thumbnail_size=0, image_size=16 * 1024, make='Flex', model='Travels One', thumbnail=None):
+    """
+    JPEG with an EXIF block
+    @:param position: (longitude, latitude, altitude) or None for a photo without GPS
+    @:param maker_note_size: bytes of MakerNote, 0 for none
+    @:param thumbnail_size: bytes of embedded JPEG thumbnail, 0 for none
+    @:param thumbnail: the embedded JPEG thumbnail, e.g. by encode_jpeg, instead of one of thumbnail_size bytes
+    @:param image_size: bytes of (fake) image data
+    @:return bytes
+    """
+    exif = _Ifd({0x829A: _rational(1 / 500), 0x829D: _rational(4.0), 0x8827: _short(200),
+                 0x9003: _ascii(timestamp), 0x9004: _ascii(timestamp), 0xA002: _long(4000), 0xA003: _long(3000)})
+    if maker_note_size:
+        exif.entries[0x927C] = (_UNDEFINED, maker_note_size, bytes(random.Random(maker_note_size).getrandbits(8)
+                                                                     for _ in range(maker_note_size)))
+    ifd0 = _Ifd({0x010F: _ascii(make), 0x0110: _ascii(model), 0x0132: _ascii(timestamp), 0x8769: exif})
+    ifds = [ifd0, exif]
+    if position is not None:
+        longitude, latitude, altitude = position
+        gps = _Ifd({0x0000: (_BYTE, 4, b'\x02\x03\x00\x00'), 0x0001: _ascii('N' if latitude >= 0 else 'S'),
+                    0x0002: _rational(*_dms(latitude)), 0x0003: _ascii('E' if longitude >= 0 else 'W'),
+                    0x0004: _rational(*_dms(longitude)), 0x0005: (_BYTE, 1, b'\x00'),
+                    0x0006: _rational(abs(altitude))})
+        ifd0.entries[0x8825] = gps
+        ifds.append(gps)
+    if thumbnail is None and thumbnail_size:
+        thumbnail = _jpeg_payload(thumbnail_size)
+    ifd1 = None
+    if thumbnail is not None:
+        ifd1 = _Ifd({0x0103: _short(6), 0x0201: 'thumbnail', 0x0202: _long(len(thumbnail))})
+        ifds.append(ifd1)
+
+    offset = 8
+    for ifd in ifds:
+        ifd.offset = offset
+        offset += ifd.size()
+    pointers = {'thumbnail': offset}
+
+    tiff = bytearray(b'II*\x00' + struct.pack('<I', 8))
+    for ifd in ifds:
+        tiff += ifd.pack(ifd1.offset if ifd is ifd0 and ifd1 is not None else 0, pointers)
+    if thumbnail is not None:
+        tiff += thumbnail
+
+    app1 = b'Exif\x00\x00' + bytes(tiff)
+    if len(app1) + 2 > 0xFFFF:
+        raise ValueError('EXIF block of %s bytes does not fit into one APP1 segment' % len(app1))
+    return b'\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + _jpeg_payload(image_size)[2:]
+
+
+_MP4_EPOCH_OFFSET = 2082844800
+
+
+def _box(box_type, *payload):
+    data = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(data), box_type) + data
+
+
+def _full_box(box_type, version, *payload):
+    return _box(box_type, struct.pack('>I', version << 24), *payload)
+
+
+def _klv(key, value_type, struct_size, data):
+    """
+    GPMF item, nested items have value type 0
+    """
+    repeat = len(data) // struct_size if struct_size else 0
+    return key + struct.pack('>cBH', value_type, struct_size, repeat) + data + b'\x00' * (-len(data) % 4)
+
+
+def _gpmf_sample(start_time, elapsed, points, gps_rate, imu_rate, rng):
+    """
+    one second of GPMF telemetry, a GPS5 stream with fix, time and precision and ACCL/GYRO streams
+    """
+    gpsu = datetime.datetime.fromtimestamp(start_time + elapsed, datetime.timezone.utc) \
+        .strftime('%y%m%d%H%M%S.000').encode('ascii')
+    gps = b''.join(struct.pack('>5i', int(lat * 1e7), int(lng * 1e7), int(alt * 1000), int(speed * 1000),
+                               int(speed * 1000)) for lng, lat, alt, speed in points)
+    gps_stream = _klv(b'STRM', b'\x00', 1, b''.join((
+        _klv(b'STNM', b'c', 1, b'GPS (Lat., Long., Alt., 2D speed, 3D speed)'),
+        _klv(b'GPSF', b'L', 4, struct.pack('>I', 3)),
+        _klv(b'GPSU', b'U', 16, gpsu),
+        _klv(b'GPSP', b'S', 2, struct.pack('>H', 150)),
+        _klv(b'UNIT', b'c', 3, b'degdegm\x00\x00m/sm/s'),
+        _klv(b'SCAL', b'l', 4, struct.pack('>5i', 10000000, 10000000, 1000, 1000, 1000)),
+        _klv(b'GPS5', b'l', 20, gps),
+    )))
+    imu_streams = []
+    for key, name, unit, scale in ((b'ACCL', b'Accelerometer', b'm/s\xb2', 418),
+                                   (b'GYRO', b'Gyroscope', b'rad/s', 939)):
+        rows = b''.join(struct.pack('>3h', *(int(rng.gauss(0, 1) * scale) for _ in range(3)))
+                        for _ in range(imu_rate))
+        imu_streams.append(_klv(b'STRM', b'\x00', 1, b''.join((
+            _klv(b'STNM', b'c', 1, name),
+            _klv(b'SIUN', b'c', len(unit), unit),
+            _klv(b'SCAL', b's', 2, struct.pack('>h', scale)),
+            _klv(key, b's', 6, rows),
+        ))))
+    return _klv(b'DEVC', b'\x00', 1, b''.join([_klv(b'DVID', b'L', 4, struct.pack('>I', 1)),
+                                              _klv(b'DVNM', b'c', 1, b'Camera'), gps_stream] + imu_streams))
+
+
+def _track(track_id, handler, timescale, duration, sample_entry, sample_sizes, chunk_offsets, sample_delta,
+           width=0, height=0):
+    stbl = _box(b'stbl',
+                _full_box(b'stsd', 0, struct.pack('>I', 1), sample_entry),
+                _full_box(b'stts', 0, struct.pack('>III', 1, len(sample_sizes), sample_delta)),
+                _full_box(b'stsc', 0, struct.pack('>IIII', 1, 1, 1, 1)),
+                _full_box(b'stsz', 0, struct.pack('>II', 0, len(sample_sizes)),
+                          struct.pack('>%dI' % len(sample_sizes), *sample_sizes)),
+                _full_box(b'co64', 0, struct.pack('>I', len(chunk_offsets)),
+                          struct.pack('>%dQ' % len(chunk_offsets), *chunk_offsets)))
+    return _box(b'trak',
+                _full_box(b'tkhd', 0, struct.pack('>IIIII', 0, 0, track_id, 0, duration), b'\x00' * 52,
+                          struct.pack('>II', width << 16, height << 16)),
+                _box(b'mdia',
+                     _full_box(b'mdhd', 0, struct.pack('>IIIIHH', 0, 0, timescale, duration * timescale // 1000,
+                                                       0x55c4, 0)),
+                     _full_box(b'hdlr', 0, struct.pack('>I4s12x', 0, handler), b'GoPro ' + handler + b'\x00'),
+                     _box(b'minf', stbl)))
+
+
+def make_mp4(duration=600, gps_rate=18, imu_rate=200, media_size=0, start_time=1569544331,
+             start_position=(104.0657, 30.6595), width=3840, height=2160, seed=0):
+    """
+    GoPro style MP4 of a synthetic ride with a GPMF telemetry track, samples of one second each
+    @:param media_size: bytes of the video media data in mdat, written as a hole so huge files stay cheap
+    @:return list of byte strings and holes (int sizes) to be written in order, see write_mp4
+    """
+    rng = random.Random(seed)
+    longitude, latitude = start_position
+    altitude, heading = 500.0, rng.uniform(0, 2 * math.pi)
+    samples = []
+    for second in range(duration):
+        points = []
+        for _ in range(gps_rate):
+            speed = max(0.0, 7.0 + rng.gauss(0, 0.3))
+            heading += rng.gauss(0, 0.01)
+            step = speed / gps_rate
+            latitude += step * math.cos(heading) / 111320
+            longitude += step * math.sin(heading) / (111320 * math.cos(math.radians(latitude)))
+            altitude += rng.gauss(0, 0.05)
+            points.append((longitude, latitude, altitude, speed))
+        samples.append(_gpmf_sample(start_time, second, points, gps_rate, imu_rate, rng))
+
+    ftyp = _box(b'ftyp', b'mp41', struct.pack('>I', 0), b'mp41isom')
+    mdat_header = struct.pack('>I4sQ', 1, b'mdat', 16 + media_size + sum(len(i) for i in samples))
+    telemetry_start = len(ftyp) + len(mdat_header) + media_size
+    offsets = [telemetry_start + sum(len(i) for i in samples[:k]) for k in range(len(samples))]
+
+    creation = start_time + _MP4_EPOCH_OFFSET
+    video_entry = _box(b'avc1', b'\x00' * 6, struct.pack('>H', 1), b'\x00' * 16, struct.pack('>HH', width, height),
+                       b'\x00' * 50)
+    video_sizes = [media_size // duration] * duration if media_size else []
+    video_offsets = [len(ftyp) + len(mdat_header) + i * (media_size // duration) for i in range(len(video_sizes))]
+    moov = _box(b'moov',
+                _full_box(b'mvhd', 0, struct.pack('>IIII', creation, creation, 1000, duration * 1000), b'\x00' * 80),
+                _track(1, b'vide', 1000, duration * 1000, video_entry, video_sizes, video_offsets, 1000, width, height),
+                _track(2, b'meta', 1000, duration * 1000, _box(b'gpmd', b'\x00' * 6, struct.pack('>H', 1)),
+                       [len(i) for i in samples], offsets, 1000))
+    return [ftyp, mdat_header, media_size] + samples + [moov]
+
+
+def write_mp4(path, parts):
+    with open(path, 'wb') as file:
+        for part in parts:
+            if isinstance(part, int):
+                file.seek(part, os.SEEK_CUR)
+            else:
+                file.write(part)
+        file.truncate()
+
+
+def write_fixtures(directory, fit_duration=3600, fit_sampling_rate=1.0, fit_files=1, photos=20, videos=1,
+                   video_duration=600, video_media_size=4 * 1024 ** 3):
+    """
+    write a fixture set into directory
+    @:return {'fit': [paths], 'photo': [paths], 'video': [paths]}
+    """
+    os.makedirs(directory, exist_ok=True)
+    ret = {'fit': [], 'photo': [], 'video': []}
+    for i in range(fit_files):
+        path = os.path.join(directory, 'ride_%s.fit' % i)
+        with open(path, 'wb') as file:
+            file.write(make_fit(fit_duration, fit_sampling_rate, seed=i))
+        ret['fit'].append(path)
+
+    variants = [{'maker_note_size': 0, 'thumbnail_size': 0},
+                {'maker_note_size': 4096, 'thumbnail_size': 0},
+                {'maker_note_size': 0, 'thumbnail_size': 8 * 1024},
+                {'maker_note_size': 4096, 'thumbnail_size': 8 * 1024, 'position': None}]
+    for i in range(photos):
+        variant = dict(variants[i % len(variants)])
+        path = os.path.join(directory, 'photo_%s.jpg' % i)
+        with open(path, 'wb') as file:
+            file.write(make_jpeg(timestamp='2019:09:27 08:%02d:%02d' % (40 + i // 60 % 20, i % 60), **variant))
+        ret['photo'].append(path)
+
+    for i in range(videos):
+        path = os.path.join(directory, 'video_%s.mp4' % i)
+        write_mp4(path, make_mp4(video_duration, media_size=video_media_size, seed=i))
+        ret['video'].append(path)
+    return ret
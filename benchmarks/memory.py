@@ -0,0 +1,178 @@
+"""
+in memory DB for the benchmarks and the tests, encoding and bookkeeping are the same as against Mongo
+"""
+import copy
+
+
+def _get(document, path):
+    for part in path.split('.'):
+        if not isinstance(document, dict) or part not in document:
+            return False, None
+        document = document[part]
+    return True, document
+
+
+def _set(document, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset(document, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.get(part, {})
+    document.pop(parts[-1], None)
+
+
+def _match(document, filter_data):
+    for key, condition in (filter_data or {}).items():
+        found, value = _get(document, key)
+        if isinstance(condition, dict) and any(i.startswith('$') for i in condition):
+            for operator, operand in condition.items():
+                if operator == '$exists' and found != operand:
+                    return False
+                if operator == '$gte' and not (found and value >= operand):
+                    return False
+                if operator == '$lte' and not (found and value <= operand):
+                    return False
+                if operator == '$ne' and found and value == operand:
+                    return False
+                if operator not in ('$exists', '$gte', '$lte', '$ne'):
+                    raise NotImplementedError('%s filters are not supported' % operator)
+        elif not found or value != condition:
+            return False
+    return True
+
+
+class _Result:
+    def __init__(self, modified_count=0, upserted_id=None):
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class _InsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class _Cursor(list):
+    def batch_size(self, size):
+        return self
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, limit):
+        return self
+
+    def close(self):
+        pass
+
+
+class MemoryCollection:
+    """
+    in-process stand-in for a pymongo collection, keeps the stored documents in a list. supports the queries
+    and updates the DB class is used with: equality, $exists, $gte, $lte and $ne filters, $set, $inc, $unset, $push,
+    $addToSet and $setOnInsert updates, upserts and unique indexes
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.unique = set()
+        self._next_id = 0
+
+    def create_index(self, field, unique=False):
+        if unique:
+            self.unique.add(field)
+
+    def drop(self):
+        self.documents = []
+
+    def _check_unique(self, document):
+        from pymongo.errors import DuplicateKeyError
+
+        for field in self.unique:
+            if any(_get(i, field) == _get(document, field) for i in self.documents if i is not document):
+                raise DuplicateKeyError('E11000 duplicate key %s' % field)
+
+    def _insert(self, document):
+        self._check_unique(document)
+        self._next_id += 1
+        document.setdefault('_id', self._next_id)
+        self.documents.append(document)
+
+    def insert_one(self, document):
+        # DB.insert passes a fresh copy already
+        self._insert(document)
+        return _InsertResult(document['_id'])
+
+    def _apply(self, document, update, inserted):
+        for key, value in update.get('$set', {}).items():
+            _set(document, key, value)
+        for key, value in update.get('$inc', {}).items():
+            found, current = _get(document, key)
+            _set(document, key, current + value if found else value)
+        for key in update.get('$unset', {}):
+            _unset(document, key)
+        for key, value in update.get('$push', {}).items():
+            found, current = _get(document, key)
+            items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+            _set(document, key, (current if found else []) + list(items))
+        for key, value in update.get('$addToSet', {}).items():
+            found, current = _get(document, key)
+            current = list(current) if found else []
+            for item in value['$each'] if isinstance(value, dict) and '$each' in value else [value]:
+                if item not in current:
+                    current.append(item)
+            _set(document, key, current)
+        if inserted:
+            for key, value in update.get('$setOnInsert', {}).items():
+                _set(document, key, value)
+
+    def update_one(self, filter_data, update, upsert=False):
+        for document in self.documents:
+            if _match(document, filter_data):
+                self._apply(document, update, False)
+                self._check_unique(document)
+                return _Result(1)
+        if not upsert:
+            return _Result()
+        document = {k: v for k, v in filter_data.items() if not isinstance(v, dict)}
+        self._apply(document, update, True)
+        self._insert(document)
+        return _Result(0, document['_id'])
+
+    def find_one_and_update(self, filter_data, update, projection=None, upsert=False, return_document=None):
+        self.update_one(filter_data, update, upsert)
+        return self.find_one(filter_data)
+
+    def find_one(self, filter_data=None):
+        for document in self.documents:
+            if _match(document, filter_data):
+                return copy.deepcopy(document)
+        return None
+
+    def find(self, filter_data=None, projection=None):
+        return _Cursor(copy.deepcopy(i) for i in self.documents if _match(i, filter_data))
+
+
+class MemoryDatabase(dict):
+    def __missing__(self, key):
+        self[key] = MemoryCollection()
+        return self[key]
+
+
+def memory_db():
+    """
+    a DB whose collections live in memory. it replaces the default DB, so the registries, rollups and photo
+    hashes are written there as well
+    """
+    from app.utils.mongodb import DB, mongodb
+
+    db = DB.__new__(DB)
+    db.client = None
+    db.db = MemoryDatabase()
+    mongodb.use(db)
+    return db
@@ -0,0 +1,230 @@
+"""
+run the benchmark suite
+
+    python -m benchmarks.run --duration 3600 --rate 1 --photos 40 --output bench.json
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --fail-on-regression
+
+every stage runs in a fresh process, so peak RSS and allocations are those of the stage alone,
+the cold start of a parse worker is measured as well, see benchmarks.startup
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fixtures import write_fixtures
+from benchmarks.memory import memory_db
+from benchmarks.stages import STAGES
+from benchmarks.startup import DEFAULT_BUDGET as DEFAULT_STARTUP_BUDGET, measure_startup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 0.1
+
+
+def _configure_sandbox(work_dir):
+    """
+    keep everything a stage persists inside the benchmark work directory, and the DB writes in memory
+    """
+    from app import settings
+
+    settings.SPATIAL_INDEX['PATH'] = os.path.join(work_dir, 'spatial_index.pkl')
+    settings.FIT_INCREMENTAL['CHECKPOINT_ROOT'] = os.path.join(work_dir, 'fit_checkpoints')
+    settings.HEATMAP['PATH'] = os.path.join(work_dir, 'heatmap')
+    # parse results, registries, rollups and photo hashes
+    memory_db()
+
+
+def measure_stage(stage_cls, fixtures, repeat, work_dir):
+    """
+    run one stage in the current process
+    :return: result dict of the stage
+    """
+    _configure_sandbox(work_dir)
+    stage = stage_cls(fixtures)
+    result = {'unit': stage.unit}
+    try:
+        stage.setup()
+        setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        timings = []
+        units = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            units = stage.run()
+            timings.append(time.perf_counter() - start)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # allocations are traced in a separate run, tracing slows the stage down too much to time it
+        tracemalloc.start()
+        stage.run()
+        alloc_current, alloc_peak = tracemalloc.get_traced_memory()
+        alloc_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.stop()
+    except Exception as err:
+        logger.debug('stage %s failed' % stage.name, exc_info=True)
+        result.update({'status': 'error', 'error': '%s: %s' % (type(err).__name__, err)})
+        return result
+
+    best = min(timings)
+    result.update({'status': 'ok',
+                   'units': units,
+                   'seconds_best': best,
+                   'seconds_mean': sum(timings) / len(timings),
+                   'throughput': units / best if best > 0 else None,
+                   'peak_rss_kb': peak_rss,
+                   'stage_rss_kb': max(peak_rss - setup_rss, 0),
+                   'alloc_peak_bytes': alloc_peak,
+                   'alloc_retained_bytes': alloc_current,
+                   'alloc_retained_blocks': alloc_blocks,
+                   })
+    return result
+
+
+def _measure_in_child(queue, stage_name, fixtures, repeat, work_dir):
+    stage_cls = next(cls for cls in STAGES if cls.name == stage_name)
+    queue.put(measure_stage(stage_cls, fixtures, repeat, work_dir))
+
+
+def run_suite(stages, fixtures, repeat, work_dir, isolate=True):
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for stage_cls in stages:
+        if not isolate:
+            results[stage_cls.name] = measure_stage(stage_cls, fixtures, repeat, work_dir)
+            continue
+        queue = context.Queue()
+        process = context.Process(target=_measure_in_child, args=(queue, stage_cls.name, fixtures, repeat, work_dir))
+        process.start()
+        try:
+            results[stage_cls.name] = queue.get()
+        finally:
+            process.join()
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    compare stage results with a baseline
+    :return: list of (stage, metric, baseline value, current value, change) of the regressions
+    """
+    regressions = []
+    for name, current in results['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if not previous or previous.get('status') != 'ok' or current.get('status') != 'ok':
+            continue
+        # (metric, higher is better)
+        for metric, higher_is_better in (('throughput', True), ('peak_rss_kb', False), ('alloc_peak_bytes', False)):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append((name, metric, old, new, change))
+
+    previous, current = baseline.get('startup'), results.get('startup')
+    if previous and current and previous.get('status') == 'ok' and current.get('status') == 'ok':
+        old, new = previous['seconds_best'], current['seconds_best']
+        if old and (new - old) / old > tolerance:
+            regressions.append(('startup', 'seconds_best', old, new, (new - old) / old))
+    return regressions
+
+
+def _print_results(results, regressions):
+    print('%-18s %-8s %14s %12s %12s %14s' % ('stage', 'status', 'throughput', 'best (s)', 'rss (KB)', 'alloc peak'))
+    for name, result in results['stages'].items():
+        if result['status'] != 'ok':
+            print('%-18s %-8s %s' % (name, result['status'], result.get('error')))
+            continue
+        print('%-18s %-8s %10.1f %-3s %12.4f %12d %14d' % (
+            name, 'ok', result['throughput'] or 0, result['unit'][:3], result['seconds_best'], result['peak_rss_kb'],
+            result['alloc_peak_bytes']))
+    startup = results.get('startup')
+    if startup:
+        if startup['status'] == 'ok':
+            print('%-18s %-8s %14s %12.4f' % ('startup', 'ok', '', startup['seconds_best']))
+        else:
+            print('%-18s %-8s %s' % ('startup', startup['status'], startup.get('error')))
+    for name, metric, old, new, change in regressions:
+        print('REGRESSION %s %s: %s -> %s (%+.1f%%)' % (name, metric, old, new, change * 100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='flex travels parser benchmarks')
+    parser.add_argument('--duration', type=int, default=3600, help='seconds of every synthetic FIT ride')
+    parser.add_argument('--rate', type=float, default=1.0, help='FIT records per second')
+    parser.add_argument('--fit-files', type=int, default=1)
+    parser.add_argument('--photos', type=int, default=40)
+    parser.add_argument('--videos', type=int, default=1)
+    parser.add_argument('--video-duration', type=int, default=600, help='seconds of every synthetic video')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', help='comma separated stage names or prefixes, e.g. fit,photo.decode')
+    parser.add_argument('--no-isolate', action='store_true', help='run all stages in this process')
+    parser.add_argument('--output', help='write results as JSON to this file, - for stdout')
+    parser.add_argument('--baseline', help='compare with this result file')
+    parser.add_argument('--save-baseline', help='write results as a new baseline to this file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--startup-budget', type=float, default=DEFAULT_STARTUP_BUDGET,
+                        help='in second, a slower parse worker cold start counts as a regression')
+    parser.add_argument('--no-startup', action='store_true', help="don't measure the parse worker cold start")
+    args = parser.parse_args(argv)
+
+    stages = STAGES
+    if args.stages:
+        wanted = [i.strip() for i in args.stages.split(',') if i.strip()]
+        stages = [cls for cls in STAGES if any(cls.name == w or cls.name.startswith(w + '.') for w in wanted)]
+
+    with tempfile.TemporaryDirectory(prefix='pcc-bench-') as work_dir:
+        fixtures = write_fixtures(os.path.join(work_dir, 'fixtures'), args.duration, args.rate, args.fit_files,
+                                  args.photos, args.videos, args.video_duration)
+        results = {'meta': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'time': int(time.time()),
+                            'params': {'duration': args.duration, 'rate': args.rate, 'fit_files': args.fit_files,
+                                       'photos': args.photos, 'videos': args.videos,
+                                       'video_duration': args.video_duration, 'repeat': args.repeat}},
+                   'stages': run_suite(stages, fixtures, args.repeat, work_dir, isolate=not args.no_isolate)}
+    if not args.no_startup:
+        results['startup'] = measure_startup(repeat=args.repeat)
+
+    regressions = []
+    startup = results.get('startup')
+    if startup and startup['status'] == 'ok' and startup['seconds_best'] > args.startup_budget:
+        regressions.append(('startup', 'budget', args.startup_budget, startup['seconds_best'],
+                            (startup['seconds_best'] - args.startup_budget) / args.startup_budget))
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('meta', {}).get('params') != results['meta']['params']:
+            logger.warning('baseline was recorded with other parameters: %s' % baseline.get('meta', {}).get('params'))
+        regressions += compare(results, baseline, args.tolerance)
+    if regressions:
+        results['regressions'] = [dict(zip(('stage', 'metric', 'baseline', 'current', 'change'), i))
+                                  for i in regressions]
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        _print_results(results, regressions)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+benchmark stages, each stage prepares its input in setup() outside of the measurement and processes it in run()
+"""
+import json
+
+from benchmarks.memory import memory_db
+
+
+class Stage:
+    name = None
+    unit = None
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+
+    def setup(self):
+        pass
+
+    def run(self):
+        """
+        :return: number of units processed
+        """
+        raise NotImplementedError
+
+
+class FitDecode(Stage):
+    name = 'fit.decode'
+    unit = 'messages'
+
+    def run(self):
+        import fitparse
+
+        count = 0
+        for path in self.fixtures['fit']:
+            for message in fitparse.FitFile(path).get_messages():
+                message.get_values()
+                count += 1
+        return count
+
+
+class FitParse(Stage):
+    name = 'fit.parse'
+    unit = 'records'
+
+    def run(self):
+        from app.parse.parsers import FitParser
+
+        count = 0
+        for path in self.fixtures['fit']:
+            count += len(FitParser(path).parse()['activity_records'])
+        return count
+
+
+class FitClean(Stage):
+    name = 'fit.clean'
+    unit = 'records'
+
+    def setup(self):
+        import fitparse
+
+        self.records = [message.get_values() for path in self.fixtures['fit']
+                        for message in fitparse.FitFile(path).get_messages('record')]
+
+    def run(self):
+        from app.data.geographic.models import Coordinate
+        from app.data.models import Physiologic, Environment
+
+        for values in self.records:
+            coordinate = Coordinate({'latitude': values.get('position_lat'), 'longitude': values.get('position_long'),
+                                     'altitude': values.get('enhanced_altitude'), 'datum': 'WGS84'})
+            physiologic = Physiologic({'speed': values.get('enhanced_speed')})
+            environment = Environment({'temperature': values.get('temperature')})
+            for model in (coordinate, physiologic, environment):
+                model.set_time(values.get('timestamp'), 'UTC')
+                model.is_valid()
+        return len(self.records)
+
+
+class FitSerialize(Stage):
+    name = 'fit.serialize'
+    unit = 'records'
+
+    def setup(self):
+        from app.parse.parsers import FitParser
+
+        self.results = [FitParser(path).parse() for path in self.fixtures['fit']]
+
+    def run(self):
+        from app.utils.mongodb import JSONEncoder
+
+        for result in self.results:
+            json.loads(JSONEncoder().encode(result))
+        return sum(len(result['activity_records']) for result in self.results)
+
+
+class FitSave(FitSerialize):
+    name = 'fit.save'
+    unit = 'files'
+
+    def setup(self):
+        from app.parse.parsers import FitParser
+
+        memory_db()
+        self.parsers = [FitParser(path) for path in self.fixtures['fit']]
+        for parser in self.parsers:
+            parser.parse()
+
+    def run(self):
+        for parser in self.parsers:
+            parser.save({})
+        return len(self.parsers)
+
+
+class PhotoDecode(Stage):
+    name = 'photo.decode'
+    unit = 'files'
+
+    def run(self):
+        import exifread
+
+        for path in self.fixtures['photo']:
+            with open(path, 'rb') as file:
+                exifread.process_file(file)
+        return len(self.fixtures['photo'])
+
+
+class PhotoParse(Stage):
+    name = 'photo.parse'
+    unit = 'files'
+
+    def run(self):
+        from app.parse.parsers import PhotoParser
+
+        for path in self.fixtures['photo']:
+            PhotoParser(path).parse()
+        return len(self.fixtures['photo'])
+
+
+class PhotoSerialize(Stage):
+    name = 'photo.serialize'
+    unit = 'files'
+
+    def setup(self):
+        from app.parse.parsers import PhotoParser
+
+        self.results = [PhotoParser(path).parse() for path in self.fixtures['photo']]
+
+    def run(self):
+        from app.utils.mongodb import JSONEncoder
+
+        for result in self.results:
+            json.loads(JSONEncoder().encode(result))
+        return len(self.results)
+
+
+class PhotoSave(Stage):
+    name = 'photo.save'
+    unit = 'files'
+
+    def setup(self):
+        from app.parse.parsers import PhotoParser
+
+        memory_db()
+        self.parsers = [PhotoParser(path) for path in self.fixtures['photo']]
+        for parser in self.parsers:
+            parser.parse()
+
+    def run(self):
+        for parser in self.parsers:
+            parser.save({})
+        return len(self.parsers)
+
+
+class VideoDecode(Stage):
+    name = 'video.decode'
+    unit = 'files'
+
+    def run(self):
+        from app.parse import video
+        from app.parse.source import ParseSource
+        from app.settings import VIDEO
+
+        for path in self.fixtures['video']:
+            with ParseSource(path).buffer() as buf:
+                metadata, telemetry = video.parse_movie(buf)
+                video.read_telemetry(buf, telemetry, VIDEO['GPS_STREAMS'] + VIDEO['IMU_STREAMS'],
+                                     metadata['creation_time'])
+        return len(self.fixtures['video'])
+
+
+class VideoParse(Stage):
+    name = 'video.parse'
+    unit = 'files'
+
+    def run(self):
+        from app.parse.parsers import VideoParser
+
+        for path in self.fixtures['video']:
+            VideoParser(path).parse()
+        return len(self.fixtures['video'])
+
+
+STAGES = [FitDecode, FitParse, FitClean, FitSerialize, FitSave, PhotoDecode, PhotoParse, PhotoSerialize, PhotoSave,
+          VideoDecode, VideoParse]
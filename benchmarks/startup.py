@@ -0,0 +1,89 @@
+"""
+cold start time of a parse worker
+
+    python -m benchmarks.startup --budget 0.2
+    python -m benchmarks.startup --module app.parse.parsers --module app.parse.geotag --top 20
+
+every measurement spawns a fresh interpreter, the import time breakdown comes from `python -X importtime`
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ('app.parse.parsers',)
+DEFAULT_BUDGET = 0.2  # in second, interpreter start included
+
+
+def _parse_importtime(stderr):
+    """
+    :return: list of (module, self us, cumulative us) in import order
+    """
+    ret = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        ret.append((module.strip(), int(self_us), int(cumulative_us)))
+    return ret
+
+
+def measure_startup(modules=DEFAULT_MODULES, repeat=5, top=10, python=sys.executable):
+    """
+    time `python -c "import <modules>"` in fresh processes
+    :return: result dict with the best wall time and the slowest imports of the last run
+    """
+    code = '; '.join('import %s' % module for module in modules)
+    timings = []
+    process = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run([python, '-c', code], capture_output=True, text=True)
+        timings.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()
+            return {'status': 'error', 'modules': list(modules), 'error': error[-1] if error else process.returncode}
+
+    process = subprocess.run([python, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    imports = _parse_importtime(process.stderr)
+    roots = {module.split('.')[0] for module in modules}
+    return {'status': 'ok',
+            'modules': list(modules),
+            'seconds_best': min(timings),
+            'seconds_mean': sum(timings) / len(timings),
+            'import_seconds': sum(cumulative for module, _, cumulative in imports
+                                  if module.split('.')[0] in roots and '.' not in module) / 1e6,
+            'imported_modules': len(imports),
+            'slowest': [{'module': module, 'self_us': self_us, 'cumulative_us': cumulative_us}
+                        for module, self_us, cumulative_us in sorted(imports, key=lambda i: -i[1])[:top]],
+            }
+
+
+def _print_result(result, budget):
+    if result['status'] != 'ok':
+        print('startup of %s failed: %s' % (', '.join(result['modules']), result['error']))
+        return
+    print('startup of %s: best %.1f ms, mean %.1f ms, app imports %.1f ms, %d modules, budget %.0f ms' % (
+        ', '.join(result['modules']), result['seconds_best'] * 1000, result['seconds_mean'] * 1000,
+        result['import_seconds'] * 1000, result['imported_modules'], budget * 1000))
+    for item in result['slowest']:
+        print('  %-48s %10d us self %10d us cumulative' % (item['module'], item['self_us'], item['cumulative_us']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='parse worker cold start time')
+    parser.add_argument('--module', action='append', help='module imported by the worker, repeatable')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports listed')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='in second')
+    args = parser.parse_args(argv)
+
+    result = measure_startup(args.module or DEFAULT_MODULES, args.repeat, args.top)
+    _print_result(result, args.budget)
+    if result['status'] != 'ok':
+        return 2
+    return 1 if result['seconds_best'] > args.budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
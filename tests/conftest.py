@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks.memory import memory_db as _memory_db
+
+
+@pytest.fixture
+def memory_db():
+    """
+    a DB over in memory collections, the default DB while the test runs
+    """
+    from app.utils.mongodb import mongodb
+
+    default = mongodb._db
+    yield _memory_db()
+    mongodb.use(default)
@@ -0,0 +1,54 @@
+import json
+import subprocess
+import sys
+
+from app.parse.parsers import FitParser
+from benchmarks.fixtures import make_fit
+from benchmarks.memory import MemoryCollection
+from benchmarks.run import compare
+
+
+def test_fit_fixture():
+    result = FitParser(make_fit(duration=120, sampling_rate=2, seed=1)).parse()
+    assert len(result['activity_records']) == 240
+    assert len(result['gear']) == 4
+    assert make_fit(duration=120, seed=1) == make_fit(duration=120, seed=1)
+
+
+def test_memory_collection_has_the_pymongo_api(memory_db):
+    from pymongo.collection import Collection
+
+    methods = [name for name in vars(MemoryCollection) if not name.startswith('_')]
+    assert 'insert' not in methods
+    assert all(callable(getattr(Collection, name, None)) for name in methods)
+    parse_id = memory_db.insert(memory_db.Collections.MEDIA_PARSED_DATA, {'path': 'rides/a.fit'})
+    assert memory_db.find_one(memory_db.Collections.MEDIA_PARSED_DATA, {'_db_pyr_guid': parse_id})['path'] == \
+        'rides/a.fit'
+
+
+def test_compare():
+    baseline = {'stages': {'fit.parse': {'status': 'ok', 'throughput': 1000, 'peak_rss_kb': 100,
+                                         'alloc_peak_bytes': 1000}},
+                'startup': {'status': 'ok', 'seconds_best': 0.1}}
+    results = {'stages': {'fit.parse': {'status': 'ok', 'throughput': 850, 'peak_rss_kb': 105,
+                                        'alloc_peak_bytes': 2000}},
+               'startup': {'status': 'ok', 'seconds_best': 0.105}}
+    assert [i[:2] for i in compare(results, baseline)] == [('fit.parse', 'throughput'),
+                                                          ('fit.parse', 'alloc_peak_bytes')]
+    results['stages']['fit.parse']['status'] = 'error'
+    assert [i[:4] for i in compare(results, baseline, tolerance=0.01)] == [('startup', 'seconds_best', 0.1, 0.105)]
+
+
+def test_suite_runs_in_a_sandbox(tmp_path):
+    """
+    the stages run in their own processes and persist nothing outside their work directory
+    """
+    process = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--duration', '60', '--photos', '2',
+                              '--video-duration', '5', '--repeat', '1', '--no-startup', '--output', '-'],
+                             capture_output=True, text=True, env={'HOME': str(tmp_path)}, check=True)
+    stages = json.loads(process.stdout)['stages']
+    assert {name: result['status'] for name, result in stages.items()} == dict.fromkeys(
+        ('fit.decode', 'fit.parse', 'fit.clean', 'fit.serialize', 'fit.save', 'photo.decode', 'photo.parse',
+         'photo.serialize', 'photo.save', 'video.decode', 'video.parse'), 'ok')
+    assert stages['fit.parse']['units'] == 60 and stages['photo.save']['units'] == 2
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,59 @@
+import pytest
+
+from app.parse.budget import BudgetExceededError, ParseBudget, profiling
+from app.parse.parsers import FitParser
+from benchmarks.fixtures import make_fit
+
+
+@pytest.fixture(scope='module')
+def fit():
+    return make_fit(duration=600)
+
+
+def test_budget_limits():
+    budget = ParseBudget(max_messages=2, max_points=None, max_bytes=10, timeout=None)
+    with pytest.raises(BudgetExceededError) as err:
+        budget.start('ride.fit', 11)
+    assert (err.value.limit, err.value.value, err.value.maximum) == ('bytes', 11, 10)
+    budget.start('ride.fit', 10)
+    budget.message()
+    budget.message()
+    budget.point(1000)
+    with pytest.raises(BudgetExceededError, match='ride.fit exceeds the messages budget: 3 > 2'):
+        budget.message()
+
+
+def test_timeout():
+    budget = ParseBudget(timeout=1e-9)
+    budget.start('ride.fit', 0)
+    with pytest.raises(BudgetExceededError) as err:
+        budget.check_time()
+    assert err.value.limit == 'timeout'
+
+
+@pytest.mark.parametrize('limits, limit', [({'max_messages': 100}, 'messages'), ({'max_points': 100}, 'points'),
+                                           ({'max_bytes': 100}, 'bytes')])
+def test_parse_over_budget(fit, limits, limit):
+    parser = FitParser(fit, budget=ParseBudget(**limits))
+    with pytest.raises(FitParser.FileParsingError) as err:
+        parser.parse()
+    assert isinstance(err.value.__cause__, BudgetExceededError) and err.value.__cause__.limit == limit
+
+
+def test_profile(fit):
+    parser = FitParser(fit, profile=True)
+    result = parser.parse()
+    assert result['activity_records']
+    assert parser.profile['peak_bytes'] > 0 and parser.profile['top']
+    parser = FitParser(fit, profile=False)
+    parser.parse()
+    assert parser.profile is None
+
+
+def test_profiling_nested():
+    with profiling() as outer:
+        with profiling(top=1) as inner:
+            data = [bytearray(1024) for _ in range(100)]
+    assert inner['retained_bytes'] >= 100 * 1024 and len(inner['top']) == 1
+    assert outer['retained_bytes'] >= 100 * 1024
+    del data
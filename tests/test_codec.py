@@ -0,0 +1,61 @@
+import numpy as np
+
+from app.data.codec import decode_track, encode_track, find_chunks, iter_track, track_length, varint_decode, \
+    varint_encode
+from app.settings import TRACK_CODEC
+
+
+def _records(count, start=1569544331.0, step=1 / 18):
+    return [{'coordinate': {'timestamp': start + i * step, 'longitude': 104.0657 + i * 1e-5,
+                            'latitude': 30.6595 - i * 1e-5, 'altitude': 500.25, 'datum': 'WGS84', 'time': None},
+             'physiologic': {'timestamp': start + i * step, 'speed': 25.125, 'heart_rate': 120 + i % 7},
+             'environment': None if i % 3 else {'temperature': 18.5}}
+            for i in range(count)]
+
+
+def _close(a, b):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_close(a[k], b[k]) for k in a)
+    if isinstance(a, float):
+        # timestamps are kept to the ms
+        return abs(a - b) <= 5e-4
+    return a == b
+
+
+def test_varint_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 2 ** 40, 2 ** 63], dtype=np.uint64)
+    assert varint_decode(varint_encode(values), values.size).tolist() == values.tolist()
+
+
+def test_round_trip():
+    records = _records(2500)
+    encoded = encode_track(records, chunk_size=1000)
+    assert len(encoded['chunks']) == 3 and track_length(encoded) == 2500
+    decoded = decode_track(encoded)
+    assert len(decoded) == len(records)
+    assert all(_close(a, b) for a, b in zip(records, decoded))
+    assert list(iter_track(encoded)) == decoded
+    assert find_chunks(encoded, records[1500]['coordinate']['timestamp']) == [1, 2]
+
+
+def test_sub_second_timestamps():
+    records = _records(18)
+    timestamps = [i['coordinate']['timestamp'] for i in decode_track(encode_track(records))]
+    assert len(set(timestamps)) == 18
+    assert all(abs(a['coordinate']['timestamp'] - b) < 1e-3 for a, b in zip(records, timestamps))
+
+
+def test_whole_numbers_stay_integers():
+    records = [{'coordinate': {'timestamp': 1569544331 + i, 'longitude': 104.0, 'latitude': 30.0}}
+               for i in range(10)]
+    decoded = decode_track(encode_track(records))
+    assert [i['coordinate']['timestamp'] for i in decoded] == list(range(1569544331, 1569544341))
+    assert isinstance(decoded[0]['coordinate']['timestamp'], int)
+
+
+def test_decoded_with_stored_scales(monkeypatch):
+    records = _records(100)
+    encoded = encode_track(records)
+    monkeypatch.setitem(TRACK_CODEC, 'SCALES', dict(TRACK_CODEC['SCALES'], longitude=10, timestamp=1))
+    assert all(_close(a, b) for a, b in zip(records, decode_track(encoded)))
+
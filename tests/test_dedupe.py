@@ -0,0 +1,114 @@
+import io
+import random
+
+import numpy as np
+import pytest
+
+from app.data import dedupe
+from app.data.dedupe import MultiIndexHash, PhotoIndex, content_hash, hamming
+from app.parse.parsers import PhotoParser
+from app.settings import HEATMAP, ROLLUP, SPATIAL_INDEX
+from benchmarks.fixtures import encode_jpeg, make_jpeg
+
+
+@pytest.fixture
+def photo_index(memory_db, monkeypatch):
+    for settings in (SPATIAL_INDEX, HEATMAP, ROLLUP):
+        monkeypatch.setitem(settings, 'ENABLED', False)
+    monkeypatch.setattr(dedupe, '_photo_index', None)
+    return memory_db
+
+
+def _flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_content_hash():
+    data = bytes(range(256)) * 100
+    assert content_hash(io.BytesIO(data), block=1000) == content_hash(io.BytesIO(data))
+    assert content_hash(io.BytesIO(data)) != content_hash(io.BytesIO(data[:-1]))
+
+
+def _picture(seed, height=120, width=160):
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    ret = np.dstack([x * 1.5, y * 2.0, 128 + 100 * np.sin(x / 9) * np.cos(y / 7)])
+    for _ in range(4):
+        top, left = rng.randint(0, height - 30), rng.randint(0, width - 40)
+        ret[top:top + 30, left:left + 40] = rng.randint(0, 256, 3)
+    return ret
+
+
+def test_perceptual_hash():
+    picture = _picture(1)
+    phash = dedupe.perceptual_hash(encode_jpeg(picture, quality=90))
+    assert phash is not None
+    assert hamming(phash, dedupe.perceptual_hash(encode_jpeg(picture, quality=40))) <= 2
+    # a gray copy hashes like the color picture
+    gray = picture @ [0.299, 0.587, 0.114]
+    assert hamming(phash, dedupe.perceptual_hash(encode_jpeg(gray))) <= 2
+    assert hamming(phash, dedupe.perceptual_hash(encode_jpeg(_picture(2)))) > 6
+    assert dedupe.perceptual_hash(b'\xff\xd8\xff\xd9') is None
+
+
+def test_multi_index_search_matches_linear_scan():
+    rng = random.Random(7)
+    table = MultiIndexHash(bits=64, radius=6)
+    values = [rng.getrandbits(64) for _ in range(200)]
+    query = values[0]
+    values += [_flip(query, rng.sample(range(64), distance)) for distance in range(1, 10)]
+    for i, value in enumerate(values):
+        table.add(value, i)
+    assert len(table) == len(values)
+    found = table.search(query)
+    expected = sorted(hamming(query, value) for value in values if hamming(query, value) <= 6)
+    assert [distance for distance, _, _ in found] == expected
+    assert found[0] == (0, query, [0])
+    assert len(table.search(query, radius=9)) == 10
+
+
+def test_photo_index_syncs_other_processes(photo_index):
+    index, other = PhotoIndex(photo_index), PhotoIndex(photo_index)
+    index.add('a', 'sha-a', 0xff00)
+    assert other.find('sha-a') == {'parse_id': 'a', 'exact': True, 'distance': 0}
+    assert other.find('sha-b', _flip(0xff00, (1, 20))) == {'parse_id': 'a', 'exact': False, 'distance': 2}
+    assert other.find('sha-b', _flip(0xff00, range(8))) is None
+    assert other.find('sha-b') is None
+
+
+def _parser(sha1, phash):
+    parser = PhotoParser(b'\xff\xd8\xff\xd9')
+    parser._result = {'image': {}, 'gps': {}, 'thumbnail': {'base64': 'AAAA'},
+                      'hash': {'sha1': sha1, 'phash': '%x' % phash}}
+    return parser
+
+
+def test_save_links_duplicates(photo_index):
+    collection = photo_index.Collections.MEDIA_PARSED_DATA
+    original = _parser('sha-a', 0xff00).save()
+    exact = photo_index.find_one(collection, {'_db_pyr_guid': _parser('sha-a', 0xff00).save()})
+    assert exact['duplicate_of'] == original
+    assert 'thumbnail' not in exact['data']
+
+    near = photo_index.find_one(collection, {'_db_pyr_guid': _parser('sha-b', 0xff01).save()})
+    assert near['similar_to'] == {'parse_id': original, 'distance': 1}
+    assert near['data']['thumbnail'] == {}
+
+    other = photo_index.find_one(collection, {'_db_pyr_guid': _parser('sha-c', 0xffff00ff00).save()})
+    assert 'similar_to' not in other and other['data']['thumbnail'] == {'base64': 'AAAA'}
+    # the exact duplicate is not in the index, the near one is
+    assert len(list(photo_index.iterate(photo_index.Collections.PHOTO_HASH))) == 3
+
+
+def test_reencoded_photos_are_near_duplicates(photo_index):
+    collection = photo_index.Collections.MEDIA_PARSED_DATA
+    parse_ids = []
+    for quality in (90, 50):
+        parser = PhotoParser(make_jpeg(thumbnail=encode_jpeg(_picture(1), quality=quality)))
+        assert parser.parse()['hash']['phash'] is not None
+        parse_ids.append(parser.save())
+    original, near = (photo_index.find_one(collection, {'_db_pyr_guid': i}) for i in parse_ids)
+    assert original['data']['thumbnail']['base64'] and 'similar_to' not in original
+    assert near['similar_to']['parse_id'] == parse_ids[0] and near['data']['thumbnail'] == {}
@@ -0,0 +1,81 @@
+import json
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pytest
+
+from app.data.codec import encode_track
+from app.data.geographic.constants import COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_WGS84
+from app.data.geographic.transform import transform
+from app.export.columns import COLUMNS, iter_chunks
+from app.export.run import export, export_collection
+from app.export.writers import ExportError, get_writer, read_npz
+
+START = 1569544331
+
+
+def _records(count, datum=COORDINATE_SYSTEM_WGS84):
+    return [{'coordinate': {'timestamp': START + i, 'longitude': 104.0 + i * 1e-4, 'latitude': 30.0,
+                            'altitude': 500.0 if i % 2 else None, 'datum': datum, 'address': '四川省成都市'},
+             'physiologic': {'timestamp': START + i, 'heart_rate': 120}} for i in range(count)]
+
+
+def _documents():
+    longitude, latitude = transform(104.0, 30.0, COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_GCJ02)
+    gcj = _records(3, COORDINATE_SYSTEM_GCJ02)
+    gcj[0]['coordinate'].update(longitude=float(longitude), latitude=float(latitude))
+    return [{'_db_pyr_guid': 'a', 'data': {'activity_records': encode_track(_records(5))}},
+            {'_db_pyr_guid': 'empty', 'data': {}},
+            {'_db_pyr_guid': 'b', 'data': {'activity_records': gcj + [{'physiologic': {'timestamp': START}}]}}]
+
+
+def test_chunks():
+    chunks = list(iter_chunks(_documents(), chunk_size=3))
+    assert [len(chunk['parse_id']) for chunk in chunks] == [3, 3, 3]
+    assert all(tuple(chunk) == COLUMNS for chunk in chunks)
+    parse_ids = np.concatenate([chunk['parse_id'] for chunk in chunks]).tolist()
+    assert parse_ids == ['a'] * 5 + ['b'] * 4
+    # GCJ-02 positions are exported in WGS84
+    assert abs(chunks[1]['longitude'][2] - 104.0) < 1e-5 and abs(chunks[1]['latitude'][2] - 30.0) < 1e-5
+    assert np.isnan(chunks[0]['altitude'][0]) and np.isnan(chunks[2]['longitude'][2])
+    assert chunks[2]['address'][2] == ''
+
+
+def test_npz(tmp_path):
+    path = str(tmp_path / 'tracks.npz')
+    writer = export(_documents(), 'npz', path, chunk_size=4)
+    assert (writer.rows, writer.chunks) == (9, 3)
+    columns = read_npz(path, ['parse_id', 'heart_rate'])
+    assert set(columns) == {'parse_id', 'heart_rate'}
+    assert columns['parse_id'].tolist() == ['a'] * 5 + ['b'] * 4
+    assert np.nansum(columns['heart_rate']) == 120 * 8
+
+
+def test_gpx(tmp_path):
+    path = str(tmp_path / 'rides.gpx')
+    export(_documents(), 'gpx', path, chunk_size=2)
+    namespace = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+    tracks = ElementTree.parse(path).getroot().findall('gpx:trk', namespace)
+    assert [track.find('gpx:name', namespace).text for track in tracks] == ['a', 'b']
+    points = tracks[0].findall('gpx:trkseg/gpx:trkpt', namespace)
+    assert len(points) == 5 and points[1].find('gpx:ele', namespace).text == '500.0'
+    assert points[0].find('gpx:ele', namespace) is None
+    assert points[0].find('gpx:time', namespace).text == '2019-09-27T00:32:11Z'
+
+
+def test_geojson(tmp_path, memory_db):
+    for document in _documents():
+        memory_db.insert(memory_db.Collections.MEDIA_PARSED_DATA, document)
+    path = str(tmp_path / 'rides.geojson')
+    export_collection(memory_db.Collections.MEDIA_PARSED_DATA, 'geojson', path, chunk_size=2)
+    with open(path, encoding='utf-8') as file:
+        features = json.load(file)['features']
+    assert [feature['properties']['parse_id'] for feature in features] == ['a', 'b']
+    assert features[0]['properties']['points'] == 5
+    assert features[0]['properties']['end_time'] == '2019-09-27T00:32:15Z'
+    assert features[0]['geometry']['coordinates'][1] == [104.0001, 30.0, 500.0]
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ExportError):
+        get_writer('csv', str(tmp_path / 'tracks.csv'))
@@ -0,0 +1,37 @@
+from app.data.geographic.constants import COORDINATE_SYSTEM_GCJ02, COORDINATE_SYSTEM_WGS84
+from app.data.geographic.geocoding import ReverseGeocoder
+from app.data.geographic.transform import transform
+
+
+def test_reverse():
+    geocoder = ReverseGeocoder()
+    assert geocoder.reverse(104.06, 30.66)['address'] == '四川省成都市'
+    # the districts of a municipality have no city name
+    assert geocoder.reverse(116.40, 39.91)['city'] is None
+    assert geocoder.reverse(0, 0) is None
+    assert geocoder.reverse(None, 30.66) is None
+
+
+def test_lookup_once_per_cell():
+    geocoder = ReverseGeocoder(quantum=0.01, cache_size=2)
+    places = geocoder.lookup([104.061, 104.062, float('nan'), 116.40], [30.661, 30.662, 30.66, 39.91])
+    assert places[0] is places[1] and places[2] is None
+    assert (geocoder.hits, geocoder.misses) == (0, 2)
+    geocoder.lookup([104.061], [30.661])
+    assert geocoder.hits == 1
+    geocoder.lookup([121.47], [31.23])
+    # the least recently used cell was evicted
+    geocoder.lookup([116.40], [39.91])
+    assert geocoder.misses == 4
+
+
+def test_annotate_track_by_datum():
+    longitude, latitude = transform(104.06, 30.66, COORDINATE_SYSTEM_WGS84, COORDINATE_SYSTEM_GCJ02)
+    records = [{'coordinate': {'longitude': 104.06, 'latitude': 30.66}},
+               {'coordinate': {'longitude': float(longitude), 'latitude': float(latitude),
+                               'datum': COORDINATE_SYSTEM_GCJ02}},
+               {'coordinate': {'longitude': None, 'latitude': None}},
+               {'physiologic': {'speed': 20}}]
+    ReverseGeocoder().annotate_track(records)
+    assert records[0]['coordinate']['address'] == records[1]['coordinate']['address'] == '四川省成都市'
+    assert 'address' not in records[2]['coordinate']
@@ -0,0 +1,54 @@
+import numpy as np
+
+from app.data.geographic.utils import gps_to_position
+from app.parse.geotag import TrackLocator, geotag_photos, photo_timestamp
+
+START = 1569544331  # 2019-09-27 00:32:11 UTC
+
+
+def _track(start=START, count=100, step=10):
+    return [{'coordinate': {'timestamp': start + i * step, 'longitude': 104.0 + i * 1e-3, 'latitude': 30.0,
+                            'altitude': 500.0 + i, 'datum': 'WGS84'}} for i in range(count)]
+
+
+def _photo(value, offset=None):
+    exif = {'DateTimeOriginal': value}
+    if offset is not None:
+        exif['OffsetTimeOriginal'] = offset
+    return {'exif': exif, 'gps': {}}
+
+
+def test_photo_timestamp():
+    assert photo_timestamp(_photo('2019:09:27 08:32:11')) == START
+    assert photo_timestamp(_photo('2019:09:27 02:32:11', '+02:00')) == START
+    assert photo_timestamp(_photo('2019:09:27 00:32:11'), 'UTC') == START
+    assert photo_timestamp({'exif': {'DateTimeOriginal': '0000:00:00 00:00:00'},
+                            'image': {'DateTime': '2019:09:27 08:32:11'}}) == START
+    assert photo_timestamp({'exif': {}}) is None
+
+
+def test_locate():
+    locator = TrackLocator([_track(count=10), _track(start=START + 1000, count=10)])
+    longitude, latitude, altitude, matched = locator.locate([START + 15, START - 30, START - 90, START + 500,
+                                                             None, START + 1090])
+    assert matched.tolist() == [True, True, False, False, False, True]
+    assert np.isclose(longitude[0], 104.0015) and np.isclose(altitude[0], 501.5)
+    # photos just before the track snap to its first point
+    assert longitude[1] == 104.0
+    assert np.isnan(longitude[3])
+    assert np.isclose(longitude[5], 104.009)
+
+
+def test_geotag_photos():
+    photos = [_photo('2019:09:27 08:32:26'), _photo('2019:09:27 08:32:11'),
+              dict(_photo('2019:09:27 08:32:11'), gps={'GPSLatitude': [1, 0, 0], 'GPSLatitudeRef': 'N',
+                                                       'GPSLongitude': [1, 0, 0], 'GPSLongitudeRef': 'E'}),
+              _photo('2019:09:28 08:32:11')]
+    assert geotag_photos(photos, [_track()], clock_offset=10) == 2
+    longitude, latitude = gps_to_position(photos[0]['gps'])
+    assert abs(longitude - 104.0025) < 1e-6 and abs(latitude - 30.0) < 1e-6
+    assert photos[0]['gps']['_inferred']['clock_offset'] == 10
+    assert photos[0]['gps']['GPSAltitude'] == 502.5
+    assert gps_to_position(photos[1]['gps'])[0] == 104.001
+    assert gps_to_position(photos[2]['gps']) == (1.0, 1.0)
+    assert photos[3]['gps'] == {}
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from app.data.codec import encode_track
+from app.data.geographic.heatmap import Heatmap, HeatmapError, to_pixels
+
+ZOOM = 12
+
+
+def _track(count=50, longitude=104.1, latitude=30.66, step=1e-4):
+    return [longitude + i * step for i in range(count)], [latitude] * count
+
+
+def _tile(longitude, latitude, zoom=ZOOM):
+    x, y = to_pixels(longitude, latitude, zoom)
+    return zoom, int(x) // 256, int(y) // 256
+
+
+@pytest.fixture
+def heatmap(tmp_path):
+    return Heatmap(str(tmp_path / 'heatmap'), min_zoom=10, max_zoom=ZOOM)
+
+
+def test_to_pixels():
+    x, y = to_pixels([-180, 0, 180], [0, 0, 90], 0)
+    assert x.tolist() == [0, 128, 255] and y.tolist()[:2] == [128, 128] and y[2] == 0
+
+
+def test_track_counts_once_per_pixel(heatmap):
+    longitude, latitude = _track()
+    # a track going back and forth over the same pixels counts once
+    heatmap.add('a', longitude + longitude[::-1], latitude * 2)
+    heatmap.add('b', *_track(count=25))
+    counts = heatmap.tile(*_tile(longitude[0], latitude[0]))
+    assert counts.max() == 2 and set(np.unique(counts).tolist()) == {0, 1, 2}
+    # the segments between the points are filled, no pixel of the row is left out
+    row = counts[counts.any(axis=1)][0]
+    assert np.count_nonzero(row) == np.flatnonzero(row)[-1] - np.flatnonzero(row)[0] + 1
+    # every zoom counts the track
+    assert heatmap.tile(*_tile(longitude[0], latitude[0], 10)).max() == 2
+    assert heatmap.tile(*_tile(longitude[0], latitude[0], 9)).max() == 0
+
+
+def test_add_remove(heatmap):
+    longitude, latitude = _track()
+    assert heatmap.add('a', longitude, latitude) == 3
+    assert heatmap.add('a', longitude, latitude) == 0
+    assert Heatmap(heatmap.path).parses == {'a'}
+    heatmap.remove('a', longitude, latitude)
+    assert heatmap.tile(*_tile(longitude[0], latitude[0])).max() == 0
+    assert Heatmap(heatmap.path).parses == set()
+
+
+def _tiles(heatmap, longitude, latitude):
+    return [heatmap.tile(*_tile(longitude[0], latitude[0], zoom)) for zoom in (10, 11, 12)]
+
+
+def test_extend_matches_add(tmp_path, memory_db):
+    longitude, latitude = _track(count=20, step=1e-3)
+    # out and back, the slices meet between two points pixels apart and the way back passes the pixels of the first slice
+    longitude, latitude = longitude + longitude[::-1], latitude * 2
+    added = Heatmap(str(tmp_path / 'added'), min_zoom=10, max_zoom=ZOOM)
+    added.add('a', longitude, latitude)
+    extended = Heatmap(str(tmp_path / 'extended'), min_zoom=10, max_zoom=ZOOM)
+    extended.extend('a', longitude[:10], latitude[:10])
+    extended.extend('a', longitude[10:], latitude[10:])
+    assert all(np.array_equal(i, j) for i, j in zip(_tiles(added, longitude, latitude),
+                                                      _tiles(extended, longitude, latitude)))
+    assert _tiles(extended, longitude, latitude)[2].max() == 1
+
+    records = [{'coordinate': {'longitude': i, 'latitude': j, 'datum': 'WGS84'}} for i, j in zip(longitude, latitude)]
+    memory_db.insert(memory_db.Collections.MEDIA_PARSED_DATA, {'_db_pyr_guid': 'a',
+                                                               'data': {'activity_records': records}})
+    rebuilt = Heatmap(str(tmp_path / 'rebuilt'), min_zoom=10, max_zoom=ZOOM)
+    rebuilt.rebuild(memory_db)
+    assert all(np.array_equal(i, j) for i, j in zip(_tiles(rebuilt, longitude, latitude),
+                                                      _tiles(extended, longitude, latitude)))
+    # the pixels counted by the slices are taken out, whatever points are given
+    extended.remove('a', [], [])
+    assert not any(i.any() for i in _tiles(extended, longitude, latitude))
+
+
+def test_glitches_and_gaps(heatmap):
+    heatmap.add('a', [104.1, np.nan, 104.11, 120.0], [30.66, np.nan, 30.66, 30.66])
+    counts = heatmap.tile(*_tile(104.1, 30.66))
+    # the NaN point breaks the track and the jump to 120 is a glitch, only the points are counted
+    assert np.count_nonzero(counts) == 2
+    assert heatmap.tile(*_tile(120.0, 30.66)).max() == 1
+
+
+def test_overzoom_and_png(heatmap):
+    longitude, latitude = _track()
+    heatmap.add('a', longitude, latitude)
+    zoom, x, y = _tile(longitude[0], latitude[0])
+    assert np.count_nonzero(heatmap.tile(zoom + 1, x * 2, y * 2)) + \
+        np.count_nonzero(heatmap.tile(zoom + 1, x * 2 + 1, y * 2)) + \
+        np.count_nonzero(heatmap.tile(zoom + 1, x * 2, y * 2 + 1)) + \
+        np.count_nonzero(heatmap.tile(zoom + 1, x * 2 + 1, y * 2 + 1)) == 4 * np.count_nonzero(heatmap.tile(zoom, x, y))
+    assert heatmap.png(zoom, x, y).startswith(b'\x89PNG\r\n\x1a\n')
+    with pytest.raises(HeatmapError):
+        heatmap.tile(zoom, 1 << zoom, y)
+
+
+def test_rebuild(heatmap, memory_db):
+    collection = memory_db.Collections.MEDIA_PARSED_DATA
+    longitude, latitude = _track()
+    records = [{'coordinate': {'longitude': i, 'latitude': j, 'datum': 'WGS84'}} for i, j in zip(longitude, latitude)]
+    memory_db.insert(collection, {'_db_pyr_guid': 'a', 'data': {'activity_records': encode_track(records)}})
+    memory_db.insert(collection, {'_db_pyr_guid': 'b', 'data': {'activity_records': records}, '_db_deleted': True})
+    memory_db.insert(collection, {'_db_pyr_guid': 'c', 'data': {'activity_records': records}, 'merged_from': ['a']})
+    memory_db.insert(collection, {'_db_pyr_guid': 'd', 'data': {}})
+    heatmap.add('stale', *_track(latitude=31.0))
+    assert heatmap.rebuild(memory_db) == 1
+    assert heatmap.parses == {'a'}
+    assert heatmap.tile(*_tile(longitude[0], latitude[0])).max() == 1
+    assert heatmap.tile(*_tile(longitude[0], 31.0)).max() == 0
@@ -0,0 +1,45 @@
+import pytest
+
+from app.parse.incremental import FitCheckpointStore
+from app.parse.parsers import FitParser
+from app.settings import FIT_INCREMENTAL, HEATMAP, ROLLUP, SPATIAL_INDEX
+from benchmarks.fixtures import make_fit
+
+
+@pytest.fixture
+def no_indexes(monkeypatch):
+    for settings in (SPATIAL_INDEX, HEATMAP, ROLLUP):
+        monkeypatch.setitem(settings, 'ENABLED', False)
+
+
+def test_sliced_upload_lists_gears_once(memory_db, no_indexes, tmp_path):
+    data = make_fit(duration=1800, device_info_interval=300)
+    path = tmp_path / 'ride.fit'
+    store = FitCheckpointStore(str(tmp_path / 'checkpoints'))
+    parse_ids = set()
+    for end in (len(data) // 4, len(data) // 2, len(data) * 3 // 4, len(data)):
+        path.write_bytes(data[:end])
+        parser = FitParser(str(path), incremental=True, checkpoint_store=store)
+        parser.parse()
+        parse_ids.add(parser.save())
+    assert len(parse_ids) == 1
+
+    stored = memory_db.find_one(memory_db.Collections.MEDIA_PARSED_DATA, {'_db_pyr_guid': parse_ids.pop()})
+    expected = FitParser(str(path)).parse()
+    gears = stored['data']['gear']
+    assert sorted(i['key'] for i in gears) == sorted(i['key'] for i in expected['gear'])
+    assert len(gears) == 4
+    assert len(stored['data']['activity']) == len(expected['activity'])
+    assert len(stored['data']['activity_records']) == len(expected['activity_records'])
+    for gear in gears:
+        assert gear['first_seen'] <= gear['last_seen']
+
+
+def test_checkpoint_root_is_read_when_used(memory_db, no_indexes, monkeypatch, tmp_path):
+    monkeypatch.setitem(FIT_INCREMENTAL, 'CHECKPOINT_ROOT', str(tmp_path / 'checkpoints'))
+    path = tmp_path / 'ride.fit'
+    path.write_bytes(make_fit(duration=60))
+    parser = FitParser(str(path), incremental=True)
+    parser.parse()
+    parser.save()
+    assert len(list((tmp_path / 'checkpoints').iterdir())) == 1
@@ -0,0 +1,36 @@
+from app.data.geographic import heatmap, index
+from app.ingest import daemon
+from app.ingest.checkpoint import IngestCheckpoint
+from app.parse.parsers import Parser
+from app.settings import FIT_INCREMENTAL, HEATMAP, SPATIAL_INDEX
+from benchmarks.fixtures import make_fit
+
+
+def test_thread_workers_leave_settings_alone(memory_db, monkeypatch, tmp_path):
+    monkeypatch.setitem(SPATIAL_INDEX, 'PATH', str(tmp_path / 'spatial_index.pkl'))
+    monkeypatch.setitem(HEATMAP, 'PATH', str(tmp_path / 'heatmap'))
+    monkeypatch.setitem(FIT_INCREMENTAL, 'CHECKPOINT_ROOT', str(tmp_path / 'fit_checkpoints'))
+    monkeypatch.setattr(index, '_spatial_index', None)
+    monkeypatch.setattr(heatmap, '_heatmap', None)
+    media = tmp_path / 'media'
+    media.mkdir()
+    for i in range(3):
+        (media / ('ride_%d.fit' % i)).write_bytes(make_fit(duration=60, seed=i))
+
+    indexed, enabled = [], []
+    monkeypatch.setattr(Parser, '_index_positions', lambda self, *args, **kwargs: indexed.append(args))
+    ingest_file = daemon.ingest_file
+
+    def ingest(*args, **kwargs):
+        enabled.append((SPATIAL_INDEX['ENABLED'], HEATMAP['ENABLED']))
+        return ingest_file(*args, **kwargs)
+    monkeypatch.setattr(daemon, 'ingest_file', ingest)
+
+    counts = daemon.IngestDaemon([str(media)], IngestCheckpoint(':memory:'), workers=2, executor='thread',
+                                 watcher='poll', settle_seconds=0, full_scan_interval=0).run(once=True)
+    assert counts.get('done') == 3
+    # the workers skip the indexes by argument, the daemon indexes the positions itself
+    assert not indexed
+    assert enabled == [(True, True)] * 3
+    assert len(index.get_spatial_index()) == 3
+    assert SPATIAL_INDEX['ENABLED'] and HEATMAP['ENABLED']
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from app.parse.jpeg import JpegError, decode_luma
+from benchmarks.fixtures import encode_jpeg
+
+
+def _gradient(height, width):
+    y, x = np.mgrid[0:height, 0:width]
+    return np.dstack([x * 255 / width, y * 255 / height, np.full((height, width), 128.0)])
+
+
+@pytest.mark.parametrize('height, width', [(120, 160), (37, 53)])
+def test_decode_luma(height, width):
+    rgb = _gradient(height, width)
+    luma = 0.299 * rgb[..., 0] + 0.587 * rgb[..., 1] + 0.114 * rgb[..., 2]
+    # chroma subsampled color and gray images
+    for pixels, expected in ((rgb, luma), (luma, luma)):
+        decoded = decode_luma(encode_jpeg(pixels, quality=95))
+        assert decoded.shape == (height, width)
+        assert np.abs(decoded - expected).mean() < 1
+
+
+def test_unsupported_and_corrupt():
+    data = encode_jpeg(_gradient(16, 16))
+    with pytest.raises(JpegError):
+        decode_luma(data.replace(b'\xff\xc0', b'\xff\xc2', 1))
+    with pytest.raises(JpegError):
+        decode_luma(data[:len(data) // 2])
+    with pytest.raises(JpegError):
+        decode_luma(b'GIF89a')
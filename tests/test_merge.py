@@ -0,0 +1,73 @@
+from app.data.codec import decode_track, encode_track
+from app.parse.merge import ActivitySummary, TimelineMerger, merge_parse_results, merge_stored, record_timestamp
+
+
+def _record(timestamp, longitude=None, heart_rate=None, altitude=None, speed=20.0):
+    ret = {'physiologic': {'timestamp': timestamp, 'speed': speed, 'heart_rate': heart_rate}}
+    if longitude is not None:
+        ret['coordinate'] = {'timestamp': timestamp, 'longitude': longitude, 'latitude': 30.0, 'altitude': altitude}
+    return ret
+
+
+def test_record_timestamp():
+    assert record_timestamp({'environment': {'timestamp': 3}}) == 3
+    assert record_timestamp({'coordinate': None, 'physiologic': {'timestamp': 2}}) == 2
+    assert record_timestamp({}) is None
+
+
+def test_merge_is_in_time_order():
+    sources = [[_record(t, longitude=104 + t * 1e-4) for t in range(0, 30, 3)],
+               [_record(t, longitude=104 + t * 1e-4) for t in range(1, 30, 3)],
+               [_record(t, longitude=104 + t * 1e-4) for t in range(2, 30, 3)]]
+    merger = TimelineMerger(sources)
+    timestamps = [record_timestamp(record) for record in merger]
+    assert timestamps == list(range(30))
+    assert merger.summary()['sources'] == {'source0': 10, 'source1': 10, 'source2': 10}
+    assert merger.merged == 0 and merger.late == 0
+
+
+def test_merge_combines_by_preference():
+    edge = [_record(t, longitude=104.0, altitude=500) for t in range(5)]
+    strap = [_record(t + 0.25, heart_rate=130) for t in range(5)] + [{'physiologic': {'heart_rate': 1}}]
+    merger = TimelineMerger([edge, strap], names=['edge', 'strap'],
+                            preferences={'heart_rate': ['strap'], 'speed': ['edge']})
+    records = list(merger)
+    assert len(records) == 5 and merger.merged == 5 and merger.untimed == 1
+    assert all(record['physiologic']['heart_rate'] == 130 for record in records)
+    assert all(record['coordinate']['longitude'] == 104.0 for record in records)
+    # the first source having the field wins by default, the edge records have no heart rate
+    records = list(TimelineMerger([edge, strap], names=['edge', 'strap']))
+    assert records[0]['physiologic']['heart_rate'] == 130
+
+
+def test_late_records_are_dropped():
+    merger = TimelineMerger([[_record(0), _record(5), _record(2), _record(6)]])
+    assert [record_timestamp(record) for record in merger] == [0, 5, 6]
+    assert merger.late == 1
+
+
+def test_summary():
+    summary = ActivitySummary(ascent_threshold=5)
+    for t, altitude in enumerate((100, 102, 106, 110, 103, 98)):
+        summary.add(_record(t * 10, longitude=104.0 + t * 1e-3, altitude=altitude, heart_rate=100 + t))
+    ret = summary.result()
+    assert ret['total_elapsed_time'] == 50 and ret['total_timer_time'] == 50
+    # climbs under the threshold are not counted
+    assert ret['total_ascent'] == 6 and ret['total_descent'] == 8
+    assert ret['max_heart_rate'] == 105 and ret['avg_heart_rate'] == 102.5
+    assert ret['swc_position'] == (104.0, 30.0) and 450 < ret['total_distance'] < 500
+
+
+def test_merge_stored(memory_db):
+    collection = memory_db.Collections.MEDIA_PARSED_DATA
+    parse_ids = [memory_db.insert(collection, {'data': {'activity_records': encode_track(
+                     [_record(t, longitude=104 + t * 1e-4) for t in range(start, 40, 2)], chunk_size=8)}})
+                 for start in (0, 1)]
+    merged = memory_db.find_one(collection, {'_db_pyr_guid': merge_stored(parse_ids)})
+    assert merged['merged_from'] == parse_ids
+    records = merged['data']['activity_records']
+    assert [record_timestamp(record) for record in records] == list(range(40))
+    assert merged['data']['activity'][0]['sources'] == dict(zip(parse_ids, (20, 20)))
+
+    result = merge_parse_results([{'activity_records': encode_track(records[:10])}])
+    assert len(decode_track(result['activity_records'])) == 10
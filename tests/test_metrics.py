@@ -0,0 +1,79 @@
+import pytest
+
+from app.settings import METRICS
+from app.utils import metrics
+from app.utils.metrics import Histogram, Registry, inc, timed_iter, timer
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    ret = Registry()
+    monkeypatch.setattr(metrics, 'registry', ret)
+    monkeypatch.setitem(METRICS, 'ENABLED', True)
+    monkeypatch.setitem(METRICS, 'TRACE_SAMPLE_RATE', 0)
+    return ret
+
+
+def test_histogram_exposition():
+    histogram = Histogram('parse_seconds', 'Time of parses', buckets=(1, 0.1))
+    for value in (0.05, 0.5, 2):
+        histogram.observe(value, parser='FitParser')
+    assert histogram.expose() == ['parse_seconds_bucket{parser="FitParser",le="0.1"} 1',
+                                  'parse_seconds_bucket{parser="FitParser",le="1.0"} 2',
+                                  'parse_seconds_bucket{parser="FitParser",le="+Inf"} 3',
+                                  'parse_seconds_sum{parser="FitParser"} 2.55',
+                                  'parse_seconds_count{parser="FitParser"} 3']
+
+
+def test_counter_labels_are_escaped(registry):
+    inc('ingest_files_total', status='failed', path='C:\\rides\\"a".fit')
+    inc('ingest_files_total', 2, status='failed', path='C:\\rides\\"a".fit')
+    text = registry.expose()
+    assert '# TYPE ingest_files_total counter' in text
+    assert 'ingest_files_total{path="C:\\\\rides\\\\\\"a\\".fit",status="failed"} 3.0' in text
+
+
+def test_timer_counts_errors(registry):
+    @timer('parser_parse_seconds', parser='FitParser')
+    def parse(fail):
+        if fail:
+            raise ValueError('bad file')
+
+    parse(False)
+    with pytest.raises(ValueError):
+        parse(True)
+    text = registry.expose()
+    assert 'parser_parse_seconds_count{parser="FitParser"} 2' in text
+    assert 'parser_parse_errors_total{parser="FitParser"} 1.0' in text
+
+
+def test_disabled(registry, monkeypatch):
+    monkeypatch.setitem(METRICS, 'ENABLED', False)
+    with timer('parser_parse_seconds'):
+        inc('ingest_files_total')
+    assert list(timed_iter(range(3), 'fit_decode_seconds')) == [0, 1, 2]
+    assert registry.expose() == '\n'
+
+
+def test_traces(registry, monkeypatch):
+    monkeypatch.setitem(METRICS, 'TRACE_SAMPLE_RATE', 1)
+    monkeypatch.setitem(METRICS, 'TRACE_MAX_SPANS', 2)
+    with timer('parser_parse_seconds'):
+        for _ in range(3):
+            with timer('parser_handler_seconds', handler='record'):
+                pass
+        assert list(timed_iter(iter('abc'), 'fit_decode_seconds')) == ['a', 'b', 'c']
+    trace = registry.traces[-1]
+    assert trace['name'] == 'parser_parse_seconds' and len(trace['children']) == 2
+    assert trace['children'][0]['labels'] == {'handler': 'record'}
+    assert 'fit_decode_items_total 3.0' in registry.expose()
+
+
+def test_metrics_endpoint(registry):
+    from app import create_app
+
+    client = create_app({'TESTING': True}).test_client()
+    assert client.get('/missing').status_code == 404
+    response = client.get('/metrics')
+    assert response.content_type == metrics.PROMETHEUS_CONTENT_TYPE
+    assert 'http_request_seconds_count{endpoint="unknown",method="GET",status="404"} 1' in response.get_data(True)
@@ -0,0 +1,57 @@
+from app.data.registry import GearRegistry, ProfileRegistry
+from app.parse.parsers import FitParser
+from app.parse.source import ParseSource
+from benchmarks.fixtures import make_fit
+
+
+def test_gear_key_uses_model():
+    gear = {'manufacturer': 'garmin', 'model': 2713, 'serial_number': 3900000000}
+    assert GearRegistry().key(gear) == 'garmin:2713:3900000000'
+    assert GearRegistry().key({'manufacturer': 'garmin', 'garmin_product': 'edge530', 'serial_number': 1}) == \
+        'garmin:edge530:1'
+
+
+def test_parsed_gear_keys():
+    parser = FitParser(ParseSource(make_fit(duration=60), name='ride.fit'))
+    parser.parse()
+    keys = [i['key'] for i in parser._result['gear']]
+    assert len(keys) == 4
+    assert all(':None:' not in key for key in keys)
+
+
+def test_register_once(memory_db):
+    registry = GearRegistry()
+    gear = {'manufacturer': 'garmin', 'model': 2713, 'serial_number': 1, 'battery_voltage': 3.9}
+    registry_id = registry.register(gear)
+    assert registry_id is not None
+    assert registry.register(dict(gear, battery_voltage=3.7)) == registry_id
+    assert (registry.hits, registry.misses) == (1, 1)
+    assert memory_db.find_one(memory_db.Collections.GEAR, {'key': 'garmin:2713:1'})['model'] == 2713
+    reference = ProfileRegistry().reference({'age': 35, 'weight': 72.0})
+    assert memory_db.find_one(memory_db.Collections.TRAVELLER_PROFILE, {'key': reference['key']})
+
+
+def test_failed_db_is_not_retried(memory_db, monkeypatch):
+    calls = []
+
+    def upsert(*args, **kwargs):
+        calls.append(args)
+        return None
+    monkeypatch.setattr(memory_db, 'upsert', upsert)
+    registry = GearRegistry()
+    for serial_number in range(10):
+        assert registry.register({'manufacturer': 'garmin', 'model': 2713, 'serial_number': serial_number}) is None
+    assert len(calls) == 1
+    assert registry.failures == 10
+    # a record not registered is kept whole in the reference, in the back-off as well
+    for _ in range(2):
+        reference = registry.reference({'manufacturer': 'garmin', 'model': 2713, 'serial_number': 1,
+                                        'battery_voltage': 3.9, 'timestamp': 1569544331})
+        assert reference == {'manufacturer': 'garmin', 'model': 2713, 'serial_number': 1, 'battery_voltage': 3.9,
+                             'timestamp': 1569544331, 'gear_id': None, 'key': 'garmin:2713:1'}
+    assert len(calls) == 1
+
+    # registered again once RETRY_AFTER is over
+    monkeypatch.undo()
+    registry._failed_until = 0
+    assert registry.register({'manufacturer': 'garmin', 'model': 2713, 'serial_number': 1}) is not None
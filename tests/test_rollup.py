@@ -0,0 +1,111 @@
+from app.data.rollup import Rollups, contribution
+
+
+def _document(parse_id, distance=10000.0, path='rides/a.fit'):
+    return {'_db_pyr_guid': parse_id, '_db_owner': 'alice', 'path': path,
+            'data': {'activity': [{'start_time': '2019-09-27 00:32:11', 'total_distance': distance,
+                                   'total_ascent': 100, 'total_elapsed_time': 3600, 'total_timer_time': 3000}],
+                     'gear': [{'key': 'garmin:edge 530:42'}]}}
+
+
+def test_contribution_buckets():
+    ret = contribution(_document('a'))
+    assert ret['values']['distance'] == 10000.0
+    assert 'owner:alice:week:2019-W39' in ret['buckets']
+    assert 'gear:garmin:edge 530:42:all:all' in ret['buckets']
+
+
+def test_update_is_idempotent(memory_db):
+    rollups = Rollups(memory_db)
+    assert rollups.update(_document('a'))
+    assert not rollups.update(_document('a'))
+    assert rollups.get('owner', 'alice', 'week', '2019-W39')['activities'] == 1
+    assert rollups.get('gear', 'garmin:edge 530:42', 'all', 'all') == rollups.get('owner', 'alice', 'month', '2019-09')
+    assert rollups.get('gear', 'garmin:edge 530:42', 'all', 'all')['distance'] == 10000.0
+
+
+def test_reparse_replaces_contribution(memory_db):
+    rollups = Rollups(memory_db)
+    rollups.update(_document('a'))
+    rollups.update(_document('b', distance=20000.0))
+    totals = rollups.get('owner', 'alice', 'day', '2019-09-27')
+    assert totals['activities'] == 1
+    assert totals['distance'] == 20000.0
+    assert not rollups.remove('a')
+    assert rollups.remove('b')
+    assert rollups.get('owner', 'alice', 'day', '2019-09-27')['activities'] == 0
+
+
+def test_rebuild_matches_updates(memory_db):
+    rollups = Rollups(memory_db)
+    for document in (_document('a'), _document('b', path='rides/b.fit')):
+        memory_db.insert(memory_db.Collections.MEDIA_PARSED_DATA, document)
+        rollups.update(document)
+    updated = rollups.series('owner', 'alice', 'day')
+    assert rollups.rebuild() == 2
+    assert rollups.series('owner', 'alice', 'day') == updated
+    assert updated[0]['activities'] == 2
+
+
+class _FailingCollection:
+    def __getattr__(self, item):
+        def fail(*args, **kwargs):
+            from pymongo.errors import ServerSelectionTimeoutError
+
+            raise ServerSelectionTimeoutError('no server')
+        return fail
+
+
+def test_db_failure_skips_rollup(memory_db):
+    rollups = Rollups(memory_db)
+    collection = memory_db.db[memory_db.Collections.ROLLUP_LEDGER]
+    memory_db.db[memory_db.Collections.ROLLUP_LEDGER] = _FailingCollection()
+    assert not rollups.update(_document('a'))
+    assert not memory_db.db[memory_db.Collections.ROLLUP].documents
+
+    # a write failing half way leaves the contribution pending, the next update finishes without counting twice
+    memory_db.db[memory_db.Collections.ROLLUP_LEDGER] = collection
+    rollup = memory_db.db[memory_db.Collections.ROLLUP]
+    update_one = rollup.update_one
+    calls = []
+
+    def flaky(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            _FailingCollection().update_one()
+        return update_one(*args, **kwargs)
+    rollup.update_one = flaky
+    assert not rollups.update(_document('a'))
+    ledger = collection.find_one({'source': {'$exists': True}})
+    assert ledger.get('contribution') is None and len(ledger['pending']) == 1
+    rollup.update_one = update_one
+    assert rollups.update(_document('a'))
+    for period, bucket in (('day', '2019-09-27'), ('week', '2019-W39'), ('month', '2019-09')):
+        assert rollups.get('owner', 'alice', period, bucket)['activities'] == 1
+
+
+def test_half_applied_reparse(memory_db):
+    rollups = Rollups(memory_db)
+    rollups.update(_document('a'))
+    rollup = memory_db.db[memory_db.Collections.ROLLUP]
+    update_one = rollup.update_one
+
+    def flaky(condition, *args, **kwargs):
+        if condition['key'] == 'owner:alice:week:2019-W39':
+            _FailingCollection().update_one()
+        return update_one(condition, *args, **kwargs)
+    rollup.update_one = flaky
+    assert not rollups.update(_document('b', distance=20000.0))
+    assert rollups.get('owner', 'alice', 'day', '2019-09-27')['distance'] == 20000.0
+    assert rollups.get('owner', 'alice', 'week', '2019-W39')['distance'] == 10000.0
+
+    # the next parse has another version, it replaces whichever version each bucket holds
+    rollup.update_one = update_one
+    assert rollups.update(_document('c', distance=30000.0))
+    for period, bucket in (('day', '2019-09-27'), ('week', '2019-W39'), ('month', '2019-09')):
+        assert rollups.get('owner', 'alice', period, bucket)['distance'] == 30000.0
+        assert rollups.get('owner', 'alice', period, bucket)['activities'] == 1
+    assert rollups.remove('c')
+    assert not any(rollups.get('owner', 'alice', period, bucket)['activities']
+                   for period, bucket in (('day', '2019-09-27'), ('week', '2019-W39'), ('all', 'all')))
+    assert rollups.get('gear', 'garmin:edge 530:42', 'all', 'all')['distance'] == 0
@@ -0,0 +1,94 @@
+import io
+import json
+import mmap
+
+import pytest
+
+from app.base.exceptions import PyrTypeError
+from app.parse.parsers import FitParser, PhotoParser, VideoParser
+from app.parse.source import BufferReader, ParseSource
+from app.utils.mongodb import JSONEncoder
+from benchmarks.fixtures import make_fit, make_jpeg, write_fixtures
+from benchmarks.stages import VideoDecode
+
+
+@pytest.fixture(scope='module')
+def fixtures(tmp_path_factory):
+    return write_fixtures(str(tmp_path_factory.mktemp('fixtures')), fit_duration=120, photos=4,
+                          video_duration=10, video_media_size=1 << 20)
+
+
+class _FileStorage:
+    filename = 'ride.fit'
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+
+def test_buffer_reader():
+    reader = BufferReader(b'0123456789')
+    assert reader.read(3) == b'012'
+    reader.seek(-2, io.SEEK_END)
+    assert reader.read() == b'89'
+    target = bytearray(4)
+    reader.seek(1)
+    assert reader.readinto(target) == 4 and target == b'1234'
+
+
+def test_fit_inputs(fixtures):
+    path = fixtures['fit'][0]
+    with open(path, 'rb') as file:
+        data = file.read()
+    expected = FitParser(path).parse()
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for obj in (data, bytearray(data), memoryview(data), io.BytesIO(data), _FileStorage(data), mapped, file):
+            assert FitParser(obj).parse() == expected, type(obj)
+        assert not file.closed
+
+
+def test_photo_inputs(fixtures):
+    for path in fixtures['photo']:
+        with open(path, 'rb') as file:
+            data = file.read()
+        expected = PhotoParser(path).parse()
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for obj in (data, memoryview(data), io.BytesIO(data), mapped, file):
+                assert PhotoParser(obj).parse() == expected, type(obj)
+
+
+def test_photo_from_bytes():
+    result = PhotoParser(make_jpeg(timestamp='2019:09:27 08:40:00', position=(104.0657, 30.6595, 512.0))).parse()
+    assert result['exif']['DateTimeOriginal'] == '2019:09:27 08:40:00'
+    assert (result['image']['Make'], result['gps']['GPSLatitudeRef']) == ('Flex', 'N')
+    assert [float(i) for i in result['gps']['GPSLongitude']] == [104, 3, 56.52]
+    # the EXIF ratios are stored as strings
+    assert json.loads(JSONEncoder().encode(result))['gps']['GPSLongitude'] == ['104', '3', '1413/25']
+
+
+def test_source_name_and_size():
+    data = make_fit(duration=10)
+    source = ParseSource(io.BytesIO(data), name='ride.fit')
+    assert (source.name, source.path, source.size) == ('ride.fit', None, len(data))
+    assert ParseSource(_FileStorage(data)).name == 'ride.fit'
+    with ParseSource(b'').buffer() as buffer:
+        assert buffer is None
+    with pytest.raises(PyrTypeError):
+        ParseSource(3)
+
+
+def test_video_inputs(fixtures):
+    path = fixtures['video'][0]
+    with open(path, 'rb') as file:
+        data = file.read()
+    expected = VideoParser(path).parse()
+    assert expected['activity_records']
+    for obj in (data, io.BytesIO(data)):
+        result = VideoParser(obj).parse()
+        assert result['metadata'] == expected['metadata']
+        assert len(result['activity_records']) == len(expected['activity_records'])
+
+
+def test_video_decode_stage(fixtures):
+    stage = VideoDecode(fixtures)
+    stage.setup()
+    assert stage.run() == 1
@@ -0,0 +1,84 @@
+import os
+
+from app.data.geographic.index import SpatialIndex
+
+
+def test_queries():
+    index = SpatialIndex()
+    index.add('ride', [104.00, 104.05], [30.60, 30.60])
+    index.add('photo', 116.39, 39.90, track=False)
+    assert index.bbox(104.02, 30.59, 104.03, 30.61) == {'ride'}
+    assert index.radius(116.39, 39.90, 500) == {'photo'}
+    assert index.corridor([104.025, 104.025], [30.55, 30.65], 100) == {'ride'}
+    assert index.remove('ride') and 'ride' not in index
+
+
+def test_journal_and_compact(tmp_path):
+    path = str(tmp_path / 'index.pkl')
+    index = SpatialIndex(path)
+    index.add('a', 104.0, 30.6, track=False)
+    index.extend('a', 104.1, 30.6, track=False)
+    assert SpatialIndex(path).bbox(104.09, 30.59, 104.11, 30.61) == {'a'}
+    index.compact()
+    assert not os.path.exists(path + '.journal')
+    assert SpatialIndex(path).bbox(103.9, 30.5, 104.2, 30.7) == {'a'}
+
+
+def test_compact_keeps_other_writers(tmp_path):
+    # two processes sharing the index files
+    path = str(tmp_path / 'index.pkl')
+    first, second = SpatialIndex(path), SpatialIndex(path)
+    first.add('a', 104.0, 30.6, track=False)
+    second.add('b', 116.39, 39.90, track=False)
+    first.compact()
+    second.add('c', 121.47, 31.23, track=False)
+    first.remove('a')
+    second.compact()
+    assert set(SpatialIndex(path)._items) == {'b', 'c'}
+    assert set(second._items) == {'b', 'c'}
+
+
+def test_writes_never_compact(tmp_path):
+    path = str(tmp_path / 'index.pkl')
+    index = SpatialIndex(path)
+    for i in range(50):
+        index.add(str(i), 104.0 + i * 0.01, 30.6, track=False)
+    assert not os.path.exists(path) and index.journal_size == 50
+
+
+def test_readers_replay_the_journal(tmp_path):
+    path = str(tmp_path / 'index.pkl')
+    writer, reader = SpatialIndex(path), SpatialIndex(path)
+    writer.add('a', 104.0, 30.6, track=False)
+    assert reader.bbox(103.9, 30.5, 104.2, 30.7) == {'a'}
+    offset = reader._journal_offset
+    writer.extend('a', 104.1, 30.6, track=False)
+    writer.add('b', 104.15, 30.6, track=False)
+    # only the entries appended since the last read are replayed
+    assert reader.bbox(104.09, 30.59, 104.2, 30.61) == {'a', 'b'}
+    assert reader._journal_offset == os.path.getsize(path + '.journal') > offset
+    assert reader.journal_size == 3
+
+    # an entry being written is left for the next read, a torn one is cut off by the next write
+    with open(path + '.journal', 'ab') as file:
+        file.write(b'\x80\x05\x95')
+    writer.remove('b')
+    assert reader.bbox(103.9, 30.5, 104.2, 30.7) == {'a'}
+    assert SpatialIndex(path).journal_size == 4
+
+    # compacted by another process, the reader reads the files again
+    SpatialIndex(path).compact()
+    writer.add('c', 104.05, 30.6, track=False)
+    assert reader.bbox(103.9, 30.5, 104.2, 30.7) == {'a', 'c'} and reader.journal_size == 1
+
+
+def test_compact_command(tmp_path, monkeypatch):
+    from app.data.geographic import index
+
+    path = str(tmp_path / 'index.pkl')
+    SpatialIndex(path).add('a', 104.0, 30.6, track=False)
+    monkeypatch.setattr(index, '_spatial_index', SpatialIndex(path))
+    assert index.main(['compact', '--min-entries', '2']) == 0
+    assert os.path.exists(path + '.journal')
+    assert index.main(['compact', '--min-entries', '1']) == 0
+    assert not os.path.exists(path + '.journal') and SpatialIndex(path).bbox(103.9, 30.5, 104.2, 30.7) == {'a'}
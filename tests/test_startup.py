@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+import pytest
+
+# modules a parse worker does not need until it parses or saves
+HEAVY = ('fitparse', 'exifread', 'pymongo', 'bson', 'numpy', 'flask', 'django')
+
+
+@pytest.mark.parametrize('module', ['app', 'app.parse.parsers', 'app.ingest.daemon'])
+def test_heavy_dependencies_are_lazy(module):
+    code = 'import sys, %s; print(" ".join(m for m in %r if m in sys.modules))' % (module, HEAVY)
+    process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert process.stdout.split() == []
+
+
+def test_default_db_connects_on_first_use():
+    from app.utils.mongodb import _LazyDB
+
+    db = _LazyDB()
+    assert db.Collections.GEAR == 'gear' and db._db is None
@@ -0,0 +1,55 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.data.geographic.models import Coordinate
+from app.data.geographic.transform import CoordinateSystemError, bd09_to_wgs84, gcj02_to_bd09, gcj02_to_wgs84, \
+    transform, transform_track, wgs84_to_bd09, wgs84_to_gcj02
+
+
+def test_known_values():
+    # the reference values of the widely used scalar implementation
+    assert wgs84_to_gcj02(128.543, 37.065) == pytest.approx((128.54820547949757, 37.065651049489816), abs=1e-12)
+    assert gcj02_to_bd09(128.543, 37.065) == pytest.approx((128.54944656269413, 37.07113427883019), abs=1e-12)
+
+
+def test_vectorized_matches_scalar():
+    rng = np.random.default_rng(0)
+    lng, lat = rng.uniform(74, 134, 500), rng.uniform(18, 53, 500)
+    vector = wgs84_to_bd09(lng, lat)
+    for i in range(0, 500, 50):
+        assert wgs84_to_bd09(float(lng[i]), float(lat[i])) == (vector[0][i], vector[1][i])
+
+
+def test_inverse_round_trip():
+    rng = np.random.default_rng(1)
+    lng, lat = rng.uniform(74, 134, 1000), rng.uniform(18, 53, 1000)
+    back = gcj02_to_wgs84(*wgs84_to_gcj02(lng, lat))
+    assert np.abs(back[0] - lng).max() < 1e-8 and np.abs(back[1] - lat).max() < 1e-8
+    # the BD-09 inverse is the usual closed form approximation, within half a meter
+    back = bd09_to_wgs84(*wgs84_to_bd09(lng, lat))
+    assert np.abs(back[0] - lng).max() < 5e-6 and np.abs(back[1] - lat).max() < 5e-6
+
+
+def test_outside_china_and_missing_values():
+    assert wgs84_to_gcj02(2.35, 48.85) == (2.35, 48.85)
+    lng, lat = wgs84_to_gcj02([104.06, None, float('nan')], [30.66, 30.66, 30.66])
+    assert not math.isnan(lng[0]) and np.isnan(lng[1:]).all()
+    with pytest.raises(CoordinateSystemError):
+        transform(104.06, 30.66, 'WGS84', 'UTM')
+
+
+def test_track_and_coordinate():
+    records = [{'coordinate': {'longitude': 104.06, 'latitude': 30.66}},
+               {'coordinate': {'longitude': 104.07, 'latitude': 30.67, 'datum': 'GCJ02'}},
+               {'coordinate': {'longitude': None, 'latitude': None}}]
+    transform_track(records, 'GCJ02')
+    assert records[0]['coordinate']['datum'] == 'GCJ02'
+    assert records[0]['coordinate']['longitude'] == wgs84_to_gcj02(104.06, 30.66)[0]
+    assert records[1]['coordinate']['longitude'] == 104.07
+    assert records[2]['coordinate']['longitude'] is None
+
+    coordinate = Coordinate({'longitude': 104.06, 'latitude': 30.66, 'datum': 'WGS84'}).transform('BD09')
+    assert (coordinate.longitude, coordinate.latitude) == wgs84_to_bd09(104.06, 30.66)
+    assert coordinate.datum == 'BD09'
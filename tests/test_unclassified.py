@@ -0,0 +1,53 @@
+from app.parse.incremental import FitCheckpointStore
+from app.parse.parsers import FitParser
+from app.parse.unclassified import UnclassifiedCollector, iter_unclassified
+from app.settings import DATA_MODEL, HEATMAP, ROLLUP, SPATIAL_INDEX
+from benchmarks.fixtures import make_fit
+
+
+class _Field:
+    def __init__(self, name, raw_value):
+        self.name = name
+        self.raw_value = raw_value
+
+
+class _Message:
+    def __init__(self, **values):
+        self.fields = [_Field(k, v) for k, v in values.items()]
+
+    def get_values(self):
+        return {field.name: field.raw_value for field in self.fields}
+
+
+def test_policies(memory_db):
+    collector = UnclassifiedCollector({'hrv': 'raw', 'event': 'lazy', 'developer_data_id': 'count', 'x': 'drop'},
+                                      default='inline', chunk_size=3)
+    assert collector.add('unknown', _Message(a=1))
+    assert not collector.add('x', _Message(a=1))
+    assert not collector.add('developer_data_id', _Message(a=1))
+    for i in range(7):
+        collector.add('hrv', _Message(time=i))
+        collector.add('event', _Message(timestamp=i, event='timer'))
+    assert collector.summary() == {'unknown': {'policy': 'inline', 'count': 1},
+                                   'developer_data_id': {'policy': 'count', 'count': 1},
+                                   'hrv': {'policy': 'raw', 'count': 7}, 'event': {'policy': 'lazy', 'count': 7}}
+    collector.save('p')
+    assert [values['time'] for _, values in iter_unclassified('p', 'hrv')] == list(range(7))
+
+
+def test_order_across_incremental_saves(memory_db, monkeypatch, tmp_path):
+    for settings in (SPATIAL_INDEX, HEATMAP, ROLLUP):
+        monkeypatch.setitem(settings, 'ENABLED', False)
+    monkeypatch.setitem(DATA_MODEL, 'UNCLASSIFIED_CHUNK_SIZE', 2)
+    data = make_fit(duration=1800, event_interval=60)
+    path = tmp_path / 'ride.fit'
+    store = FitCheckpointStore(str(tmp_path / 'checkpoints'))
+    # the slices are saved within the same second, the creation time can't order them
+    for end in (len(data) // 3, len(data) * 2 // 3, len(data)):
+        path.write_bytes(data[:end])
+        parser = FitParser(str(path), incremental=True, checkpoint_store=store)
+        parser.parse()
+        parse_id = parser.save()
+    timestamps = [values['timestamp'] for _, values in iter_unclassified(parse_id, 'event')]
+    assert len(timestamps) == 30
+    assert timestamps == sorted(timestamps)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from app.data.validation import validate_columns, validate_track
+
+
+def _columns(longitude, latitude, **kwargs):
+    return dict({'longitude': np.array(longitude, dtype=np.float64),
+                 'latitude': np.array(latitude, dtype=np.float64)},
+                **{k: np.array(v, dtype=np.float64) for k, v in kwargs.items()})
+
+
+def test_position_masks():
+    columns = _columns([2.35, np.nan, 2 ** 31 - 1, 0, 200, 2 ** 30],
+                       [48.85, 48.85, 48.85, 0, 48.85, 2 ** 29])
+    result = validate_columns(columns)
+    assert result.masks['position_missing'].tolist() == [False, True, False, False, False, False]
+    assert result.masks['position_sentinel'].tolist() == [False, False, True, False, False, False]
+    assert result.masks['null_island'].tolist() == [False, False, False, True, False, False]
+    # 200 is out of the degree range but in the semicircle one, it is converted
+    assert result.masks['position_semicircle'].tolist() == [False, False, False, False, True, True]
+    assert result.position_valid.tolist() == [True, False, False, False, True, True]
+    assert columns['longitude'][5] == 90.0 and columns['latitude'][5] == 45.0
+    assert result.summary() == {'records': 6, 'valid': 3, 'issues': result.counts}
+
+
+def test_value_ranges_and_timestamps():
+    columns = _columns([2.35] * 4, [48.85] * 4, heart_rate=[120, 255, 10, np.nan], power=[200, 65535, -1, 3000])
+    result = validate_columns(columns, timestamps=np.array([10, 10, 5, np.nan], dtype=np.float64))
+    assert result.masks['heart_rate_range'].tolist() == [False, True, True, False]
+    assert result.masks['power_range'].tolist() == [False, True, True, False]
+    assert np.isnan(columns['heart_rate'][1]) and columns['power'][3] == 3000
+    assert result.masks['timestamp_duplicate'].tolist() == [False, True, False, False]
+    assert result.masks['timestamp_backwards'].tolist() == [False, False, True, False]
+    assert result.masks['timestamp_missing'].tolist() == [False, False, False, True]
+    # values out of range leave the position valid
+    assert result.position_valid.all()
+
+
+def test_validate_track_cleans_records():
+    records = [
+        {'coordinate': {'timestamp': 1, 'longitude': 2.35, 'latitude': 48.85, 'altitude': 35},
+         'physiologic': {'timestamp': 1, 'heart_rate': 255}},
+        {'coordinate': {'timestamp': 2, 'longitude': 0, 'latitude': 0}},
+        {'coordinate': {'timestamp': 3, 'longitude': 2 ** 30, 'latitude': 2 ** 29, 'altitude': 20000}},
+        {'environment': {'timestamp': 4, 'temperature': 21}},
+    ]
+    result = validate_track(records)
+    assert result.counts['null_island'] == 1 and result.counts['position_missing'] == 1
+    assert records[0]['physiologic']['heart_rate'] is None
+    assert records[0]['coordinate']['altitude'] == 35
+    assert 'coordinate' not in records[1]
+    assert records[2]['coordinate']['longitude'] == 90.0 and records[2]['coordinate']['altitude'] is None
+    assert records[3]['environment']['temperature'] == 21
+    assert 'timestamp_backwards' not in result.masks
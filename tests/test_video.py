@@ -0,0 +1,71 @@
+import pytest
+
+from app.parse import video
+from app.parse.parsers import VideoParser
+from app.parse.source import ParseSource
+from app.settings import VIDEO
+from benchmarks.fixtures import make_mp4, write_mp4
+from benchmarks.stages import VideoDecode, VideoParse
+
+START = 1569544331
+
+
+@pytest.fixture(scope='module')
+def mp4(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('video') / 'GX010001.MP4')
+    # the media data is a hole of 64 MB, it is never read
+    write_mp4(path, make_mp4(duration=30, media_size=64 * 1024 ** 2))
+    return path
+
+
+def test_parse_movie(mp4):
+    with ParseSource(mp4).buffer() as buf:
+        metadata, telemetry = video.parse_movie(buf)
+        columns = video.read_telemetry(buf, telemetry, ('GPS5', 'ACCL'), metadata['creation_time'])
+    assert (metadata['brand'], metadata['width'], metadata['height']) == ('mp41', 3840, 2160)
+    assert metadata['duration'] == 30 and len(telemetry) == 1
+    assert columns['GPS5']['values'].shape == (30 * 18, 5) and columns['ACCL']['values'].shape == (30 * 200, 3)
+    assert columns['GPS5']['timestamp'][0] == START and columns['GPS5']['fix'][0] == 3
+
+    gps = video.downsample(columns['GPS5'], 1)
+    assert gps['values'].shape[0] == 30
+    rows = video.gps_rows(gps)
+    assert [row['timestamp'] for row in rows] == list(range(START, START + 30))
+    assert abs(rows[0]['longitude'] - 104.0657) < 1e-3 and abs(rows[0]['latitude'] - 30.6595) < 1e-3
+
+
+def test_no_moov():
+    with pytest.raises(video.VideoParsingError):
+        video.parse_movie(memoryview(b'\x00\x00\x00\x10ftypmp41\x00\x00\x00\x00'))
+
+
+def test_video_parser(mp4):
+    result = VideoParser(mp4).parse()
+    assert len(result['activity_records']) == 30
+    assert result['activity_records'][0]['coordinate']['timestamp'] == START
+    assert len(result['telemetry']['ACCL']['values']) == 30 * 10
+    assert result['validation']['valid'] == 30
+
+
+def test_video_parser_every_gps_point(mp4, monkeypatch):
+    monkeypatch.setitem(VIDEO, 'GPS_RATE', None)
+    result = VideoParser(mp4).parse()
+    timestamps = [i['coordinate']['timestamp'] for i in result['activity_records']]
+    assert len(timestamps) == 30 * 18 and timestamps == sorted(set(timestamps))
+    assert timestamps[1] - timestamps[0] == pytest.approx(1 / 18, abs=1e-3)
+    assert 'timestamp_duplicate' not in result['validation']['issues']
+
+
+def test_unfinished_recording(tmp_path):
+    parts = make_mp4(duration=5)
+    path = tmp_path / 'unfinished.mp4'
+    path.write_bytes(b''.join(parts[:2] + parts[3:-1]))
+    with pytest.raises(VideoParser.FileParsingError):
+        VideoParser(str(path)).parse()
+
+
+def test_benchmark_stages(mp4):
+    for stage in (VideoDecode, VideoParse):
+        stage = stage({'video': [mp4]})
+        stage.setup()
+        assert stage.run() == 1